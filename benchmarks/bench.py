@@ -0,0 +1,684 @@
+"""Benchmarks of the likelihood, priors, kicks model, processing of the chain, summaries,
+reweighting, writes of the chain and initial walkers
+
+Every benchmark runs on fixed-seed synthetic walker positions, drawn uniformly inside the
+`initialGuess` ranges of the configuration, or on a small synthetic chain written to a temporary
+HDF5 file, so they can be run offline and always do the same work. For each one it reports calls
+per second (best of `--repeat` timed runs), time per call and peak memory allocated during a run (as
+traced by `tracemalloc`), and the time spent in each module by the likelihood (from `cProfile`)
+
+The start of the command line modules (`python -m <module> --help`), which sweeps & MPI workers
+do over and over, is also timed. It must stay below `--startup-budget` seconds, and those modules
+must not import `emcee`, `scipy.stats` nor `poskiorb` until they are used
+
+Results are compared against a baseline stored in JSON, and the run fails if the throughput of any
+benchmark drops by more than `--tolerance`. Baselines depend on the machine, so record one before
+changing the code:
+
+    make bench-baseline    # run benchmarks and save results to benchmarks/baseline.json
+    make bench             # run benchmarks and compare them against the baseline
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import argparse
+import contextlib
+import cProfile
+import io
+import json
+import platform
+import pstats
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from pathlib import Path
+
+import emcee
+import numpy as np
+import yaml
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.append(str(ROOT))
+from src.data import make_dataset  # noqa: E402
+from src.models.mcmc import (  # noqa: E402
+    backends,
+    initialization,
+    kicks,
+    likelihood,
+    priors,
+    profiling,
+    reweight,
+    summaries,
+)
+from src.models.mcmc.mcmc import likelihood_context, load_yaml  # noqa: E402
+
+BASELINE = ROOT / "benchmarks/baseline.json"
+
+# command line modules, started over and over by sweeps & MPI workers
+COMMANDS = (
+    "src.models.mcmc.mcmc",
+    "src.models.mcmc.sweep",
+    "src.models.mcmc.montecarlo",
+    "src.models.mcmc.summaries",
+    "src.models.mcmc.reweight",
+    "src.data.make_dataset",
+)
+
+# modules that take long to import, which the command line modules only import when they are used
+HEAVY_MODULES = ("emcee", "scipy.stats", "poskiorb")
+
+# `lg_prior_*` function of each one of the `priorDistributions` options
+LG_PRIORS = {
+    "p_orb": priors.lg_prior_porb,
+    "e": priors.lg_prior_ecc,
+    "m2": priors.lg_prior_m2,
+    "v_sys": priors.lg_prior_vsys,
+    "i": priors.lg_prior_inc,
+    "m_bh": priors.lg_prior_mbh,
+}
+
+# a benchmark is a function with no arguments and the number of calls it does
+Benchmark = Tuple[Callable[[], Any], int]
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        description="benchmark likelihood, priors, kicks model & processing of the chain",
+        epilog="@asimazbunzel on GitHub",
+    )
+    parser.add_argument(
+        "-C",
+        "--config-file",
+        dest="config_file",
+        default=str(ROOT / "config/mcmc-config.yml"),
+        help="configuration with the stellar parameters, priors & walker ranges to use",
+        type=str,
+    )
+    parser.add_argument(
+        "-b",
+        "--baseline",
+        dest="baseline",
+        default=str(BASELINE),
+        help="JSON file with the baseline results",
+        type=str,
+    )
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        default=False,
+        dest="save",
+        help="save results as the new baseline instead of comparing against it",
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        dest="tolerance",
+        default=0.25,
+        help="largest relative drop of calls per second allowed against the baseline",
+        type=float,
+    )
+    parser.add_argument(
+        "-r",
+        "--repeat",
+        dest="repeat",
+        default=5,
+        help="number of timed runs of each benchmark, the fastest one is kept",
+        type=int,
+    )
+    parser.add_argument(
+        "-n",
+        "--walkers",
+        dest="walkers",
+        default=2000,
+        help="number of synthetic walker positions",
+        type=int,
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        dest="seed",
+        default=1234,
+        help="seed of the synthetic walkers & chain",
+        type=int,
+    )
+    parser.add_argument(
+        "--startup-budget",
+        dest="startup_budget",
+        default=0.5,
+        help="longest time allowed to start a command line module (with `--help`), in seconds",
+        type=float,
+    )
+    parser.add_argument(
+        "-k",
+        "--kick-kernel",
+        dest="kick_kernel",
+        default=None,
+        choices=list(kicks.KERNELS),
+        help="kicks model used by the likelihood (default: the one of the configuration)",
+        type=str,
+    )
+
+    return parser.parse_args()
+
+
+def synthetic_walkers(config: Dict[str, Any], nwalkers: int, seed: int) -> np.ndarray:
+    """Walker positions drawn uniformly inside the `initialGuess` ranges of a configuration"""
+
+    guess = config["MCMC"]["initialGuess"]
+    names = ("porb_preSN", "m1_preSN", "m2", "w", "theta", "phi")
+    lo = np.array([guess[f"{name}_lo"] for name in names])
+    hi = np.array([guess[f"{name}_hi"] for name in names])
+
+    return np.random.default_rng(seed).uniform(lo, hi, size=(nwalkers, len(names)))
+
+
+def write_synthetic_chain(
+    filename: str,
+    config: Dict[str, Any],
+    kwargs: Dict[str, Any],
+    nwalkers: int,
+    nsteps: int,
+    seed: int,
+    blobs: bool = True,
+) -> None:
+    """Write a chain of synthetic walkers, with or without blobs, to an `emcee` HDF5 backend"""
+
+    chain = synthetic_walkers(config, nwalkers * nsteps, seed).reshape(nsteps, nwalkers, -1)
+
+    backend = emcee.backends.HDFBackend(filename)
+    backend.reset(nwalkers, chain.shape[-1])
+    backend.grow(nsteps, np.zeros(nwalkers, dtype=likelihood.BLOBS_DTYPE) if blobs else None)
+    random_state = np.random.RandomState(seed).get_state()
+
+    for coords in chain:
+        results = likelihood.log_likelihood_batch(coords, **kwargs)
+        log_prob = np.array([result[0] for result in results])
+        state = emcee.State(coords, log_prob=log_prob, random_state=random_state)
+        if blobs:
+            state.blobs = np.array([result[1:] for result in results], dtype=likelihood.BLOBS_DTYPE)
+        backend.save_step(
+            state,
+            np.ones(nwalkers, dtype=bool),
+        )
+
+
+def likelihood_benchmarks(kwargs: Dict[str, Any], walkers: np.ndarray) -> Dict[str, Benchmark]:
+    """Scalar (one walker per call, as in `vectorize: False`) & batch versions of the likelihood"""
+
+    def scalar() -> None:
+        for walker in walkers:
+            likelihood.log_likelihood(walker, **kwargs)
+
+    def batch() -> None:
+        likelihood.log_likelihood_batch(walkers, **kwargs)
+
+    return {
+        "likelihood.log_likelihood": (scalar, len(walkers)),
+        "likelihood.log_likelihood_batch": (batch, len(walkers)),
+    }
+
+
+def prior_benchmarks(kwargs: Dict[str, Any], seed: int, ndraws: int) -> Dict[str, Benchmark]:
+    """`lg_prior_*` functions (one value per call) & prior evaluators of `priors.build_priors`
+    (all values at once), on values drawn around each stellar parameter
+    """
+
+    rng = np.random.default_rng(seed)
+    prior_set = kwargs["prior_set"]
+
+    benchmarks: Dict[str, Benchmark] = dict()
+    for key, parameter in priors.PRIOR_PARAMETERS.items():
+        if key not in prior_set:
+            continue
+
+        value, error = kwargs[parameter], kwargs[f"{parameter}_ERR"]
+        values = rng.normal(value, error, ndraws)
+        lg_prior = LG_PRIORS[key]
+        # arguments of the `lg_prior_*` functions, as the likelihood used to call them
+        args = (value, kwargs[key])
+        loc_scale = {"loc": value, "scale": error}
+
+        def legacy(
+            lg_prior: Callable[..., Any] = lg_prior,
+            values: np.ndarray = values,
+            args: Tuple[Any, ...] = args,
+            loc_scale: Dict[str, float] = loc_scale,
+        ) -> None:
+            for x in values:
+                lg_prior(x, *args, **loc_scale)
+
+        def built(prior: priors.Prior = prior_set[key], values: np.ndarray = values) -> None:
+            prior(values)
+
+        benchmarks[f"priors.{lg_prior.__name__}"] = (legacy, ndraws)
+        benchmarks[f"priors.build_priors.{key}"] = (built, ndraws)
+
+    return benchmarks
+
+
+def kick_benchmarks(kwargs: Dict[str, Any], walkers: np.ndarray) -> Dict[str, Benchmark]:
+    """Every available kicks model, one binary per call (as in `log_likelihood`) & all at once"""
+
+    period, m1, m2, w, theta, phi = walkers.T
+    m_bh = kwargs["M_BH"]
+
+    benchmarks: Dict[str, Benchmark] = dict()
+    for name, kernel in kicks.KERNELS.items():
+        try:
+            kernel(period[:1], m1[:1], m2[:1], m_bh, w[:1], theta[:1], phi[:1])
+        except ImportError:
+            print(f"skipping `{name}` kicks model, not installed")
+            continue
+
+        def scalar(kernel: Callable[..., Any] = kernel) -> None:
+            # one-element arrays, as in `log_likelihood`
+            for period_k, m1_k, m2_k, w_k, theta_k, phi_k in walkers[:, :, np.newaxis]:
+                kernel(period_k, m1_k, m2_k, m_bh, w_k, theta_k, phi_k)
+
+        def batch(kernel: Callable[..., Any] = kernel) -> None:
+            kernel(period, m1, m2, m_bh, w, theta, phi)
+
+        benchmarks[f"kicks.{name}"] = (scalar, len(period))
+        benchmarks[f"kicks.{name}.batch"] = (batch, len(period))
+
+    return benchmarks
+
+
+def processing_benchmarks(
+    config: Dict[str, Any], kwargs: Dict[str, Any], tmpdir: Path, seed: int
+) -> Dict[str, Benchmark]:
+    """`make_dataset.main` on a synthetic chain, with blobs & recomputing the kicks model"""
+
+    nwalkers, nsteps, nburn = 16, 200, 50
+    # same chain without blobs, to process it by evaluating the kicks model again
+    chain = str(tmpdir / "chain.h5")
+    chain_no_blobs = str(tmpdir / "chain-no-blobs.h5")
+    write_synthetic_chain(chain, config, kwargs, nwalkers, nsteps, seed)
+    write_synthetic_chain(chain_no_blobs, config, kwargs, nwalkers, nsteps, seed, blobs=False)
+
+    benchmarks: Dict[str, Benchmark] = dict()
+    for name, filename in (
+        ("make_dataset.main", chain),
+        ("make_dataset.main.recompute", chain_no_blobs),
+    ):
+        processing_config = {
+            "MCMC": {
+                "steps": nsteps,
+                "burn": nburn,
+                "filename": filename,
+                "processed_filename": str(tmpdir / "processed.h5"),
+                "chunk_steps": 40,
+                "priorDistributions": config["MCMC"]["priorDistributions"],
+                "kick_kernel": kwargs["kick_kernel"],
+            },
+            "StellarParameters": config["StellarParameters"],
+        }
+        config_file = tmpdir / f"{name}.yml"
+        with open(config_file, "w") as f:
+            yaml.safe_dump(processing_config, f)
+
+        def process(config_file: Path = config_file) -> None:
+            with contextlib.redirect_stdout(io.StringIO()):
+                make_dataset.main(config_file=str(config_file), workers=1, seed=seed)
+
+        benchmarks[name] = (process, nsteps - nburn - 1)
+
+    return benchmarks
+
+
+def summaries_benchmarks(kwargs: Dict[str, Any], walkers: np.ndarray) -> Dict[str, Benchmark]:
+    """Update of the streaming summaries of the posterior with one step of walkers, as done by
+    `mcmc.py` after every step
+    """
+
+    results = likelihood.log_likelihood_batch(walkers, **kwargs)
+    log_prob = np.array([result[0] for result in results])
+    blobs = np.array([result[1:] for result in results], dtype=likelihood.BLOBS_DTYPE)
+    posterior = summaries.PosteriorSummaries()
+
+    def update() -> None:
+        posterior.update_samples(walkers, log_prob, blobs)
+
+    return {"summaries.update": (update, len(walkers))}
+
+
+def reweight_benchmarks(
+    config: Dict[str, Any], kwargs: Dict[str, Any], walkers: np.ndarray
+) -> Dict[str, Benchmark]:
+    """Weights of the walkers that reach the kicks model for a narrower prior on v_sys, as done by
+    `reweight.py` over the rows of a processed file
+    """
+
+    observables = likelihood.evaluate_batch(walkers, **kwargs)
+    observables["m2"] = walkers[:, 2]
+    keep = np.isfinite(observables["p_post"])
+    rows = {column: observables[column][keep] for column in reweight.PRIOR_COLUMNS.values()}
+    new_config = yaml.safe_load(yaml.safe_dump(config))
+    new_config["StellarParameters"]["VSYS_ERR"] /= 2
+
+    def weights() -> None:
+        reweight.log_weights(config, new_config, rows)
+
+    return {"reweight.log_weights": (weights, int(keep.sum()))}
+
+
+def backend_benchmarks(
+    kwargs: Dict[str, Any], walkers: np.ndarray, tmpdir: Path
+) -> Dict[str, Benchmark]:
+    """Steps of a chain with blobs saved by `emcee.backends.HDFBackend`, which writes each one to
+    the file, and by `backends.BufferedHDFBackend`, which writes them in blocks from a thread
+    """
+
+    nsteps = 200
+    results = likelihood.log_likelihood_batch(walkers, **kwargs)
+    log_prob = np.array([result[0] for result in results])
+    blobs = np.array([result[1:] for result in results], dtype=likelihood.BLOBS_DTYPE)
+    state = emcee.State(walkers, log_prob=log_prob, blobs=blobs)
+    state.random_state = np.random.RandomState(0).get_state()
+    accepted = np.ones(len(walkers), dtype=bool)
+
+    def save(backend: emcee.backends.HDFBackend) -> None:
+        backend.reset(*walkers.shape)
+        backend.grow(nsteps, blobs)
+        for _ in range(nsteps):
+            backend.save_step(state, accepted)
+        if isinstance(backend, backends.BufferedHDFBackend):
+            backend.close()
+
+    emcee_backend = emcee.backends.HDFBackend(str(tmpdir / "emcee-backend.h5"))
+    buffered_backend = backends.BufferedHDFBackend(str(tmpdir / "buffered-backend.h5"))
+
+    return {
+        "backends.HDFBackend.save_step": (lambda: save(emcee_backend), nsteps),
+        "backends.BufferedHDFBackend.save_step": (lambda: save(buffered_backend), nsteps),
+    }
+
+
+def initialization_benchmarks(
+    config: Dict[str, Any], kwargs: Dict[str, Any], nwalkers: int, seed: int
+) -> Dict[str, Benchmark]:
+    """Ball of walkers with a finite likelihood around the best of a random search, as done by
+    `mcmc.initial_walkers` around the MAP with `use_random_uniform_walkers: False`
+    """
+
+    def log_prob_fn(params: np.ndarray) -> np.ndarray:
+        return likelihood.evaluate_batch(params, **kwargs)["log_L"]
+
+    options = initialization.initialization_options(config["MCMC"].get("initialization"))
+    _, lo, hi = initialization.guess_bounds(config["MCMC"]["initialGuess"], options["bounds"])
+    points, _, _ = initialization.random_search(
+        log_prob_fn, lo, hi, 1, np.random.default_rng(seed), batch=nwalkers
+    )
+
+    def ball() -> None:
+        initialization.finite_ball(
+            log_prob_fn,
+            points[0],
+            options["ball_scale"] * (hi - lo),
+            lo,
+            hi,
+            nwalkers,
+            np.random.default_rng(seed),
+            batch=nwalkers,
+        )
+
+    return {"initialization.finite_ball": (ball, nwalkers)}
+
+
+def startup_benchmarks(repeat: int) -> Tuple[Dict[str, Dict[str, float]], Dict[str, List[str]]]:
+    """Time to start each one of `COMMANDS` in a new interpreter, and heavy modules it imports
+
+    Startup time is the wall time of `python -m <module> --help`, best of `repeat` runs. The
+    modules imported are the ones of `HEAVY_MODULES` found in `sys.modules` right after importing
+    the command line module
+
+    Returns
+    -------
+    results : `Dict[str, Dict[str, float]]`
+        Starts per second & seconds per start of each module, as in `time_benchmark`
+
+    heavy : `Dict[str, List[str]]`
+        Modules of `HEAVY_MODULES` imported by each module
+    """
+
+    results: Dict[str, Dict[str, float]] = dict()
+    heavy: Dict[str, List[str]] = dict()
+    for module in COMMANDS:
+        times = list()
+        for _ in range(max(repeat, 1)):
+            start = time.perf_counter()
+            subprocess.run(
+                [sys.executable, "-m", module, "--help"], cwd=ROOT, check=True, capture_output=True
+            )
+            times.append(time.perf_counter() - start)
+        best = min(times)
+        results[f"startup.{module}"] = {"calls_per_sec": 1 / best, "sec_per_call": best}
+
+        check = (
+            f"import importlib, sys; importlib.import_module('{module}'); "
+            f"print(' '.join(name for name in {HEAVY_MODULES} if name in sys.modules))"
+        )
+        output = subprocess.run(
+            [sys.executable, "-c", check], cwd=ROOT, check=True, capture_output=True, text=True
+        )
+        heavy[module] = output.stdout.split()
+
+    return results, heavy
+
+
+def time_benchmark(fn: Callable[[], Any], ncalls: int, repeat: int) -> Dict[str, float]:
+    """Calls per second, time per call & peak memory of a benchmark
+
+    Each timed run loops over the benchmark for at least 0.2 seconds (as `timeit` does), and the
+    fastest of `repeat` runs is kept, to reduce noise from other processes
+    """
+
+    timer = timeit.Timer(fn)
+    # also a warm-up, so that lazy imports & caches do not count
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "calls_per_sec": ncalls / best,
+        "sec_per_call": best / ncalls,
+        "peak_memory_kB": peak / 1024,
+    }
+
+
+def time_breakdown(fn: Callable[[], Any]) -> Dict[str, float]:
+    """Fraction of the time of a benchmark spent inside each module (own time, from `cProfile`)"""
+
+    profiler = cProfile.Profile()
+    profiler.runcall(fn)
+
+    return profiling.time_by_component(pstats.Stats(profiler))
+
+
+def compare(
+    results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], tolerance: float
+) -> List[str]:
+    """Names of the benchmarks whose calls per second dropped by more than `tolerance`"""
+
+    regressions = list()
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["calls_per_sec"] / baseline[name]["calls_per_sec"]
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+
+    return regressions
+
+
+def main(
+    config_file: str,
+    baseline_file: str = str(BASELINE),
+    save: bool = False,
+    tolerance: float = 0.25,
+    repeat: int = 5,
+    nwalkers: int = 2000,
+    seed: int = 1234,
+    kick_kernel: Optional[str] = None,
+    startup_budget: float = 0.5,
+) -> int:
+    """Run every benchmark and compare results against (or save them as) the baseline
+
+    Parameters
+    ----------
+    config_file : `str`
+        Configuration with the stellar parameters, priors & ranges of the walkers
+
+    baseline_file : `str`
+        JSON file with the baseline results
+
+    save : `bool`
+        Flag to save results as the new baseline instead of comparing against it
+
+    tolerance : `float`
+        Largest relative drop of calls per second allowed against the baseline
+
+    repeat : `int`
+        Number of timed runs of each benchmark
+
+    nwalkers : `int`
+        Number of synthetic walker positions
+
+    seed : `int`
+        Seed of the synthetic walkers & chain
+
+    kick_kernel : `str`
+        Kicks model used by the likelihood, the one of the configuration if None
+
+    startup_budget : `float`
+        Longest time allowed to start a command line module, in seconds
+
+    Returns
+    -------
+    status : `int`
+        1 if any benchmark regressed, or if a command line module takes longer than
+        `startup_budget` to start or imports any of `HEAVY_MODULES`, 0 otherwise
+    """
+
+    config = load_yaml(config_file)
+    if kick_kernel is not None:
+        config["MCMC"]["kick_kernel"] = kick_kernel
+    kwargs = likelihood_context(config)
+    walkers = synthetic_walkers(config, nwalkers, seed)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        benchmarks: Dict[str, Benchmark] = dict()
+        benchmarks.update(likelihood_benchmarks(kwargs, walkers))
+        benchmarks.update(prior_benchmarks(kwargs, seed, nwalkers))
+        benchmarks.update(kick_benchmarks(kwargs, walkers))
+        benchmarks.update(processing_benchmarks(config, kwargs, Path(tmpdir), seed))
+        benchmarks.update(summaries_benchmarks(kwargs, walkers))
+        benchmarks.update(reweight_benchmarks(config, kwargs, walkers))
+        benchmarks.update(backend_benchmarks(kwargs, walkers, Path(tmpdir)))
+        benchmarks.update(initialization_benchmarks(config, kwargs, nwalkers, seed))
+
+        results = dict()
+        print(f"{'benchmark':<40s} {'calls/s':>12s} {'μs/call':>10s} {'peak kB':>10s}")
+        for name, (fn, ncalls) in benchmarks.items():
+            results[name] = time_benchmark(fn, ncalls, repeat)
+            print(
+                f"{name:<40s} {results[name]['calls_per_sec']:>12.1f} "
+                f"{1e6 * results[name]['sec_per_call']:>10.2f} "
+                f"{results[name]['peak_memory_kB']:>10.1f}"
+            )
+
+        breakdowns = {
+            name: time_breakdown(benchmarks[name][0])
+            for name in ("likelihood.log_likelihood", "likelihood.log_likelihood_batch")
+        }
+
+    for name, breakdown in breakdowns.items():
+        print(f"\ntime breakdown of {name}")
+        for component, fraction in breakdown.items():
+            if fraction >= 0.005:
+                print(f"    {component:<20s} {100 * fraction:>6.1f}%")
+
+    # startup of the command line modules, against an absolute budget
+    startup, heavy = startup_benchmarks(repeat)
+    results.update(startup)
+    print(f"\nstartup of command line modules (budget {startup_budget:.2f} s)")
+    over_budget = list()
+    for module in COMMANDS:
+        seconds = startup[f"startup.{module}"]["sec_per_call"]
+        imported = f" :: imports {', '.join(heavy[module])}" if heavy[module] else ""
+        print(f"    {module:<40s} {seconds:>6.3f} s{imported}")
+        if seconds > startup_budget or heavy[module]:
+            over_budget.append(module)
+
+    report = {
+        "metadata": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "kick_kernel": kwargs["kick_kernel"],
+            "walkers": nwalkers,
+            "seed": seed,
+        },
+        "results": results,
+        "breakdowns": breakdowns,
+    }
+
+    status = 0
+    if over_budget:
+        print(f"\nslow startup in: {', '.join(over_budget)}")
+        status = 1
+
+    if save or not Path(baseline_file).exists():
+        with open(baseline_file, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nbaseline saved to `{baseline_file}`")
+        return status
+
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+
+    if baseline["metadata"] != report["metadata"]:
+        print(f"\nwarning: baseline was recorded with different settings: {baseline['metadata']}")
+
+    print(f"\nchange against baseline (tolerance -{100 * tolerance:.0f}%)")
+    for name, result in results.items():
+        if name in baseline["results"]:
+            ratio = result["calls_per_sec"] / baseline["results"][name]["calls_per_sec"]
+            print(f"    {name:<40s} {100 * (ratio - 1):>+7.1f}%")
+
+    regressions = compare(results, baseline["results"], tolerance)
+    if regressions:
+        print(f"\nthroughput regressed in: {', '.join(regressions)}")
+        return 1
+
+    if status == 0:
+        print("\nno regressions")
+    return status
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    sys.exit(
+        main(
+            config_file=args.config_file,
+            baseline_file=args.baseline,
+            save=args.save,
+            tolerance=args.tolerance,
+            repeat=args.repeat,
+            nwalkers=args.walkers,
+            seed=args.seed,
+            kick_kernel=args.kick_kernel,
+            startup_budget=args.startup_budget,
+        )
+    )
@@ -1,20 +1,27 @@
 """Modify MCMC chain to burn first few steps and compute post-collapse parameters"""
 
 
+from typing import Any, Dict, Optional, Tuple, Union
+
 import argparse
 import logging
+import multiprocessing
 from pathlib import Path
-import sys
-from typing import Any, Union
 
-import emcee
 import h5py
 import numpy as np
-import poskiorb
 import yaml
 
-sys.path.append("src/models/mcmc")
-from likelihood import log_likelihood
+from ..models.mcmc import profiling
+from ..models.mcmc.likelihood import evaluate_batch
+from ..models.mcmc.tables import (
+    TABLES,
+    chunk_bounds,
+    observables_from_blobs,
+    open_tables,
+    read_chunk,
+    stack_rows,
+)
 
 
 def parse_args() -> argparse.Namespace:
@@ -31,6 +38,30 @@ def parse_args() -> argparse.Namespace:
         help="YAML-format configuration filename",
         type=str,
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        help="number of processes used to process the chain",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        dest="seed",
+        help="seed of the random subsample of the chain (random if not given)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        dest="profile",
+        help="profile the main process & every worker, merging their stats into a report written "
+        "to a `.profile` directory next to the processed file",
+    )
 
     return parser.parse_args()
 
@@ -55,20 +86,100 @@ def load_yaml(fname: Union[str, Path]) -> Any:
         return yaml.load(f, Loader=yaml.FullLoader)
 
 
-def main(config_file: str = "") -> None:
+def process_samples(samples: np.ndarray, kwargs: Dict[str, Any]) -> Tuple[np.ndarray, ...]:
+    """Compute post-collapse parameters of a set of MCMC samples
+
+    Angles are brought inside their limits, 0 < theta < pi and 0 < phi < 2 * pi, the same way the
+    likelihood does, and all values are computed in a single vectorized pass
+
+    Parameters
+    ----------
+    samples : `np.ndarray`
+        Samples of the chain, with shape (n, 6)
+
+    kwargs : `Dict[str, Any]`
+        Stellar parameters of Cygnus X-1 and prior distributions
+
+    Returns
+    -------
+    samples_pre : `np.ndarray`
+        Pre-CC values of samples with finite likelihood: p, a, m1, m2, w, theta, phi
+
+    samples_post : `np.ndarray`
+        Post-CC values of samples with finite likelihood: p, e, i, v_sys, log_L
+    """
+
+    return stack_rows(samples, evaluate_batch(samples, **kwargs))
+
+
+def process_chunk(
+    task: Tuple[str, int, int, int, np.random.SeedSequence, Dict[str, Any]]
+) -> Tuple[np.ndarray, ...]:
+    """Subsample a chunk of the chain and get its post-collapse parameters, from the blobs stored
+    in the chain when available
+
+    Each chunk draws its subsample with its own seed, so the result of a chunk does not depend on
+    which process handles it nor on the order in which chunks are processed
+
+    Parameters
+    ----------
+    task : `Tuple`
+        Name of the chain file, first and last (excluded) step of the chunk, number of samples to
+        take from it, seed of the subsample and keyword arguments of `process_samples`
+
+    Returns
+    -------
+    samples_pre, samples_post : `np.ndarray`
+        Same output as `process_samples`
+    """
+
+    filename, start, stop, quota, seed, kwargs = task
+
+    samples, log_prob, blobs = read_chunk(filename, start, stop)
+    rng = np.random.default_rng(seed)
+    idx = np.sort(rng.choice(samples.shape[0], quota, replace=False))
+
+    # chains stored without blobs need to evaluate the kicks model again
+    if blobs is None:
+        return process_samples(samples[idx], kwargs)
+
+    return stack_rows(samples[idx], observables_from_blobs(samples[idx], log_prob[idx], blobs[idx]))
+
+
+def main(
+    config_file: str = "", workers: int = 1, seed: Optional[int] = None, profile: bool = False
+) -> None:
     """Runs data processing scripts to turn raw data into cleaned data
 
+    The chain is read in chunks of steps, so that memory usage does not depend on its length.
+    A uniform random subsample (without replacement) of the burned chain is drawn by splitting
+    its size among chunks with a multivariate hypergeometric draw, and then choosing that many
+    samples inside each chunk. Chunks are processed by a pool of `workers` processes and their
+    results are appended to the processed file in the order of the chain
+
+    Every chunk has its own seed, spawned from `seed`, so that the processed file only depends on
+    `seed` and not on the number of workers
+
+    The processed file has named columns, stored with the layout, codec & precision of the
+    `processed` options of the configuration (see `src/models/mcmc/tables.py`)
+
     Parameters
     ----------
     config_file : `str`
         Configuration filename
 
-    output_filename : `str`
-        Processed data filename
+    workers : `int`
+        Number of processes computing post-collapse parameters
+
+    seed : `int`
+        Seed of the random subsample. If None, a random one is used and printed
+
+    profile : `bool`
+        Flag to profile this process & the workers (see `profiling.py`)
     """
     logger = logging.getLogger(__name__)
     logger.info("making final data set from raw data")
-    
+
     # load config file
     config = load_yaml(fname=config_file)
 
@@ -77,94 +188,89 @@ def main(config_file: str = "") -> None:
     nburn = config["MCMC"].get("burn")
     filename = config["MCMC"].get("filename")
     output_filename = config["MCMC"].get("processed_filename")
+    chunk_steps = config["MCMC"].get("chunk_steps", 1000)
+    # layout, codec & precision of the processed file
+    storage = config["MCMC"].get("processed")
     priorsD = config["MCMC"].get("priorDistributions")
     # Cygnus X-1 properties
     stellarParameters = config["StellarParameters"]
 
-    # load samples & remove burned steps
-    print("loading MCMC chain and burning steps", end="... ")
-    reader = emcee.backends.HDFBackend(filename, read_only=True)
-    samples = reader.get_chain(flat=True, discard=nburn)
-    limit_to = (nsteps - nburn) - 1
-    samples_r = samples[np.random.choice(samples.shape[0], limit_to, replace=False), :]
-    print("done !")
-    print("samples pre-CC shape:", samples_r.shape, type(samples_r))
-    
     kwargs = dict()
     kwargs.update(stellarParameters)
     kwargs.update(priorsD)
+    # kicks model, only evaluated for chains stored without blobs
+    kwargs["kick_kernel"] = config["MCMC"].get("kick_kernel", "poskiorb")
+
+    # one seed for the split among chunks and one for each chunk
+    seed_sequence = np.random.SeedSequence(seed)
+    print("seed of random subsample:", seed_sequence.entropy)
+    bounds, nwalkers = chunk_bounds(filename, nburn, chunk_steps)
+    split_seed, *chunk_seeds = seed_sequence.spawn(len(bounds) + 1)
+
+    # number of samples to take from each chunk of the burned chain
+    sizes = np.array([(stop - start) * nwalkers for start, stop in bounds], dtype=np.int64)
+    limit_to = min((nsteps - nburn) - 1, int(sizes.sum()))
+    quotas = np.random.default_rng(split_seed).multivariate_hypergeometric(sizes, limit_to)
+    print("samples pre-CC to process:", limit_to, "in", len(sizes), "chunks")
+
+    tasks = [
+        (filename, start, stop, int(quota), chunk_seed, kwargs)
+        for (start, stop), quota, chunk_seed in zip(bounds, quotas, chunk_seeds)
+        if quota > 0
+    ]
 
     # evaluate kicks model
-    print("computing binary stellar parameters after kick", end="... ", flush=True)
-    samples1, samples2 = [], []
-    for k in range(len(samples_r)):
-        # replace values of theta and phi outside of boundaries:
-        # 0 < theta < pi, and 0 < phi < 2 * pi
-        theta = samples_r[k, 4]
-        phi = samples_r[k, 5] % (2 * np.pi)
-
-        samples_r[k, 5] = phi
-        if theta < 0 or theta > np.pi:
-            theta = np.pi - (theta % np.pi)
-        samples_r[k, 4] = theta
-
-        # compute new orbit after kick
-        (
-            a_post,
-            p_post,
-            e,
-            cos_i,
-            v_sys,
-            _,
-            _,
-            _,
-            _,
-        ) = poskiorb.utils.binary_orbits_after_kick(
-            a=poskiorb.utils.P_to_a(samples_r[k, 0], samples_r[k, 1], samples_r[k, 2]),
-            m1=samples_r[k, 1],
-            m2=samples_r[k, 2],
-            m1_remnant_mass=kwargs["M_BH"],
-            w=samples_r[k, 3],
-            theta=samples_r[k, 4],
-            phi=samples_r[k, 5],
-            ids=np.ones(1),
-        )
-
-        # compute likelihood
-        args = [
-            samples_r[k, 0],
-            samples_r[k, 1],
-            samples_r[k, 2],
-            samples_r[k, 3],
-            samples_r[k, 4],
-            samples_r[k, 5],
-        ]
-        ll = log_likelihood(args, **kwargs)
-
-        if not np.isfinite(ll):
-            continue
-
-        samples1.append(
-            [float(samples_r[k,0]), float(poskiorb.utils.P_to_a(samples_r[k, 0], samples_r[k, 1], samples_r[k, 2])),
-             float(samples_r[k,1]), float(samples_r[k,2]), float(samples_r[k,3]), float(samples_r[k,4]), float(samples_r[k,5])]
-        )
-        samples2.append(
-            [float(p_post), float(e), np.rad2deg(np.arccos(float(cos_i))), float(v_sys), ll]
-        )
-    print("done !")
-
-    # use numpy arrays
-    samples_pre = np.asarray(samples1)
-    samples_post = np.asarray(samples2)
-    print("sample shapes pre, post-CC:", samples_pre.shape, samples_post.shape)
-
-    with h5py.File(output_filename, "w") as f:
-        f.create_dataset("mcmc/pre-cc", data=samples_pre, compression="gzip")
-        f.create_dataset("mcmc/post-cc", data=samples_post, compression="gzip")
+    print(
+        f"computing binary stellar parameters after kick ({workers} workers)",
+        end="... ",
+        flush=True,
+    )
+    # profiles of this process & of the workers, merged once the data set is written
+    profile_dir = None
+    if profile:
+        profile_dir = profiling.profile_directory(output_filename)
+        profiling.reset(profile_dir)
+
+    with profiling.profiled(profile_dir), h5py.File(output_filename, "w") as f:
+        tables = open_tables(f, TABLES, storage)
+
+        if workers > 1:
+            initializer = None if profile_dir is None else profiling.init_worker
+            with multiprocessing.Pool(
+                workers, initializer=initializer, initargs=(profile_dir,)
+            ) as pool:
+                # `imap` gives results in the order of the tasks
+                for samples_pre, samples_post in pool.imap(process_chunk, tasks):
+                    tables["pre-cc"].append(samples_pre)
+                    tables["post-cc"].append(samples_post)
+                # let workers exit on their own, writing their profiles
+                pool.close()
+                pool.join()
+        else:
+            for samples_pre, samples_post in map(process_chunk, tasks):
+                tables["pre-cc"].append(samples_pre)
+                tables["post-cc"].append(samples_post)
+
+        for table in tables.values():
+            table.close()
+
+        print("done !")
+        print("samples pre, post-CC:", tables["pre-cc"].nrows, tables["post-cc"].nrows)
+
+    if profile_dir is not None:
+        for line in profiling.write_report(profile_dir):
+            print(line)
+        print(f"profile report written to `{profile_dir}`")
+
+
+def cli() -> None:
+    """Entry point of the command line"""
 
-if __name__ == "__main__":
-    
     # parse command line arguments
     args = parse_args()
 
-    main(config_file=args.config_file)
+    main(config_file=args.config_file, workers=args.workers, seed=args.seed, profile=args.profile)
+
+
+if __name__ == "__main__":
+    cli()
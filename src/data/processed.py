@@ -0,0 +1,143 @@
+"""Reader of processed data sets stored in HDF5 files, with named columns read lazily
+
+A processed file has a `mcmc` group with one table per kind of values, `pre-cc` & `post-cc` (see
+`TABLES` for their columns). Tables are stored in one of two layouts:
+
+- `columns`: the table is a group with one 1-D dataset per column, so that reading a column does
+  not read the other ones. Columns are chunked & compressed with `lzf` or `gzip`, or stored
+  uncompressed & contiguous (codec `none`), in which case `ProcessedData` maps them from the file
+  with `np.memmap` instead of reading them
+- `table`: the table is a single 2-D dataset of rows, as written by older versions of
+  `make_dataset.py`
+
+Values are stored as `float64` or, to halve the size of the file, `float32`. `ProcessedData` reads
+both layouts, so that notebooks do not need to know the order of the columns. Tables are written by
+`src/models/mcmc/tables.py`
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from ..models.mcmc.tables import TABLES
+
+
+class ProcessedData:
+    """Lazy reader of the columns of a processed file
+
+    Only the columns asked for are read. Uncompressed contiguous columns are not even read, but
+    mapped from the file (`np.memmap`), so that only the parts of them actually used are loaded.
+    Tables in the older `table` layout are read column by column too, although reading a column of
+    them decompresses the whole table
+
+    Parameters
+    ----------
+    filename : `str / Path`
+        Name of the processed file
+
+    Examples
+    --------
+    >>> with ProcessedData("data/processed/mcmc_corrected_angles.h5") as data:
+    ...     w = data["w"]
+    ...     chain_pre = data.to_array("pre-cc")
+    """
+
+    def __init__(self, filename: Union[str, Path]) -> None:
+        self.filename = str(filename)
+        self._file = h5py.File(self.filename, "r")
+        self._group = self._file["mcmc"]
+
+    def __enter__(self) -> "ProcessedData":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Close the file. Memory-mapped columns stay valid"""
+
+        self._file.close()
+
+    @property
+    def attrs(self) -> Dict[str, Any]:
+        """Attributes of the `mcmc` group (e.g. the summary of `montecarlo.py`)"""
+
+        return dict(self._group.attrs)
+
+    @property
+    def tables(self) -> List[str]:
+        """Names of the tables of the file"""
+
+        return list(self._group.keys())
+
+    def columns(self, table: str) -> Tuple[str, ...]:
+        """Names of the columns of a table"""
+
+        stored = self._group[table]
+        if "columns" in stored.attrs:
+            return tuple(str(name) for name in stored.attrs["columns"])
+
+        # tables written before columns had names
+        return TABLES[table]
+
+    def column(self, table: str, name: str) -> np.ndarray:
+        """Values of one column of a table
+
+        Parameters
+        ----------
+        table : `str`
+            Name of the table, e.g. `pre-cc`
+
+        name : `str`
+            Name of the column, e.g. `m2`
+
+        Returns
+        -------
+        values : `np.ndarray`
+            Values of the column. A read-only `np.memmap` for uncompressed contiguous columns
+        """
+
+        columns = self.columns(table)
+        if name not in columns:
+            raise KeyError(f"no column `{name}` in table `{table}`, options are: {columns}")
+
+        stored = self._group[table]
+        if isinstance(stored, h5py.Dataset):
+            return stored[:, columns.index(name)]
+
+        dataset = stored[name]
+        offset = dataset.id.get_offset()
+        if dataset.chunks is None and offset is not None:
+            return np.memmap(
+                self.filename, dtype=dataset.dtype, mode="r", offset=offset, shape=dataset.shape
+            )
+
+        return dataset[...]
+
+    def to_array(self, table: str, names: Optional[Sequence[str]] = None) -> np.ndarray:
+        """Columns of a table stacked into an array of shape (n, number of columns), e.g. for
+        corner plots. All columns of the table, in their stored order, if `names` is None
+        """
+
+        if names is None:
+            names = self.columns(table)
+
+        return np.column_stack([self.column(table, name) for name in names])
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        """Column by `table/name`, or only by `name` when no other table has it"""
+
+        if "/" in key:
+            table, name = key.split("/", 1)
+            return self.column(table, name)
+
+        tables = [table for table in self.tables if key in self.columns(table)]
+        if not tables:
+            raise KeyError(f"no column `{key}` in any table")
+        if len(tables) > 1:
+            raise KeyError(f"column `{key}` found in tables {tables}, use `table/{key}`")
+
+        return self.column(tables[0], key)
@@ -0,0 +1,489 @@
+"""Backends of `emcee` used by the MCMC runs
+
+`BufferedHDFBackend` keeps the steps of the sampler in memory and writes them `buffer_steps` at a
+time from a background thread, in chunked datasets, so that the sampler neither opens the file nor
+waits for it at every step. It can also store only one of every `thin` steps. The group of the
+chain has the layout of `emcee.backends.HDFBackend`, whose `iteration` attribute is the number of
+stored rows, plus the `thin` spacing between them and the number of `steps` done by the sampler.
+Row `r` of a thinned chain is the state of the walkers after step `(r + 1) * thin`
+"""
+
+from typing import Any, Dict, List, Mapping, Optional
+
+import atexit
+import concurrent.futures
+import logging
+import time
+import weakref
+
+import emcee
+import h5py
+import numpy as np
+
+from .tables import CODECS
+from .transforms import add_jacobian, to_physical, to_sampled
+
+logger = logging.getLogger("MCMC")
+
+# largest chunk of the chain datasets, in bytes
+_MAX_CHUNK_BYTES = 1 << 20
+
+# backends with steps that may still be in memory, written when the interpreter exits
+_open_backends: "weakref.WeakSet[BufferedHDFBackend]" = weakref.WeakSet()
+
+
+class BufferedHDFBackend(emcee.backends.HDFBackend):
+    """`emcee.backends.HDFBackend` writing its steps in blocks from a background thread
+
+    Steps are copied to buffers in memory. Once `buffer_steps` steps are buffered, they are
+    handed to a writer thread, which appends them to the file in a single write while the sampler
+    goes on filling new buffers. Only one block is written at a time, so memory never holds more
+    than two of them. Counters of the sampler (`iteration`, `accepted` & `random_state`) are kept
+    in memory while sampling, and every read of the chain first writes the buffered steps
+
+    Steps still in memory are written by `close`, by any read of the chain and, if the run ends
+    without calling them, when the interpreter exits. The `iteration` attribute of the file is
+    only updated once the rows it counts are written, so a crash in the middle of a write never
+    exposes half-written rows
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the HDF5 file
+
+    buffer_steps : `int`
+        Number of steps kept in memory between writes
+
+    thin : `int`
+        Only one of every `thin` steps is stored. `iteration`, and the `discard` & `thin`
+        arguments of `get_chain`, `get_log_prob` & `get_blobs`, still count steps of the sampler
+
+    codec : `str`
+        Compression of the stored chain, one of `tables.CODECS`
+
+    kwargs :
+        Other arguments of `emcee.backends.HDFBackend`
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        buffer_steps: int = 100,
+        thin: int = 1,
+        codec: str = "none",
+        **kwargs: Any,
+    ) -> None:
+        if codec not in CODECS:
+            raise ValueError(f"unknown codec `{codec}`, options are: {', '.join(CODECS)}")
+        if buffer_steps < 1 or thin < 1:
+            raise ValueError("`buffer_steps` & `thin` must be positive")
+
+        super().__init__(filename, compression=None if codec == "none" else codec, **kwargs)
+        self.thin = int(thin)
+        self.buffer_rows = -(-int(buffer_steps) // self.thin)
+
+        # counters of the sampler, kept in memory once sampling starts (see `grow`)
+        self._steps: Optional[int] = None
+        self._accepted = np.zeros(0)
+        self._random_state: Any = None
+        self._written_steps = 0
+
+        # buffered rows, and the write running in the background
+        self._nbuffered = 0
+        self._buffers: Dict[str, Optional[np.ndarray]] = dict()
+        self._writer: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._pending: Optional[concurrent.futures.Future] = None
+
+        # bytes & time of every write, and time the sampler waited for the writer
+        self.writes: List[Dict[str, float]] = list()
+        self.wait_time = 0.0
+
+        _open_backends.add(self)
+
+    def open(self, mode: str = "r") -> h5py.File:
+        # the file is only opened by one thread at a time
+        self.wait()
+        return super().open(mode)
+
+    def reset(self, nwalkers: int, ndim: int) -> None:
+        """Clear the state of the chain and empty the backend"""
+
+        self._steps = None
+        self._nbuffered = 0
+
+        with self.open("a") as f:
+            if self.name in f:
+                del f[self.name]
+
+            g = f.create_group(self.name)
+            g.attrs["version"] = emcee.__version__
+            g.attrs["nwalkers"] = nwalkers
+            g.attrs["ndim"] = ndim
+            g.attrs["has_blobs"] = False
+            g.attrs["iteration"] = 0
+            g.attrs["steps"] = 0
+            g.attrs["thin"] = self.thin
+            g.create_dataset("accepted", data=np.zeros(nwalkers))
+            g.create_dataset(
+                "chain",
+                (0, nwalkers, ndim),
+                maxshape=(None, nwalkers, ndim),
+                dtype=self.dtype,
+                chunks=(self._chunk_rows(nwalkers * ndim * 8), nwalkers, ndim),
+                compression=self.compression,
+                compression_opts=self.compression_opts,
+            )
+            g.create_dataset(
+                "log_prob",
+                (0, nwalkers),
+                maxshape=(None, nwalkers),
+                dtype=self.dtype,
+                chunks=(self._chunk_rows(nwalkers * 8), nwalkers),
+                compression=self.compression,
+                compression_opts=self.compression_opts,
+            )
+
+    def _chunk_rows(self, row_bytes: int) -> int:
+        """Rows of a chunk: one write, unless it is larger than `_MAX_CHUNK_BYTES`"""
+
+        return max(min(self.buffer_rows, _MAX_CHUNK_BYTES // max(row_bytes, 1)), 1)
+
+    def grow(self, ngrow: int, blobs: Optional[np.ndarray]) -> None:
+        """Prepare the backend for sampling. Datasets are not grown in advance, but with each write
+
+        Counters of the sampler are loaded from the file (which may have been rolled back to a
+        checkpoint since the backend was created) and kept in memory from then on
+        """
+
+        self._check_blobs(blobs)
+        self.flush(wait=True)
+
+        with self.open("a") as f:
+            g = f[self.name]
+            nwalkers, ndim = int(g.attrs["nwalkers"]), int(g.attrs["ndim"])
+            if blobs is not None and not g.attrs["has_blobs"]:
+                dtype = np.dtype((blobs.dtype, blobs.shape[1:]))
+                g.create_dataset(
+                    "blobs",
+                    (int(g.attrs["iteration"]), nwalkers),
+                    maxshape=(None, nwalkers),
+                    dtype=dtype,
+                    chunks=(self._chunk_rows(nwalkers * dtype.itemsize), nwalkers),
+                    compression=self.compression,
+                    compression_opts=self.compression_opts,
+                )
+                g.attrs["has_blobs"] = True
+
+            self._steps = self._stored_steps(g)
+            self._written_steps = self._steps
+            self._accepted = g["accepted"][...]
+            self._random_state = self._read_random_state(g)
+
+        self._blob_dtype = None if blobs is None else np.dtype((blobs.dtype, blobs.shape[1:]))
+        self._shape = (nwalkers, ndim)
+        self._new_buffers()
+
+    def _stored_steps(self, g: h5py.Group) -> int:
+        """Steps of the sampler stored in the group of a backend"""
+
+        if "steps" in g.attrs:
+            return int(g.attrs["steps"])
+
+        return int(g.attrs["iteration"]) * int(g.attrs.get("thin", 1))
+
+    @staticmethod
+    def _read_random_state(g: h5py.Group) -> Optional[List[Any]]:
+        elements = [v for k, v in sorted(g.attrs.items()) if k.startswith("random_state_")]
+        return elements if len(elements) else None
+
+    def _new_buffers(self) -> None:
+        """Empty buffers for the next block of rows"""
+
+        nwalkers, ndim = self._shape
+        self._buffers = {
+            "chain": np.empty((self.buffer_rows, nwalkers, ndim), dtype=self.dtype),
+            "log_prob": np.empty((self.buffer_rows, nwalkers), dtype=self.dtype),
+            "blobs": None,
+        }
+        if self._blob_dtype is not None:
+            self._buffers["blobs"] = np.empty((self.buffer_rows, nwalkers), dtype=self._blob_dtype)
+        self._nbuffered = 0
+
+    def save_step(self, state: emcee.State, accepted: np.ndarray) -> None:
+        """Add a step to the buffers, handing them to the writer thread once they are full"""
+
+        if self._steps is None:
+            raise ValueError("`grow` must be called before saving steps")
+        if state.coords.shape != self._shape or accepted.shape != self._shape[:1]:
+            raise ValueError(f"invalid dimensions of the step, expected {self._shape}")
+
+        self._accepted = self._accepted + accepted
+        self._random_state = state.random_state
+        self._steps += 1
+        if self._steps % self.thin != 0:
+            return
+
+        k = self._nbuffered
+        self._buffers["chain"][k] = state.coords  # type: ignore
+        self._buffers["log_prob"][k] = state.log_prob  # type: ignore
+        if self._buffers["blobs"] is not None:
+            self._buffers["blobs"][k] = state.blobs
+        self._nbuffered += 1
+
+        if self._nbuffered == self.buffer_rows:
+            self.flush()
+
+    def flush(self, wait: bool = False) -> None:
+        """Hand the buffered steps to the writer thread
+
+        Parameters
+        ----------
+        wait : `bool`
+            Flag to wait until they are written, e.g. before a checkpoint refers to them
+        """
+
+        if self._steps is not None and self._steps != self._written_steps:
+            n = self._nbuffered
+            rows = {
+                name: None if values is None else values[:n]
+                for name, values in self._buffers.items()
+            }
+            task = (rows, self._accepted.copy(), self._steps, self._random_state)
+            self._written_steps = self._steps
+            self._new_buffers()
+
+            # only one write at a time: wait for the previous one before sending this one
+            self.wait()
+            if self._writer is None:
+                self._writer = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="hdf5-writer"
+                )
+            self._pending = self._writer.submit(self._write, *task)
+
+        if wait:
+            self.wait()
+
+    def wait(self) -> None:
+        """Wait until the write running in the background, if any, is done"""
+
+        if self._pending is None:
+            return
+
+        start = time.perf_counter()
+        pending, self._pending = self._pending, None
+        # errors of the writer thread are raised here
+        pending.result()
+        self.wait_time += time.perf_counter() - start
+
+    def _write(
+        self,
+        rows: Dict[str, Optional[np.ndarray]],
+        accepted: np.ndarray,
+        steps: int,
+        random_state: Any,
+    ) -> None:
+        """Append rows to the file, then update the counters of the sampler. Writer thread only"""
+
+        start = time.perf_counter()
+        nbytes = 0
+        with h5py.File(self.filename, "a") as f:
+            g = f[self.name]
+            first = int(g.attrs["iteration"])
+            last = first + len(rows["chain"])  # type: ignore
+            for name, values in rows.items():
+                if values is None or last == first:
+                    continue
+                g[name].resize(last, axis=0)
+                g[name][first:last] = values
+                nbytes += values.nbytes
+
+            g["accepted"][:] = accepted
+            if random_state is not None:
+                for i, v in enumerate(random_state):
+                    g.attrs[f"random_state_{i}"] = v
+
+            # rows only count once they are written
+            g.attrs["iteration"] = last
+            g.attrs["steps"] = steps
+
+        write_time = time.perf_counter() - start
+        self.writes.append(
+            {"steps": steps, "rows": last - first, "bytes": nbytes, "time": write_time}
+        )
+        logger.debug(
+            f"step {steps} :: {last - first} rows ({nbytes / 1024:.1f} kB) written to "
+            f"{self.filename} in {1e3 * write_time:.2f} ms"
+        )
+
+    def close(self) -> None:
+        """Write the buffered steps and stop the writer thread"""
+
+        if self._steps is not None and self._steps != self._written_steps:
+            # same as `flush`, but from this thread: at exit, threads can not be started anymore
+            self.wait()
+            n = self._nbuffered
+            rows = {
+                name: None if values is None else values[:n]
+                for name, values in self._buffers.items()
+            }
+            self._written_steps = self._steps
+            self._write(rows, self._accepted.copy(), self._steps, self._random_state)
+            self._new_buffers()
+
+        self.wait()
+        if self._writer is not None:
+            self._writer.shutdown()
+            self._writer = None
+
+    def write_stats(self) -> Dict[str, Any]:
+        """Number of writes, with their rows, bytes & time in total and per write, and the time the
+        sampler waited for the writer thread
+        """
+
+        nwrites = len(self.writes)
+        total = {key: sum(write[key] for write in self.writes) for key in ("rows", "bytes", "time")}
+
+        return {
+            "writes": nwrites,
+            "rows": int(total["rows"]),
+            "bytes": int(total["bytes"]),
+            "write_time": total["time"],
+            "bytes_per_write": total["bytes"] / max(nwrites, 1),
+            "time_per_write": total["time"] / max(nwrites, 1),
+            "max_time_per_write": max((write["time"] for write in self.writes), default=0.0),
+            "wait_time": self.wait_time,
+        }
+
+    @property
+    def iteration(self) -> int:
+        """Number of steps done by the sampler, stored or not"""
+
+        if self._steps is not None:
+            return self._steps
+
+        with self.open() as f:
+            return self._stored_steps(f[self.name])
+
+    @property
+    def accepted(self) -> np.ndarray:
+        if self._steps is not None:
+            return self._accepted
+
+        return super().accepted
+
+    @property
+    def random_state(self) -> Any:
+        if self._steps is not None:
+            return self._random_state
+
+        return super().random_state
+
+    def get_value(self, name: str, flat: bool = False, thin: int = 1, discard: int = 0) -> Any:
+        """Stored values after the first `discard` steps, one of every `thin` steps (at least one
+        of every `thin` of the backend)
+        """
+
+        self.flush(wait=True)
+
+        if not self.initialized:
+            raise AttributeError("you must run the sampler before accessing the results")
+
+        with self.open() as f:
+            g = f[self.name]
+            nrows = int(g.attrs["iteration"])
+            if nrows <= 0:
+                raise AttributeError("you must run the sampler before accessing the results")
+            if name == "blobs" and not g.attrs["has_blobs"]:
+                return None
+
+            # row `r` is the state after step `(r + 1) * thin`
+            step = max(thin // self.thin, 1)
+            first = discard // self.thin + step - 1
+            v = g[name][first:nrows:step]
+
+        if flat:
+            s = list(v.shape[1:])
+            s[0] = np.prod(v.shape[:2])
+            return v.reshape(s)
+
+        return v
+
+    def get_autocorr_time(self, discard: int = 0, thin: int = 1, **kwargs: Any) -> np.ndarray:
+        """Integrated autocorrelation time of each parameter, in steps of the sampler"""
+
+        x = self.get_chain(discard=discard, thin=thin)
+
+        return max(thin // self.thin, 1) * self.thin * emcee.autocorr.integrated_time(x, **kwargs)
+
+    def get_last_sample(self) -> emcee.State:
+        """Last stored state, which is the state after step `thin * rows` of the sampler"""
+
+        self.flush(wait=True)
+
+        with self.open() as f:
+            g = f[self.name]
+            nrows = int(g.attrs["iteration"])
+            if nrows <= 0:
+                raise AttributeError("you must run the sampler before accessing the results")
+
+            blobs = g["blobs"][nrows - 1] if g.attrs["has_blobs"] else None
+            return emcee.State(
+                g["chain"][nrows - 1],
+                log_prob=g["log_prob"][nrows - 1],
+                blobs=blobs,
+                random_state=self._read_random_state(g),
+            )
+
+
+@atexit.register
+def _close_backends() -> None:
+    """Write the steps still in memory when the interpreter exits"""
+
+    for backend in list(_open_backends):
+        try:
+            backend.close()
+        except Exception as exc:
+            logger.critical(f"could not write the last steps to {backend.filename}: {str(exc)}")
+
+
+class PhysicalHDFBackend(BufferedHDFBackend):
+    """`BufferedHDFBackend` of a sampler moving in the sampled space, which stores its walkers in
+    physical units together with the log-probability of their physical parameters
+
+    The last sample is given back in the sampled space, to resume the run from it
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the HDF5 file
+
+    stellar_parameters : `Mapping[str, Any]`
+        Stellar parameters of Cygnus X-1, setting the limits of m1 & m2
+
+    kwargs :
+        Other arguments of `BufferedHDFBackend`
+    """
+
+    def __init__(self, filename: str, stellar_parameters: Mapping[str, Any], **kwargs: Any):
+        super().__init__(filename, **kwargs)
+        self.stellar_parameters = stellar_parameters
+
+    def save_step(self, state: emcee.State, accepted: np.ndarray) -> None:
+        physical, log_jacobian = to_physical(state.coords, self.stellar_parameters)
+        with np.errstate(invalid="ignore"):
+            log_prob = add_jacobian(state.log_prob, -log_jacobian)
+
+        super().save_step(
+            emcee.State(
+                physical, log_prob=log_prob, blobs=state.blobs, random_state=state.random_state
+            ),
+            accepted,
+        )
+
+    def get_last_sample(self) -> emcee.State:
+        state = super().get_last_sample()
+        state.coords = to_sampled(state.coords, self.stellar_parameters)
+        _, log_jacobian = to_physical(state.coords, self.stellar_parameters)
+        state.log_prob = add_jacobian(state.log_prob, log_jacobian)
+
+        return state
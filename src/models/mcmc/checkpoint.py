@@ -0,0 +1,279 @@
+"""Checkpoints of a MCMC run, used to resume it from the last stored walker positions
+
+A checkpoint is a small `.npz` file next to the HDF5 backend with the state of the sampler (walker
+positions, log-probabilities, blobs & random generator state) at a given iteration. It is written
+to a temporary file which then atomically replaces the previous one, so a crash never leaves a
+half-written checkpoint. On resume, the backend is rolled back to the iteration of the checkpoint,
+discarding any step that could have been partially written after it
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import emcee
+
+logger = logging.getLogger(__name__)
+
+
+def config_hash(config: Dict[str, Any]) -> str:
+    """Hash of the options of a configuration that define the sampled distribution
+
+    Number of steps, filenames or output options are not part of it, so that a run can be resumed
+    (or extended) after changing them
+
+    Parameters
+    ----------
+    config : `Dict[str, Any]`
+        Configuration loaded from the YAML file
+
+    Returns
+    -------
+    hash : `str`
+        Hexadecimal SHA-256 digest
+    """
+
+    relevant = {
+        "walkers": config["MCMC"].get("walkers"),
+        "dimension": config["MCMC"].get("dimension"),
+        "priorDistributions": config["MCMC"].get("priorDistributions"),
+        "StellarParameters": config["StellarParameters"],
+    }
+    # walkers of checkpoints are in the sampled space, which depends on this option
+    if config["MCMC"].get("reparameterize", False):
+        relevant["reparameterize"] = True
+
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode()).hexdigest()
+
+
+def checkpoint_filename(filename: str) -> str:
+    """Name of the checkpoint of a given HDF5 backend"""
+
+    return str(Path(filename).with_suffix(".ckpt.npz"))
+
+
+def mark_backend(backend: emcee.backends.HDFBackend, chash: str) -> None:
+    """Store the hash of the configuration in a new backend"""
+
+    with backend.open("a") as f:
+        f[backend.name].attrs["config_hash"] = chash
+
+
+def save(
+    filename: str,
+    state: emcee.State,
+    iteration: int,
+    accepted: np.ndarray,
+    chash: str,
+    hot_states: Optional[Sequence[emcee.State]] = None,
+    betas: Optional[np.ndarray] = None,
+) -> None:
+    """Atomically write a checkpoint of the sampler
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the checkpoint file
+
+    state : `emcee.State`
+        State of the ensemble at `iteration`
+
+    iteration : `int`
+        Number of steps stored in the backend
+
+    accepted : `np.ndarray`
+        Number of accepted proposals of each walker, as stored in the backend
+
+    chash : `str`
+        Hash of the configuration (see `config_hash`)
+
+    hot_states : `Sequence[emcee.State]`
+        State of the hot ensembles of a parallel tempering run (see `samplers.TemperedEnsemble`)
+
+    betas : `np.ndarray`
+        Inverse temperatures of the ensembles of a parallel tempering run, cold one included
+    """
+
+    name, keys, pos, has_gauss, cached_gaussian = state.random_state
+
+    arrays = dict(
+        coords=state.coords,
+        log_prob=state.log_prob,
+        iteration=iteration,
+        accepted=accepted,
+        config_hash=chash,
+        rng_name=name,
+        rng_keys=keys,
+        rng_pos=pos,
+        rng_has_gauss=has_gauss,
+        rng_cached_gaussian=cached_gaussian,
+    )
+    if state.blobs is not None:
+        arrays["blobs"] = state.blobs
+    if hot_states:
+        arrays["betas"] = betas
+        arrays["hot_coords"] = np.stack([hot.coords for hot in hot_states])
+        arrays["hot_log_prob"] = np.stack([hot.log_prob for hot in hot_states])
+        arrays["hot_blobs"] = np.stack([hot.blobs for hot in hot_states])
+
+    tmp_filename = f"{filename}.tmp"
+    with open(tmp_filename, "wb") as f:
+        np.savez(f, **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_filename, filename)
+
+
+def load(filename: str) -> Optional[Dict[str, Any]]:
+    """Read a checkpoint written by `save`, None if there is no such file"""
+
+    if not os.path.isfile(filename):
+        return None
+
+    with np.load(filename) as data:
+        return {
+            "coords": data["coords"],
+            "log_prob": data["log_prob"],
+            "blobs": data["blobs"] if "blobs" in data.files else None,
+            "iteration": int(data["iteration"]),
+            "accepted": data["accepted"],
+            "config_hash": str(data["config_hash"]),
+            "random_state": (
+                str(data["rng_name"]),
+                data["rng_keys"],
+                int(data["rng_pos"]),
+                int(data["rng_has_gauss"]),
+                float(data["rng_cached_gaussian"]),
+            ),
+        }
+
+
+def load_hot_states(filename: str, betas: np.ndarray) -> Optional[List[emcee.State]]:
+    """State of the hot ensembles stored in a checkpoint, None if there are none or if they were
+    sampled with different temperatures
+    """
+
+    import emcee
+
+    if not os.path.isfile(filename):
+        return None
+
+    with np.load(filename) as data:
+        if "betas" not in data.files or not np.array_equal(data["betas"], betas):
+            return None
+
+        return [
+            emcee.State(coords, log_prob=log_prob, blobs=blobs)
+            for coords, log_prob, blobs in zip(
+                data["hot_coords"], data["hot_log_prob"], data["hot_blobs"]
+            )
+        ]
+
+
+def restore(
+    backend: emcee.backends.HDFBackend, nwalkers: int, ndim: int, chash: str
+) -> emcee.State:
+    """Check that a backend is compatible with the current run and get the state to resume from
+
+    If there is a checkpoint, the backend is rolled back to its iteration. Otherwise the last
+    step stored in the backend is used
+
+    Parameters
+    ----------
+    backend : `emcee.backends.HDFBackend`
+        Existing backend of a previous run
+
+    nwalkers : `int`
+        Number of walkers of the current run
+
+    ndim : `int`
+        Dimension of the current run
+
+    chash : `str`
+        Hash of the current configuration (see `config_hash`)
+
+    Returns
+    -------
+    state : `emcee.State`
+        State of the ensemble from which to continue sampling
+    """
+
+    import emcee
+
+    if not backend.initialized:
+        raise ValueError(f"no MCMC chain found in `{backend.filename}`")
+
+    if backend.shape != (nwalkers, ndim):
+        raise ValueError(
+            f"backend has (nwalkers, ndim) = {backend.shape}, expected {(nwalkers, ndim)}"
+        )
+
+    with backend.open() as f:
+        stored_hash = f[backend.name].attrs.get("config_hash")
+        thin = int(f[backend.name].attrs.get("thin", 1))
+
+    if stored_hash != chash:
+        raise ValueError("backend was created with a different configuration")
+
+    # rows of a thinned chain are `thin` steps apart (see `backends.BufferedHDFBackend`)
+    if thin != getattr(backend, "thin", 1):
+        raise ValueError(
+            f"backend stores one of every {thin} steps, not of every {getattr(backend, 'thin', 1)}"
+        )
+
+    # steps stored without blobs cannot be mixed with new ones that have them
+    if backend.iteration > 0 and not backend.has_blobs():
+        raise ValueError("backend has no blobs, it was created by an older version of the code")
+
+    ckpt = load(checkpoint_filename(backend.filename))
+    if ckpt is None:
+        logger.info("no checkpoint found, resuming from last step of backend")
+        if backend.iteration == 0:
+            raise ValueError("backend has no steps stored")
+        state = backend.get_last_sample()
+        # steps done after the last stored row of a thinned chain are lost
+        if thin > 1:
+            with backend.open("a") as f:
+                g = f[backend.name]
+                g.attrs["steps"] = int(g.attrs["iteration"]) * thin
+        return state
+
+    if ckpt["config_hash"] != chash:
+        raise ValueError("checkpoint was created with a different configuration")
+
+    if ckpt["iteration"] > backend.iteration:
+        raise ValueError(
+            f"checkpoint at step {ckpt['iteration']} is ahead of backend "
+            f"(step {backend.iteration})"
+        )
+
+    if ckpt["blobs"] is None:
+        raise ValueError("checkpoint has no blobs, it was created by an older version of the code")
+
+    # drop any step stored after the checkpoint
+    with backend.open("a") as f:
+        g = f[backend.name]
+        g.attrs["iteration"] = ckpt["iteration"] // thin
+        g.attrs["steps"] = ckpt["iteration"]
+        g["accepted"][:] = ckpt["accepted"]
+        for i, v in enumerate(ckpt["random_state"]):
+            g.attrs[f"random_state_{i}"] = v
+
+    logger.info(f"resuming from checkpoint at step {ckpt['iteration']}")
+
+    return emcee.State(
+        ckpt["coords"],
+        log_prob=ckpt["log_prob"],
+        blobs=ckpt["blobs"],
+        random_state=ckpt["random_state"],
+    )
@@ -0,0 +1,116 @@
+"""Convergence check of a MCMC chain based on its integrated autocorrelation time
+
+Following the recommendation of the `emcee` documentation, a chain is considered converged once it
+is longer than `n_tau` times the autocorrelation time (τ) of every parameter and the estimate of τ
+changed less than a relative tolerance since the previous check. τ is estimated on the second half
+of the chain, thinned according to the previous estimate, so that each check reads a bounded part
+of the backend
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional
+
+import logging
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import emcee
+
+logger = logging.getLogger(__name__)
+
+# name of the dataset with the history of τ estimates, inside the group of the backend
+TAU_HISTORY = "tau_history"
+
+# steps per τ of the previous estimate read by each check. τ is still well resolved with a thin of
+# τ / STEPS_PER_TAU
+STEPS_PER_TAU = 10
+
+
+class ConvergenceMonitor:
+    """Estimate τ every `check_every` steps and decide when to stop sampling
+
+    Parameters
+    ----------
+    check_every : `int`
+        Number of steps between estimates of τ
+
+    n_tau : `float`
+        Minimum length of the chain, in units of τ
+
+    tau_tol : `float`
+        Maximum relative change of τ between two consecutive estimates
+    """
+
+    def __init__(self, check_every: int = 1000, n_tau: float = 50, tau_tol: float = 0.01) -> None:
+        self.check_every = check_every
+        self.n_tau = n_tau
+        self.tau_tol = tau_tol
+
+        self.tau: Optional[np.ndarray] = None
+
+    def load_history(self, backend: emcee.backends.HDFBackend) -> None:
+        """Take the last estimate of τ stored in a backend, when resuming a run"""
+
+        with backend.open() as f:
+            g = f[backend.name]
+            if TAU_HISTORY in g and g[TAU_HISTORY].shape[0] > 0:
+                self.tau = g[TAU_HISTORY][-1, 1:]
+
+    def _store(self, backend: emcee.backends.HDFBackend, iteration: int, tau: np.ndarray) -> None:
+        """Append an estimate of τ to the history kept in the backend"""
+
+        row = np.concatenate(([iteration], tau))
+        with backend.open("a") as f:
+            g = f[backend.name]
+            if TAU_HISTORY not in g:
+                g.create_dataset(TAU_HISTORY, (0, row.size), maxshape=(None, row.size), dtype="f8")
+            history = g[TAU_HISTORY]
+            history.resize(history.shape[0] + 1, axis=0)
+            history[-1] = row
+
+    def _thin(self) -> int:
+        """Steps between the samples used to estimate τ, from the previous estimate. Walkers stuck
+        at their initial positions give a τ of NaN, which is ignored
+        """
+
+        if self.tau is None or not np.any(np.isfinite(self.tau)):
+            return 1
+
+        return max(int(np.nanmin(self.tau) // STEPS_PER_TAU), 1)
+
+    def converged(self, sampler: emcee.EnsembleSampler) -> bool:
+        """Check convergence of the chain, only every `check_every` steps
+
+        Parameters
+        ----------
+        sampler : `emcee.EnsembleSampler`
+            Sampler being run
+
+        Returns
+        -------
+        converged : `bool`
+            True if sampling can stop
+        """
+
+        iteration = sampler.iteration
+        if iteration % self.check_every != 0:
+            return False
+
+        # the first half of the chain is discarded (the walkers did not forget their initial
+        # positions there) and the rest is thinned by a fraction of τ of the previous check
+        discard = iteration // 2
+        tau = sampler.get_autocorr_time(discard=discard, thin=self._thin(), tol=0)
+        self._store(sampler.backend, iteration, tau)
+
+        long_enough = np.all(self.n_tau * tau < iteration)
+        stable = self.tau is not None and np.all(np.abs(self.tau - tau) / tau < self.tau_tol)
+        self.tau = tau
+
+        logger.info(
+            f"step {iteration} :: τ = {np.array2string(tau, precision=1)} :: "
+            f"N / max(τ) = {iteration / np.max(tau):.1f}"
+        )
+
+        return bool(long_enough and stable)
@@ -0,0 +1,204 @@
+"""Execution backends of the likelihood evaluations
+
+Walkers to evaluate are split in batches (see `WalkerBatches`) which are sent to a pool-like
+object with a `map` method:
+
+- `serial`: no pool, every walker is evaluated in the main process
+- `processes`: a `multiprocessing.Pool` with a given number of workers on this machine
+- `mpi`: an MPI pool from `mpi4py.futures`, which can span several nodes. The code must be
+  launched with `mpirun`/`mpiexec`; rank 0 runs the sampler and every other rank is a worker, e.g.
+  `mpirun -n 4 python -m src.models.mcmc.mcmc --executor mpi ...` for 3 workers
+
+`mpi4py` is only needed, and only imported, by the `mpi` backend
+"""
+
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+import contextlib
+import logging
+import multiprocessing
+import os
+import pickle
+
+import numpy as np
+
+from . import telemetry
+
+logger = logging.getLogger(__name__)
+
+EXECUTORS = ("serial", "processes", "mpi")
+
+# whether rank 0 already opened (and closed) the MPI pool, releasing the workers
+_mpi_released = False
+
+
+def _mpi() -> Any:
+    try:
+        from mpi4py import MPI
+    except ImportError:
+        raise RuntimeError("the `mpi` executor requires the `mpi4py` package") from None
+
+    return MPI
+
+
+def mpi_rank() -> int:
+    """Rank of this process in `MPI.COMM_WORLD`"""
+
+    return _mpi().COMM_WORLD.Get_rank()
+
+
+def serve_mpi_workers() -> None:
+    """Make this rank an MPI worker, until rank 0 closes its pool. Must be called on every rank
+    other than 0 before doing anything else
+    """
+
+    from mpi4py.futures import MPICommExecutor
+
+    with MPICommExecutor(_mpi().COMM_WORLD, root=0) as executor:
+        assert executor is None
+
+
+def release_mpi_workers() -> None:
+    """Let MPI workers finish if rank 0 ends without opening its pool (e.g. on errors or when the
+    chain already has every step)
+    """
+
+    if not _mpi_released:
+        with executor_pool("mpi"):
+            pass
+
+
+def number_of_workers(kind: str, workers: Optional[int] = None) -> int:
+    """Number of processes evaluating the likelihood for a given backend
+
+    Parameters
+    ----------
+    kind : `str`
+        Name of the backend, one of `EXECUTORS`
+
+    workers : `int`
+        Requested number of workers of the `processes` backend, all cores if None
+
+    Returns
+    -------
+    workers : `int`
+        Number of workers. For `mpi` it is the number of ranks but rank 0
+    """
+
+    if kind == "serial":
+        return 1
+    if kind == "processes":
+        return workers or os.cpu_count() or 1
+    if kind == "mpi":
+        return max(_mpi().COMM_WORLD.Get_size() - 1, 1)
+
+    raise ValueError(f"unknown executor `{kind}`, options are: {', '.join(EXECUTORS)}")
+
+
+@contextlib.contextmanager
+def executor_pool(
+    kind: str,
+    workers: Optional[int] = None,
+    initializer: Optional[Callable[..., None]] = None,
+    initargs: Tuple[Any, ...] = (),
+) -> Iterator[Optional[Any]]:
+    """Open the pool of a given backend, to be passed as `pool` to `emcee.EnsembleSampler`
+
+    Parameters
+    ----------
+    kind : `str`
+        Name of the backend, one of `EXECUTORS`
+
+    workers : `int`
+        Number of workers of the `processes` backend, all cores if None. MPI uses every rank but 0
+
+    initializer, initargs : `Callable`, `Tuple`
+        Function run once at the start of each worker, and its arguments. Not used by the
+        `serial` backend
+
+    Yields
+    ------
+    pool : `multiprocessing.Pool / mpi4py.futures.MPIPoolExecutor / None`
+        Pool of workers, None for the `serial` backend
+    """
+
+    global _mpi_released
+
+    nworkers = number_of_workers(kind, workers)
+
+    if kind == "serial":
+        yield None
+
+    elif kind == "processes":
+        logger.info(f"evaluating walkers over a pool of {nworkers} processes")
+        pool = multiprocessing.Pool(nworkers, initializer=initializer, initargs=initargs)
+        try:
+            yield pool
+            # workers leave on their own, running their finalizers (see `profiling.py`)
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+
+    else:
+        from mpi4py.futures import MPICommExecutor
+
+        logger.info(f"evaluating walkers over {nworkers} MPI workers")
+        _mpi_released = True
+        with MPICommExecutor(
+            _mpi().COMM_WORLD, root=0, initializer=initializer, initargs=initargs
+        ) as executor:
+            yield executor
+
+
+class WalkerBatches:
+    """Log-probability of the whole ensemble, for `emcee.EnsembleSampler` in `vectorize=True`
+    mode, evaluated by sending one batch of walkers to each worker of a pool
+
+    Tasks only carry walker positions (and a reference to `fn`): the keyword arguments of the
+    likelihood are set once per worker by the initializer of the pool. Bytes exchanged with the
+    workers are counted in the telemetry of the main process. They are estimated from the size of
+    the walkers, plus the pickled size of a task without walkers and of the result of one walker,
+    which are measured once, so that steps do not pickle their messages a second time
+
+    Parameters
+    ----------
+    fn : `Callable`
+        Function evaluating a batch of walkers, returning one tuple (log-probability & blobs) per
+        walker. Must be defined at module level so that it can be sent to workers
+
+    pool : `multiprocessing.Pool / mpi4py.futures.MPIPoolExecutor / None`
+        Pool of workers given by `executor_pool`. If None, walkers are evaluated in this process
+
+    nbatches : `int`
+        Number of batches in which the ensemble is split, usually the number of workers
+    """
+
+    def __init__(self, fn: Callable[[np.ndarray], List[Any]], pool: Any, nbatches: int) -> None:
+        self.fn = fn
+        self.pool = pool
+        self.nbatches = nbatches
+
+        # pickled bytes of a task without walkers, and of the result of a walker
+        self._task_bytes: Optional[int] = None
+        self._result_bytes = 0
+
+    def __call__(self, params: np.ndarray) -> List[Any]:
+        if self.pool is None:
+            return self.fn(params)
+
+        batches = np.array_split(params, min(self.nbatches, len(params)))
+        results = list(self.pool.map(self.fn, batches))
+
+        # size of the messages sent & received by the pool
+        if telemetry.is_active():
+            if self._task_bytes is None:
+                self._task_bytes = len(pickle.dumps((self.fn, params[:0])))
+                self._result_bytes = len(pickle.dumps(results[0])) // max(len(results[0]), 1)
+            telemetry.count_ipc(
+                len(batches) * self._task_bytes + params.nbytes + len(params) * self._result_bytes
+            )
+
+        return [result for batch in results for result in batch]
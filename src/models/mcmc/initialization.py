@@ -0,0 +1,405 @@
+"""Initial walkers of a chain started around the maximum a posteriori (MAP)
+
+With `use_random_uniform_walkers: False`, walkers do not start spread over the `initialGuess`
+ranges, where most of them have a likelihood of zero, but in a small ball around the MAP:
+
+1. `random_search`: draws uniform over the search bounds, evaluated in batches, until enough of
+   them have a finite log-likelihood
+2. `find_map`: differential evolution of the best of those draws, which evaluates the whole
+   population of each generation in a single batch
+3. `finite_ball`: Gaussian draws around the MAP, evaluated in batches, keeping only those with a
+   finite log-likelihood. The ball shrinks if most of its draws are rejected
+
+Every walker therefore starts with a finite log-likelihood, close to the mode of the posterior.
+`burn_in` estimates from the stored chain the number of steps the walkers took to settle, which
+is reported against the `burn` of the configuration at the end of a run
+"""
+
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# sampled parameters, in order, as named in the `initialGuess` options
+PARAMETERS = ("porb_preSN", "m1_preSN", "m2", "w", "theta", "phi")
+
+# default options of `initialization` in the configuration
+DEFAULT_OPTIONS = {
+    "bounds": dict(),
+    "batch": 4096,
+    "max_draws": 1000000,
+    "population": 60,
+    "iterations": 200,
+    "ball_scale": 0.01,
+    "seed": None,
+}
+
+# smallest fraction of finite draws of a ball before it is shrunk
+_MIN_BALL_ACCEPTANCE = 0.1
+
+LogProbability = Callable[[np.ndarray], np.ndarray]
+
+
+def initialization_options(options: Optional[Mapping[str, Any]]) -> Dict[str, Any]:
+    """Options of the initialization, with defaults from `DEFAULT_OPTIONS` for missing ones"""
+
+    merged = dict(DEFAULT_OPTIONS)
+    merged.update(options or dict())
+
+    for key in ("batch", "max_draws", "population", "iterations"):
+        if int(merged[key]) < 1:
+            raise ValueError(f"`{key}` of the initialization must be positive")
+    if merged["population"] < 5:
+        raise ValueError("`population` of the initialization must be at least 5")
+    if not 0 < merged["ball_scale"] < 1:
+        raise ValueError("`ball_scale` of the initialization must be between 0 & 1")
+
+    return merged
+
+
+def guess_bounds(
+    initial_guess: Mapping[str, float], bounds: Optional[Mapping[str, Any]] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Initial guess & limits of each parameter
+
+    Parameters
+    ----------
+    initial_guess : `Mapping[str, float]`
+        `initialGuess` options of the configuration, with the value (`<name>`) and limits
+        (`<name>_lo`, `<name>_hi`) of each parameter of `PARAMETERS`
+
+    bounds : `Mapping[str, Any]`
+        Limits (`[lo, hi]`) replacing those of `initial_guess` for some parameters
+
+    Returns
+    -------
+    values, lo, hi : `np.ndarray`
+        Initial guess, lower & upper limits of each parameter
+    """
+
+    bounds = bounds or dict()
+    unknown = set(bounds) - set(PARAMETERS)
+    if unknown:
+        raise ValueError(f"unknown parameters in bounds: {', '.join(sorted(unknown))}")
+
+    values = np.array([initial_guess[name] for name in PARAMETERS], dtype=float)
+    limits = np.array(
+        [
+            bounds.get(name, (initial_guess[f"{name}_lo"], initial_guess[f"{name}_hi"]))
+            for name in PARAMETERS
+        ],
+        dtype=float,
+    )
+    lo, hi = limits[:, 0], limits[:, 1]
+    if np.any(lo >= hi):
+        raise ValueError("lower limits of the parameters must be below their upper limits")
+
+    return values, lo, hi
+
+
+def uniform_walkers(
+    lo: np.ndarray, hi: np.ndarray, nwalkers: int, rng: np.random.Generator
+) -> np.ndarray:
+    """Walkers spread uniformly between the limits of each parameter"""
+
+    return rng.uniform(lo, hi, size=(nwalkers, len(lo)))
+
+
+def random_search(
+    log_prob_fn: LogProbability,
+    lo: np.ndarray,
+    hi: np.ndarray,
+    nfinite: int,
+    rng: np.random.Generator,
+    batch: int = 4096,
+    max_draws: int = 1000000,
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Uniform draws between the limits, evaluated in batches until `nfinite` of them have a finite
+    log-probability
+
+    Returns
+    -------
+    points : `np.ndarray`
+        Draws with a finite log-probability, at least `nfinite` of them, sorted from the highest
+        log-probability to the lowest
+
+    log_prob : `np.ndarray`
+        Log-probability of each point
+
+    ndraws : `int`
+        Number of draws evaluated
+    """
+
+    points, values = list(), list()
+    ndraws, nfound = 0, 0
+    while nfound < nfinite:
+        if ndraws >= max_draws:
+            raise ValueError(
+                f"only {nfound} of {ndraws} draws inside the bounds have a finite likelihood, "
+                f"{nfinite} are needed. Change the `bounds` of the initialization"
+            )
+        draws = uniform_walkers(lo, hi, batch, rng)
+        log_prob = log_prob_fn(draws)
+        finite = np.isfinite(log_prob)
+        points.append(draws[finite])
+        values.append(log_prob[finite])
+        ndraws += batch
+        nfound += int(finite.sum())
+
+    points_array, log_prob_array = np.concatenate(points), np.concatenate(values)
+    order = np.argsort(log_prob_array)[::-1]
+
+    return points_array[order], log_prob_array[order], ndraws
+
+
+def find_map(
+    log_prob_fn: LogProbability,
+    population: np.ndarray,
+    lo: np.ndarray,
+    hi: np.ndarray,
+    iterations: int = 200,
+    seed: Optional[int] = None,
+) -> Tuple[np.ndarray, float, int]:
+    """Maximum of the log-probability, found by differential evolution
+
+    Each generation is evaluated in a single call of `log_prob_fn`. Starting from a population of
+    finite points keeps the search inside the support of the posterior, which is a small fraction
+    of the volume inside the limits
+
+    Parameters
+    ----------
+    log_prob_fn : `Callable[[np.ndarray], np.ndarray]`
+        Log-probability of an array of shape (n, dimension)
+
+    population : `np.ndarray`
+        Initial population of shape (members, dimension), with finite log-probabilities
+
+    lo, hi : `np.ndarray`
+        Limits of each parameter
+
+    iterations : `int`
+        Maximum number of generations
+
+    seed : `int`
+        Seed of the mutations of the population
+
+    Returns
+    -------
+    x : `np.ndarray`
+        Parameters of the maximum
+
+    log_prob : `float`
+        Log-probability of the maximum
+
+    nevaluations : `int`
+        Number of points evaluated
+    """
+
+    import scipy.optimize
+
+    def cost(x: np.ndarray) -> np.ndarray:
+        # points come in columns, outside of the support the cost is infinite
+        log_prob = log_prob_fn(np.atleast_2d(x.T))
+        return np.where(np.isfinite(log_prob), -log_prob, np.inf)
+
+    result = scipy.optimize.differential_evolution(
+        cost,
+        bounds=list(zip(lo, hi)),
+        init=np.clip(population, lo, hi),
+        maxiter=iterations,
+        seed=seed,
+        polish=False,
+        updating="deferred",
+        vectorized=True,
+    )
+
+    return result.x, -float(result.fun), int(result.nfev)
+
+
+def finite_ball(
+    log_prob_fn: LogProbability,
+    center: np.ndarray,
+    scale: np.ndarray,
+    lo: np.ndarray,
+    hi: np.ndarray,
+    nwalkers: int,
+    rng: np.random.Generator,
+    batch: int = 4096,
+    max_draws: int = 1000000,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, int]:
+    """Walkers drawn from a Gaussian ball inside the limits, all of them with a finite
+    log-probability
+
+    The standard deviation of the ball is halved every time less than `_MIN_BALL_ACCEPTANCE` of a
+    batch of draws is kept
+
+    Parameters
+    ----------
+    center : `np.ndarray`
+        Center of the ball, e.g. the MAP
+
+    scale : `np.ndarray`
+        Initial standard deviation of the ball along each parameter
+
+    Returns
+    -------
+    walkers : `np.ndarray`
+        Array of shape (walkers, dimension)
+
+    log_prob : `np.ndarray`
+        Log-probability of each walker
+
+    scale : `np.ndarray`
+        Final standard deviation of the ball
+
+    ndraws : `int`
+        Number of draws evaluated
+    """
+
+    walkers, values = list(), list()
+    ndraws, nfound = 0, 0
+    while nfound < nwalkers:
+        if ndraws >= max_draws:
+            raise ValueError(
+                f"only {nfound} of {ndraws} draws around the MAP have a finite likelihood"
+            )
+        draws = center + scale * rng.standard_normal((batch, len(center)))
+        inside = np.all((draws > lo) & (draws < hi), axis=1)
+        log_prob = np.full(batch, -np.inf)
+        log_prob[inside] = log_prob_fn(draws[inside])
+        finite = np.isfinite(log_prob)
+        walkers.append(draws[finite])
+        values.append(log_prob[finite])
+        ndraws += batch
+        nfound += int(finite.sum())
+
+        if finite.mean() < _MIN_BALL_ACCEPTANCE:
+            scale = scale / 2
+            logger.debug(f"{100 * finite.mean():.1f}% of the ball is finite, halving its size")
+
+    return (
+        np.concatenate(walkers)[:nwalkers],
+        np.concatenate(values)[:nwalkers],
+        scale,
+        ndraws,
+    )
+
+
+def map_walkers(
+    log_prob_fn: LogProbability,
+    initial_guess: Mapping[str, float],
+    nwalkers: int,
+    options: Optional[Mapping[str, Any]] = None,
+) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """Walkers in a ball around the MAP, all of them with a finite log-probability
+
+    Parameters
+    ----------
+    log_prob_fn : `Callable[[np.ndarray], np.ndarray]`
+        Log-probability of an array of shape (n, dimension) of physical parameters
+
+    initial_guess : `Mapping[str, float]`
+        `initialGuess` options of the configuration (see `guess_bounds`)
+
+    nwalkers : `int`
+        Number of walkers
+
+    options : `Mapping[str, Any]`
+        `initialization` options of the configuration (see `DEFAULT_OPTIONS`)
+
+    Returns
+    -------
+    walkers : `np.ndarray`
+        Array of shape (walkers, dimension)
+
+    report : `Dict[str, Any]`
+        MAP and its log-probability, log-probability of the walkers, and evaluations done by each
+        stage
+    """
+
+    options = initialization_options(options)
+    rng = np.random.default_rng(options["seed"])
+    values, lo, hi = guess_bounds(initial_guess, options["bounds"])
+
+    # finite starting points, including the initial guess when it is finite
+    points, log_prob, ndraws = random_search(
+        log_prob_fn, lo, hi, options["population"], rng, options["batch"], options["max_draws"]
+    )
+    if np.all((values > lo) & (values < hi)) and np.isfinite(log_prob_fn(values[None])[0]):
+        points = np.vstack([values, points])
+    logger.info(
+        f"{len(points)} of {ndraws} random draws have a finite likelihood, best log L = "
+        f"{log_prob[0]:.3f}"
+    )
+
+    x_map, log_prob_map, nevaluations = find_map(
+        log_prob_fn,
+        points[: options["population"]],
+        lo,
+        hi,
+        options["iterations"],
+        None if options["seed"] is None else int(rng.integers(2**32)),
+    )
+    logger.info(f"MAP at {np.array2string(x_map, precision=4)} with log L = {log_prob_map:.3f}")
+
+    walkers, walkers_log_prob, scale, nball = finite_ball(
+        log_prob_fn,
+        x_map,
+        options["ball_scale"] * (hi - lo),
+        lo,
+        hi,
+        nwalkers,
+        rng,
+        options["batch"],
+        options["max_draws"],
+    )
+
+    report = {
+        "map": x_map.tolist(),
+        "map_log_prob": log_prob_map,
+        "walkers_log_prob": [float(np.min(walkers_log_prob)), float(np.max(walkers_log_prob))],
+        "ball_scale": scale.tolist(),
+        "evaluations": {"search": ndraws, "optimizer": nevaluations, "ball": nball},
+    }
+
+    return walkers, report
+
+
+def burn_in(log_prob: np.ndarray, ndim: int, thin: int = 1) -> int:
+    """Steps taken by the walkers of a chain to reach its typical set
+
+    The typical set of a posterior in `ndim` dimensions lies about `ndim / 2` below its highest
+    log-probability. The chain is considered burned in from the first stored step at which the
+    median log-probability of the walkers is within `ndim / 2` of its median over the second half
+    of the chain
+
+    Parameters
+    ----------
+    log_prob : `np.ndarray`
+        Log-probability of the stored steps, with shape (steps, walkers)
+
+    ndim : `int`
+        Number of parameters
+
+    thin : `int`
+        Steps of the sampler between stored steps
+
+    Returns
+    -------
+    steps : `int`
+        Steps of the sampler before the chain reached its typical set
+    """
+
+    # walkers rejected by the likelihood (NaN or -inf) count as the lowest values
+    median = np.median(np.where(np.isnan(log_prob), -np.inf, log_prob), axis=1)
+    second_half = len(median) // 2
+    reference = np.median(median[second_half:])
+    if not np.isfinite(reference):
+        return len(log_prob) * thin
+
+    settled = np.flatnonzero(median >= reference - ndim / 2)
+
+    return int(settled[0]) * thin
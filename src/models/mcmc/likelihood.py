@@ -3,19 +3,55 @@
 Compute log of likelihood while imposing conditions measured in Cygnus X-1
 """
 
-from typing import List
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 import logging
+import sys
 
 import numpy as np
-import poskiorb
-import priors
+
+from . import kicks, logs, priors, telemetry, transforms
 
 # logging stuff
 logger = logging.getLogger()
 
+# binary parameters returned by the likelihood together with its value, stored by `emcee` as blobs
+# so that the processing of the chain does not need to evaluate the kicks model again
+BLOB_NAMES = ("a_pre", "p_post", "e", "cos_i", "v_sys")
+BLOBS_DTYPE = np.dtype([(name, np.float64) for name in BLOB_NAMES])
+
+# value returned for samples rejected before evaluating the kicks model
+_REJECTED = (-np.inf,) + (np.nan,) * len(BLOB_NAMES)
+
+# keyword arguments of the likelihood in this process, by name, set once by `set_context`. runs
+# sharing a pool of workers (see `sweep.py`) use one context each
+DEFAULT_CONTEXT = "default"
+_contexts: Dict[str, Dict[str, Any]] = dict()
+
+
+class _BinaryStr:
+    """Description of a binary for debug messages. It is only formatted if the message is
+    actually emitted by the logger
+    """
+
+    __slots__ = ("args", "theta", "phi")
+
+    def __init__(self, args: List[float], theta: float, phi: float) -> None:
+        self.args = args
+        self.theta = theta
+        self.phi = phi
+
+    def __str__(self) -> str:
+        porb_pre, m1_pre, m2, w = (float(x) for x in self.args[:4])
+        theta = float(np.rad2deg(np.squeeze(self.theta)))
+        phi = float(np.rad2deg(np.squeeze(self.phi)))
+        return (
+            f"m1 = {m1_pre:.2f}, m2 = {m2:.2f}, p = {porb_pre:.2e} :: "
+            f"ω = {w:.2e}, θ = {theta:.2e}, φ = {phi:.2e}"
+        )
+
 
-def log_likelihood(args: List[float], **kwargs: float) -> float:
+def log_likelihood(args: List[float], **kwargs: float) -> Tuple[float, ...]:
     """Compute logarithm of the likelihood
 
     Parameters
@@ -25,6 +61,12 @@ def log_likelihood(args: List[float], **kwargs: float) -> float:
 
     kwargs : `dict`
         Dictionary with stellar parameters of Cygnus X-1 (see `mcmc.py` for references)
+
+    Returns
+    -------
+    log_L, *blobs : `Tuple[float, ...]`
+        Logarithm of the likelihood followed by the binary parameters of `BLOB_NAMES`, which are
+        NaN if the sample was rejected before evaluating the kicks model
     """
 
     # set parameters at asymmetric kick initial moments
@@ -40,109 +82,381 @@ def log_likelihood(args: List[float], **kwargs: float) -> float:
     theta = theta % (2 * np.pi)
     if theta < 0 or theta > np.pi:
         theta = np.pi - (theta % np.pi)
-    
-    # this is for debugging purposes
-    binary_str = f"m1 = {m1_pre:.2f}, m2 = {m2:.2f}, p = {porb_pre:.2e} :: "
-    binary_str += f"ω = {w:.2e}, θ = {np.rad2deg(theta):.2e}, φ = {np.rad2deg(phi):.2e}"
 
-    # remove cases that are not physical
+    # remove cases that are not physical. messages are only built when DEBUG is enabled
     if m1_pre < float(kwargs["M_BH"]):
-        logger.debug(f"{binary_str} :: non physical case (m1 < {kwargs['M_BH']:.2f})")
-        return -np.inf
+        if logs.debug_enabled:
+            logger.debug(
+                "%s :: non physical case (m1 < %.2f)", _BinaryStr(args, theta, phi), kwargs["M_BH"]
+            )
+        telemetry.count(telemetry.M1_BELOW_MBH)
+        return _REJECTED
     if w < 0e0:
-        logger.debug(f"{binary_str} :: non physical case (ω < 0)")
-        return -np.inf
+        if logs.debug_enabled:
+            logger.debug("%s :: non physical case (ω < 0)", _BinaryStr(args, theta, phi))
+        telemetry.count(telemetry.W_NEGATIVE)
+        return _REJECTED
     if porb_pre < 0e0:
-        logger.debug(f"{binary_str} :: non physical case: (p < 0)")
-        return -np.inf
+        if logs.debug_enabled:
+            logger.debug("%s :: non physical case: (p < 0)", _BinaryStr(args, theta, phi))
+        telemetry.count(telemetry.P_NEGATIVE)
+        return _REJECTED
     if theta < 0 or theta >= np.pi or phi < 0 or phi >= 2 * np.pi:
-        logger.debug(f"{binary_str} :: angles outside limits: (θ = {theta:.2f}, φ = {phi:.2f})")
-        return -np.inf
+        if logs.debug_enabled:
+            logger.debug(
+                "%s :: angles outside limits: (θ = %.2f, φ = %.2f)",
+                _BinaryStr(args, theta, phi),
+                theta,
+                phi,
+            )
+        telemetry.count(telemetry.ANGLES_OUTSIDE)
+        return _REJECTED
 
     # remove unlikely scenarios
     if porb_pre > 1e3:
-        logger.debug(f"{binary_str} :: unlikely scenario: (p > 1000)")
-        return -np.inf
+        if logs.debug_enabled:
+            logger.debug("%s :: unlikely scenario: (p > 1000)", _BinaryStr(args, theta, phi))
+        telemetry.count(telemetry.P_ABOVE_LIMIT)
+        return _REJECTED
     if w > 600e0:
-        logger.debug(f"{binary_str} :: unlikely scenario: (w > 500)")
-        return -np.inf
+        if logs.debug_enabled:
+            logger.debug("%s :: unlikely scenario: (w > 500)", _BinaryStr(args, theta, phi))
+        telemetry.count(telemetry.W_ABOVE_LIMIT)
+        return _REJECTED
     if m2 < (kwargs["M_2"] - kwargs["M_2_ERR"]) or m2 > (kwargs["M_2"] + kwargs["M_2_ERR"]):
-        logger.debug(
-            f"{binary_str} :: unlikely scenario: "
-            f"(m2 < {kwargs['M_2'] - kwargs['M_2_ERR']} | m2 > {kwargs['M_2'] + kwargs['M_2_ERR']})"
-        )
-        return -np.inf
-
-    # convert period to separation, needed for the `binary_orbits_after_kick`
-    a_pre = poskiorb.utils.P_to_a(period=porb_pre, m1=m1_pre, m2=m2)
-
-    # evaluate kicks model
-    (
-        a_post,
-        p_post,
-        e,
-        cos_i,
-        v_sys,
-        _,
-        _,
-        _,
-        _,
-    ) = poskiorb.utils.binary_orbits_after_kick(
-        a=a_pre,
-        m1=m1_pre,
-        m2=m2,
-        m1_remnant_mass=kwargs["M_BH"],
-        w=w,
-        theta=theta,
-        phi=phi,
-        ids=np.ones(1),
+        if logs.debug_enabled:
+            logger.debug(
+                "%s :: unlikely scenario: (m2 < %s | m2 > %s)",
+                _BinaryStr(args, theta, phi),
+                kwargs["M_2"] - kwargs["M_2_ERR"],
+                kwargs["M_2"] + kwargs["M_2_ERR"],
+            )
+        telemetry.count(telemetry.M2_OUTSIDE)
+        return _REJECTED
+
+    # evaluate models over one-element arrays, the same way `log_likelihood_batch` does for the
+    # whole ensemble, so that both functions give exactly the same numbers
+    porb_pre, m1_pre, m2, w, theta, phi = np.atleast_1d(porb_pre, m1_pre, m2, w, theta, phi)
+
+    # evaluate kicks model, separation pre-SN included
+    kernel = kicks.get_kernel(kwargs.get("kick_kernel", "poskiorb"))
+    a_pre, a_post, p_post, e, cos_i, v_sys = kernel(
+        porb_pre, m1_pre, m2, kwargs["M_BH"], w, theta, phi
     )
-    
+
+    blobs = (a_pre[0], p_post[0], e[0], cos_i[0], v_sys[0])
+
     # we dont want unbounded binaries
-    if not np.isfinite(e):        
-        logger.debug(f"{binary_str} :: unbounded after kick")
-        return -np.inf
+    if not np.isfinite(e[0]):
+        if logs.debug_enabled:
+            logger.debug("%s :: unbounded after kick", _BinaryStr(args, theta, phi))
+        telemetry.count(telemetry.UNBOUND)
+        return (-np.inf,) + blobs
 
     # inclination to deg.
     inc = np.rad2deg(np.arccos(cos_i))
 
     # compute priors to update likelihood
-    try:
-        log_L: float = priors.lg_prior_porb(
-            porb=p_post,
-            porb_fixed=kwargs["PORB"],
-            distribution=kwargs["p_orb"],  # type: ignore
-            loc=kwargs["PORB"],
-            scale=kwargs["PORB_ERR"],
-        )
-        log_L += priors.lg_prior_ecc(  # type: ignore
-            ecc=e,
-            ecc_fixed=kwargs["ECC"],
-            distribution=kwargs["e"],  # type: ignore
-            loc=kwargs["ECC"],
-            scale=kwargs["ECC_ERR"],
-        )
-        log_L += priors.lg_prior_m2(  # type: ignore
-            m2=m2,
-            m2_fixed=kwargs["M_2"],
-            distribution=kwargs["m2"],  # type: ignore
-            loc=kwargs["M_2"],
-            scale=kwargs["M_2_ERR"],
-        )
-        log_L += priors.lg_prior_vsys(  # type: ignore
-            vsys=v_sys,
-            vsys_fixed=kwargs["VSYS"],
-            distribution=kwargs["v_sys"],  # type: ignore
-            loc=kwargs["VSYS"],
-            scale=kwargs["VSYS_ERR"],
+    log_L = _lg_priors(p_post, e, m2, v_sys, inc, kwargs)
+
+    # prior on theta, phi => isotropic distribution pdf = 0.5 * sin(θ)
+    log_L += np.log(np.sin(theta))
+
+    telemetry.count(telemetry.FINITE if np.isfinite(log_L[0]) else telemetry.ZERO_PRIOR)
+
+    # debugging stuff
+    if logs.debug_enabled and log_L[0] != -np.inf:
+        logger.debug(
+            "%s :: P = %.2e, e = %.2f, i = %.2e, v_sys = %.2e => log_L = %.2f",
+            _BinaryStr(args, theta, phi),
+            p_post[0],
+            e[0],
+            inc[0],
+            v_sys[0],
+            log_L[0],
         )
-        log_L += priors.lg_prior_inc(  # type: ignore
-            inc=inc,
-            inc_fixed=kwargs["INC"],
-            distribution=kwargs["i"],  # type: ignore
-            loc=kwargs["INC"],
-            scale=kwargs["INC_ERR"],
+
+    return (log_L[0],) + blobs
+
+
+def log_likelihood_batch(params: np.ndarray, **kwargs: Any) -> List[Tuple[float, ...]]:
+    """Compute logarithm of the likelihood for a whole ensemble of walkers
+
+    Array version of `log_likelihood` meant to be used with `emcee.EnsembleSampler` in its
+    `vectorize=True` mode. Operations are done in the same order as in the scalar version, so that
+    both of them give exactly the same values
+
+    Parameters
+    ----------
+    params : `np.ndarray`
+        Array of shape (nwalkers, 6) with the elements to explore in MCMC
+
+    kwargs : `dict`
+        Dictionary with stellar parameters of Cygnus X-1 (see `mcmc.py` for references)
+
+    Returns
+    -------
+    results : `List[Tuple[float, ...]]`
+        Same output as `log_likelihood` for each walker, which is the layout `emcee` expects for
+        blobs
+    """
+
+    observables: Dict[str, np.ndarray] = dict()
+    log_L = _evaluate_batch(params, kwargs, observables)
+
+    return list(zip(log_L, *(observables[name] for name in BLOB_NAMES)))
+
+
+def set_context(context: Dict[str, Any], name: str = DEFAULT_CONTEXT) -> None:
+    """Set the keyword arguments used by `evaluate_walkers` in this process
+
+    Parameters
+    ----------
+    context : `Dict[str, Any]`
+        Stellar parameters of Cygnus X-1, prior distributions & prior evaluators, as the keyword
+        arguments of `log_likelihood`. Prior evaluators (`prior_set`) missing from it are built
+        here, once, so that evaluating walkers only pays for their logpdf
+
+    name : `str`
+        Name of the context
+    """
+
+    if context.get("prior_set") is None:
+        context = dict(context, prior_set=priors.get_priors(context))
+
+    _contexts[name] = context
+
+
+def get_context(name: str = DEFAULT_CONTEXT) -> Dict[str, Any]:
+    """Keyword arguments of the likelihood given to `set_context` in this process"""
+
+    context = _contexts.get(name)
+    if context is None:
+        raise RuntimeError(f"`set_context` must be called before evaluating walkers ({name})")
+
+    return context
+
+
+def evaluate_walkers(
+    params: np.ndarray, vectorize: bool = True, name: str = DEFAULT_CONTEXT
+) -> List[Tuple[float, ...]]:
+    """Evaluate a batch of walkers with the keyword arguments given to `set_context`
+
+    Parameters
+    ----------
+    params : `np.ndarray`
+        Array of shape (n, 6) with the walkers to evaluate
+
+    vectorize : `bool`
+        Evaluate the whole batch at once with `log_likelihood_batch` instead of calling
+        `log_likelihood` on each walker. Both give exactly the same values
+
+    name : `str`
+        Name of the context to use
+
+    Returns
+    -------
+    results : `List[Tuple[float, ...]]`
+        Output of `log_likelihood` for each walker. If the context has the `reparameterize` flag,
+        walkers are in the sampled space of `transforms.py`, and the Jacobian of the map to their
+        physical parameters is added to the log-likelihood
+    """
+
+    context = get_context(name)
+
+    log_jacobian = None
+    if context.get("reparameterize", False):
+        params, log_jacobian = transforms.to_physical(params, context)
+
+    if vectorize:
+        results = log_likelihood_batch(params, **context)
+    else:
+        results = [log_likelihood(p, **context) for p in params]
+
+    if log_jacobian is None:
+        return results
+
+    log_L = transforms.add_jacobian(np.array([result[0] for result in results]), log_jacobian)
+
+    return [(value,) + tuple(result[1:]) for value, result in zip(log_L, results)]
+
+
+def evaluate_batch(params: np.ndarray, **kwargs: Any) -> Dict[str, np.ndarray]:
+    """Compute logarithm of the likelihood of an array of samples, together with the binary
+    parameters computed on the way
+
+    Parameters
+    ----------
+    params : `np.ndarray`
+        Array of shape (n, 6) with samples of the MCMC chain
+
+    kwargs : `dict`
+        Dictionary with stellar parameters of Cygnus X-1 (see `mcmc.py` for references)
+
+    Returns
+    -------
+    observables : `Dict[str, np.ndarray]`
+        Arrays of length n with the kick angles inside their limits (`theta`, `phi`), the
+        separation pre-SN (`a_pre`), the orbit after the kick (`a_post`, `p_post`, `e`, `cos_i`,
+        `inc` in deg and `v_sys`) and `log_L`. Values that were not computed because the sample
+        was rejected are NaN
+    """
+
+    observables: Dict[str, np.ndarray] = dict()
+    observables["log_L"] = _evaluate_batch(params, kwargs, observables)
+
+    return observables
+
+
+def fold_angles(theta: np.ndarray, phi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Bring arrays of kick angles inside their limits, 0 < theta < pi and 0 < phi < 2 * pi, the
+    same way `log_likelihood` does
+    """
+
+    phi = phi % (2 * np.pi)
+    theta = theta % (2 * np.pi)
+    theta = np.where((theta < 0) | (theta > np.pi), np.pi - (theta % np.pi), theta)
+
+    return theta, phi
+
+
+def _evaluate_batch(
+    params: np.ndarray, kwargs: Dict[str, Any], observables: Optional[Dict[str, np.ndarray]] = None
+) -> np.ndarray:
+    """Logarithm of the likelihood of an array of samples. Binary parameters are only stored in
+    `observables` if a dictionary is given
+    """
+
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    n = params.shape[0]
+
+    # set parameters at asymmetric kick initial moments
+    porb_pre = params[:, 0]
+    m1_pre = params[:, 1]
+    m2 = params[:, 2]
+    w = params[:, 3]
+    theta = params[:, 4]
+    phi = params[:, 5]
+
+    # check angles
+    theta, phi = fold_angles(theta, phi)
+
+    if observables is not None:
+        observables["theta"] = theta
+        observables["phi"] = phi
+        for key in ("a_pre", "a_post", "p_post", "e", "cos_i", "inc", "v_sys"):
+            observables[key] = np.full(n, np.nan)
+
+    # remove cases that are not physical nor likely, in the same order as in the scalar version.
+    # NaN values pass these cuts and end up as unbounded after the kick, also as in there
+    m2_lo = kwargs["M_2"] - kwargs["M_2_ERR"]
+    m2_hi = kwargs["M_2"] + kwargs["M_2_ERR"]
+    cuts = (
+        (telemetry.M1_BELOW_MBH, m1_pre < float(kwargs["M_BH"])),
+        (telemetry.W_NEGATIVE, w < 0e0),
+        (telemetry.P_NEGATIVE, porb_pre < 0e0),
+        (telemetry.ANGLES_OUTSIDE, (theta < 0) | (theta >= np.pi) | (phi < 0) | (phi >= 2 * np.pi)),
+        (telemetry.P_ABOVE_LIMIT, porb_pre > 1e3),
+        (telemetry.W_ABOVE_LIMIT, w > 600e0),
+        (telemetry.M2_OUTSIDE, (m2 < m2_lo) | (m2 > m2_hi)),
+    )
+
+    rejected = np.zeros(n, dtype=bool)
+    for _, cut in cuts:
+        rejected |= cut
+
+    # outcome of each evaluation, only needed for telemetry. first cut failed is the one counted
+    outcomes = None
+    if telemetry.is_active():
+        outcomes = np.full(n, telemetry.FINITE)
+        for code, cut in reversed(cuts):
+            outcomes[cut] = code
+
+    log_L = np.full(n, -np.inf)
+    idx = np.flatnonzero(~rejected)
+    if idx.size == 0:
+        _count_outcomes(outcomes, log_L)
+        return log_L
+
+    # evaluate kicks model, separation pre-SN included
+    kernel = kicks.get_kernel(kwargs.get("kick_kernel", "poskiorb"))
+    a_pre, a_post, p_post, e, cos_i, v_sys = kernel(
+        porb_pre[idx], m1_pre[idx], m2[idx], kwargs["M_BH"], w[idx], theta[idx], phi[idx]
+    )
+
+    # we dont want unbounded binaries
+    bounded = np.isfinite(e)
+    if logs.debug_enabled:
+        logger.debug(
+            "%d walkers :: %d non physical or unlikely, %d unbounded after kick",
+            n,
+            n - idx.size,
+            idx.size - np.count_nonzero(bounded),
         )
+    if outcomes is not None:
+        outcomes[idx[~bounded]] = telemetry.UNBOUND
+    if observables is not None:
+        observables["a_pre"][idx] = a_pre
+        observables["a_post"][idx] = a_post
+        observables["p_post"][idx] = p_post
+        observables["e"][idx] = e
+        observables["cos_i"][idx] = cos_i
+        observables["v_sys"][idx] = v_sys
+    idx = idx[bounded]
+    if idx.size == 0:
+        _count_outcomes(outcomes, log_L)
+        return log_L
+
+    # inclination to deg.
+    inc = np.rad2deg(np.arccos(cos_i[bounded]))
+    if observables is not None:
+        observables["inc"][idx] = inc
+
+    # compute priors to update likelihood
+    log_L_bounded = _lg_priors(p_post[bounded], e[bounded], m2[idx], v_sys[bounded], inc, kwargs)
+
+    # prior on theta, phi => isotropic distribution pdf = 0.5 * sin(θ)
+    log_L_bounded += np.log(np.sin(theta[idx]))
+
+    log_L[idx] = log_L_bounded
+    _count_outcomes(outcomes, log_L)
+
+    return log_L
+
+
+def _count_outcomes(outcomes: Optional[np.ndarray], log_L: np.ndarray) -> None:
+    """Send outcomes of `log_likelihood_batch` to telemetry, marking evaluations that survived
+    the cuts but have a -inf likelihood because of the priors
+    """
+
+    if outcomes is None:
+        return
+
+    outcomes[(outcomes == telemetry.FINITE) & ~np.isfinite(log_L)] = telemetry.ZERO_PRIOR
+    telemetry.count_many(outcomes)
+
+
+def _lg_priors(
+    p_post: Any, e: Any, m2: Any, v_sys: Any, inc: Any, kwargs: Dict[str, Any]
+) -> Union[float, np.ndarray]:
+    """Sum of the logarithm of the priors on the post-kick observables of Cygnus X-1
+
+    Shared by `log_likelihood` and `log_likelihood_batch` so that both add the terms in the same
+    order. Priors are the ones of `priors.build_priors`
+    """
+
+    # evaluators of the context of this process (see `set_context`). keyword arguments given
+    # explicitly without them fall back to the cache of `priors.get_priors`
+    prior_set = kwargs.get("prior_set")
+    if prior_set is None:
+        prior_set = priors.get_priors(kwargs)
+
+    try:
+        log_L = prior_set["p_orb"](p_post)
+        log_L += prior_set["e"](e)
+        log_L += prior_set["m2"](m2)
+        log_L += prior_set["v_sys"](v_sys)
+        log_L += prior_set["i"](inc)
 
     except TypeError:
         logger.critical(
@@ -152,18 +466,7 @@ def log_likelihood(args: List[float], **kwargs: float) -> float:
         sys.exit()
 
     except Exception as exc:
-        logger.critical(f"could not compute log_L: {str(exc)}")
+        logger.critical("could not compute log_L: %s", exc)
         sys.exit()
 
-    # prior on theta, phi => isotropic distribution pdf = 0.5 * sin(θ)
-    log_L += np.log(np.sin(theta))
-
-    # debugging stuff
-    if log_L != -np.inf:
-        logger.debug(
-            f"{binary_str} :: "
-            f"P = {p_post:.2e}, e = {e:.2f}, i = {inc:.2e}, v_sys = {v_sys:.2e} => "
-            f"log_L = {log_L:.2f}"
-        )
-
     return log_L
@@ -0,0 +1,90 @@
+"""Logging helpers for the MCMC modules
+
+Records of every process, including the workers of a `multiprocessing.Pool`, are sent through a
+queue to a single listener in the main process, which is the only one writing to the log file
+"""
+
+from typing import Optional, Tuple
+
+import logging
+import logging.handlers
+import multiprocessing
+
+LOG_FORMAT = "%(asctime)s -- %(levelname)s -- %(message)s (%(funcName)s in %(filename)s:%(lineno)s)"
+LOG_DATEFMT = "%H:%M:%S"
+
+# cached check of the DEBUG level, to use in hot paths as `if logs.debug_enabled: ...`
+debug_enabled = False
+
+# queue shared with the workers & listener writing its records to file
+_queue: Optional["multiprocessing.Queue[logging.LogRecord]"] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _set_root_logger(queue: "multiprocessing.Queue[logging.LogRecord]", level: int) -> None:
+    """Send records of the root logger to `queue` and update the cached level check"""
+
+    global debug_enabled
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(queue))
+    root.setLevel(level)
+
+    debug_enabled = root.isEnabledFor(logging.DEBUG)
+
+
+def start_logging(filename: str, debug: bool = False) -> None:
+    """Start the single writer of log records in the main process
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the log file
+
+    debug : `bool`
+        Flag to enable DEBUG level
+    """
+
+    global _queue, _listener
+
+    level = logging.INFO
+    if debug:
+        level = logging.DEBUG
+
+    handler = logging.FileHandler(filename, mode="w")
+    handler.setFormatter(logging.Formatter(LOG_FORMAT, datefmt=LOG_DATEFMT))
+
+    _queue = multiprocessing.Queue(-1)
+    _listener = logging.handlers.QueueListener(_queue, handler)
+    _listener.start()
+
+    _set_root_logger(_queue, level)
+
+
+def stop_logging() -> None:
+    """Write pending records and stop the listener started by `start_logging`"""
+
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def worker_initargs() -> Tuple["multiprocessing.Queue[logging.LogRecord]", int]:
+    """Arguments for `init_worker` when creating a pool of workers"""
+
+    if _queue is None:
+        raise RuntimeError("`start_logging` must be called before creating workers")
+
+    return _queue, logging.getLogger().level
+
+
+def init_worker(queue: "multiprocessing.Queue[logging.LogRecord]", level: int) -> None:
+    """Initializer of pool workers: send their log records to the main process"""
+
+    _set_root_logger(queue, level)
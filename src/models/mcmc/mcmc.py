@@ -1,28 +1,57 @@
 """Markov Chain Montecarlo calculation of stellar parameters of Cygnus X-1
+
+`emcee` takes about a second to import, as it loads `scipy.stats`. Pool workers, which import this
+module to build their likelihood context, and `--help` do not need it, so it is only imported by
+the functions that run the sampler
 """
 
-from typing import Any, Union
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple, Union
 
 import argparse
+import functools
 import logging
 import os
 import sys
 import time
 import warnings
-from multiprocessing import Pool
 from pathlib import Path
 
-import emcee
-import likelihood
 import numpy as np
 import yaml
 
+from . import (
+    checkpoint,
+    executors,
+    initialization,
+    kicks,
+    likelihood,
+    logs,
+    profiling,
+    samplers,
+    summaries,
+    telemetry,
+    transforms,
+)
+from .convergence import ConvergenceMonitor
+from .priors import build_priors
+
+if TYPE_CHECKING:
+    import emcee
+
 # print options
 np.set_printoptions(precision=4)
 
 # hide warnings
 warnings.filterwarnings("ignore")
 
+# logging stuff, records are written once `set_logger` is called
+logger = logging.getLogger("MCMC")
+
+# largest number of stored steps read to estimate the burn-in of a run
+_BURN_IN_ROWS = 10000
+
 
 desc = """ Monte Carlo evaluation of stellar parameters of the HMXB Cygnus X-1, using Markov
 chain approach based on the `emcee` python module
@@ -51,26 +80,52 @@ def parse_args() -> argparse.Namespace:
         dest="debug",
         help="enable debug mode",
     )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        default=False,
+        dest="resume",
+        help="resume a previous run from its backend instead of starting a new chain",
+    )
+    parser.add_argument(
+        "-e",
+        "--executor",
+        choices=executors.EXECUTORS,
+        default=None,
+        dest="executor",
+        help="backend evaluating the walkers (`mpi` needs to be launched with `mpirun`). default: "
+        "`serial` with `vectorize: True` in the configuration file, `processes` otherwise",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        default=None,
+        dest="workers",
+        help="number of workers of the `processes` executor (default: all cores)",
+        type=int,
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        default=False,
+        dest="profile",
+        help="profile the main process & every worker, merging their stats into a report written "
+        "to a `.profile` directory next to the backend",
+    )
 
     return parser.parse_args()
 
 
 # logging stuff
 def set_logger(debug: bool = False):
-    """Set logging stuff"""
+    """Set logging stuff
 
-    # enable debug if requested
-    level = logging.INFO
-    if debug:
-        level = logging.DEBUG
+    Records of this process and of the pool workers go through a queue to a single writer of the
+    `.mcmc.log` file (see `logs.py`)
+    """
 
-    logging.basicConfig(
-        filename=".mcmc.log",
-        filemode="w",
-        format="%(asctime)s -- %(levelname)s -- %(message)s (%(funcName)s in %(filename)s:%(lineno)s)",
-        datefmt="%H:%M:%S",
-        level=level,
-    )
+    logs.start_logging(filename=".mcmc.log", debug=debug)
 
     logger = logging.getLogger("MCMC")
 
@@ -97,8 +152,33 @@ def load_yaml(fname: Union[str, Path]) -> Any:
         return yaml.load(f, Loader=yaml.FullLoader)
 
 
-def main(config_file: str = "") -> None:
-    """Main driver of MCMC chain evaluation"""
+def main(
+    config_file: str = "",
+    resume: bool = False,
+    executor: Optional[str] = None,
+    workers: Optional[int] = None,
+    profile: bool = False,
+) -> None:
+    """Main driver of MCMC chain evaluation
+
+    Parameters
+    ----------
+    config_file : `str`
+        Configuration filename
+
+    resume : `bool`
+        Flag to continue a previous run stored in the backend, only doing its remaining steps
+
+    executor : `str`
+        Backend evaluating the walkers, one of `executors.EXECUTORS`. If None, `serial` in
+        vectorized mode and `processes` otherwise
+
+    workers : `int`
+        Number of workers of the `processes` executor, all cores if None
+
+    profile : `bool`
+        Flag to profile this process & the workers (see `profiling.py`)
+    """
 
     logger.info("setting Markov Chain Monte Carlo simulation")
 
@@ -106,100 +186,581 @@ def main(config_file: str = "") -> None:
     config = load_yaml(fname=config_file)
 
     # set some constant values
-    nwalkers = config["MCMC"].get("walkers")
-    ndim = config["MCMC"].get("dimension")
     nsteps = config["MCMC"].get("steps")
-    use_rand_uniform = config["MCMC"].get("use_random_uniform_walkers")
     progress = config["MCMC"].get("progress_bar")
-    priors = config["MCMC"].get("priorDistributions")
+    vectorize = config["MCMC"].get("vectorize", False)
+    report_every = config["MCMC"].get("telemetry_every", 1000)
+    checkpoint_every = config["MCMC"].get("checkpoint_every", 1000)
     filename = config["MCMC"].get("filename")
 
-    # Cygnus X-1 properties
-    stellarParameters = config["StellarParameters"]
+    if executor is None:
+        executor = "serial" if vectorize else "processes"
 
-    # initial guess for parameter values
-    # [p_pre   m1_pre    m2    w      theta     phi]
-    initialGuess = config["MCMC"].get("initialGuess")
-    initial_values = [
-        initialGuess.get("porb_preSN"),
-        initialGuess.get("m1_preSN"),
-        initialGuess.get("m2"),
-        initialGuess.get("w"),
-        initialGuess.get("theta"),
-        initialGuess.get("phi"),
+    backend, initial, chash = open_backend(config, resume)
+
+    # only run the steps that are missing
+    start_step = backend.iteration
+    if start_step >= nsteps:
+        logger.info(f"chain already has {start_step} steps, nothing to do")
+        return
+    if start_step > 0:
+        logger.info(f"resuming at step {start_step}, {nsteps - start_step} steps to go")
+
+    # keyword arguments of the likelihood, built once in this process. workers build their own
+    # copy when they start (see `init_worker`), so that tasks only carry walker positions
+    try:
+        likelihood.set_context(likelihood_context(config))
+    except ValueError as exc:
+        logger.critical(f"could not set likelihood: {str(exc)}")
+        sys.exit(1)
+
+    # optional early stop once the chain has converged
+    monitor = convergence_monitor(config, backend)
+
+    # quantiles & histograms of the posterior, updated at every step
+    posterior = summaries.build_summaries(config, backend)
+    summaries_every = config["MCMC"].get("summaries", dict()).get("write_every")
+
+    # counters of likelihood evaluations, reported next to the backend
+    nworkers = executors.number_of_workers(executor, workers)
+    stats = telemetry.Telemetry(
+        nslots=nworkers + 1,
+        filename=str(Path(filename).with_suffix(".telemetry.jsonl")),
+        start_step=start_step,
+        executor=executor,
+        workers=nworkers,
+    )
+
+    # profiles of this process & of the workers, merged once the run ends
+    profile_dir = None
+    if profile:
+        profile_dir = profiling.profile_directory(filename)
+        profiling.reset(profile_dir)
+
+    # MPI workers may live on other nodes, they can share neither log queue nor counters
+    config_files = {likelihood.DEFAULT_CONTEXT: str(Path(config_file).resolve())}
+    initargs: Tuple[Any, ...] = (config_files, None, None, profile_dir)
+    if executor != "mpi":
+        initargs = (config_files, logs.worker_initargs(), stats.initargs(), profile_dir)
+
+    print("starting Monte Carlo simulation")
+    with profiling.profiled(profile_dir), executors.executor_pool(
+        executor, workers, initializer=init_worker, initargs=initargs
+    ) as pool:
+        try:
+            sampler = make_sampler(config, backend, pool, nworkers)
+        except ValueError as exc:
+            logger.critical(f"could not set sampler: {str(exc)}")
+            sys.exit(1)
+
+        # run MCMC
+        start = time.perf_counter()
+        run_sampler(
+            sampler,
+            initial,
+            nsteps - start_step,
+            progress,
+            stats,
+            report_every,
+            checkpoint_every,
+            chash,
+            monitor,
+            posterior,
+            summaries_every,
+        )
+
+    if profile_dir is not None:
+        # MPI workers write their profiles once the pool is closed
+        if executor == "mpi":
+            profiling.wait_for_profiles(profile_dir, nworkers + 1)
+        for line in profiling.write_report(profile_dir):
+            logger.info(line)
+        logger.info(f"profile report written to `{profile_dir}`")
+
+    # effective samples per CPU-second, to compare samplers for the same configuration
+    efficiency = samplers.sampling_efficiency(
+        sampler,
+        start_step,
+        time.perf_counter() - start,
+        nworkers,
+        burn=config["MCMC"].get("burn", 0),
+        tau=None if monitor is None else monitor.tau,
+    )
+    stats.write(efficiency)
+    logger.info(
+        f"τ = {np.array2string(np.array(efficiency['tau']), precision=1)} :: "
+        f"{efficiency['min_effective_samples']:.1f} effective samples, "
+        f"{efficiency['effective_samples_per_cpu_second']:.3f} per CPU-second"
+    )
+    if "swap_acceptance_fraction" in efficiency:
+        swaps = np.array(efficiency["swap_acceptance_fraction"])
+        logger.info(f"swap acceptance between temperatures: {np.array2string(swaps, precision=3)}")
+
+    # steps the walkers took to settle, against the burn-in of the configuration. only about
+    # `_BURN_IN_ROWS` stored steps are read
+    spacing = max(backend.iteration // _BURN_IN_ROWS, 1)
+    spacing = max(spacing // backend.thin, 1) * backend.thin
+    nburn = config["MCMC"].get("burn", 0)
+    settled = initialization.burn_in(
+        backend.get_log_prob(thin=spacing), config["MCMC"].get("dimension"), spacing
+    )
+    start_from = "uniform" if config["MCMC"].get("use_random_uniform_walkers") else "map"
+    stats.write(
+        {"burn_in": {"initialization": start_from, "estimated": settled, "configured": nburn}}
+    )
+    logger.info(
+        f"walkers reached the typical set after ~{settled} steps, `burn` is {nburn}"
+        + (f" :: {nburn - settled} steps of burn-in could be saved" if settled < nburn else "")
+    )
+
+    # cost of storing the chain, and time the sampler waited for it
+    writes = backend.write_stats()
+    stats.write({"backend": writes})
+    logger.info(
+        f"chain written in {writes['writes']} writes of {writes['bytes_per_write'] / 1024:.1f} kB, "
+        f"{1e3 * writes['time_per_write']:.2f} ms each :: sampler waited "
+        f"{writes['wait_time']:.3f} s"
+    )
+
+
+def make_sampler(
+    config: Dict[str, Any],
+    backend: emcee.backends.HDFBackend,
+    pool: Any,
+    nbatches: int,
+    context: str = likelihood.DEFAULT_CONTEXT,
+    seed: Optional[np.random.SeedSequence] = None,
+) -> Union[emcee.EnsembleSampler, samplers.TemperedEnsemble]:
+    """Sampler sending its ensemble to a pool of workers, in `nbatches` batches of walkers
+
+    Proposals are given by the `moves` option of the configuration. If its `tempering` option has
+    more than one temperature, the sampler is a parallel tempering ladder whose cold ensemble is
+    stored in `backend`
+
+    Parameters
+    ----------
+    config : `Dict[str, Any]`
+        Configuration loaded from the YAML file
+
+    backend : `emcee.backends.HDFBackend`
+        Backend of the run
+
+    pool : `multiprocessing.Pool / mpi4py.futures.MPIPoolExecutor / None`
+        Pool of workers given by `executors.executor_pool`
+
+    nbatches : `int`
+        Number of batches of walkers sent to the pool at each step
+
+    context : `str`
+        Name of the likelihood context of the run (see `likelihood.set_context`)
+
+    seed : `np.random.SeedSequence`
+        Seed of the random numbers of the sampler. If None, ensembles take the global state of
+        `np.random`, as done by `emcee`
+
+    Returns
+    -------
+    sampler : `emcee.EnsembleSampler / samplers.TemperedEnsemble`
+        Sampler of the run
+    """
+
+    import emcee
+
+    fn = functools.partial(
+        likelihood.evaluate_walkers,
+        vectorize=config["MCMC"].get("vectorize", False),
+        name=context,
+    )
+    log_prob_fn = executors.WalkerBatches(telemetry.Timed(fn), pool, nbatches)
+
+    tempering = config["MCMC"].get("tempering", dict())
+    betas = samplers.temperature_ladder(
+        tempering.get("temperatures", 1), tempering.get("max_temperature", 20.0)
+    )
+
+    ensembles = [
+        emcee.EnsembleSampler(
+            nwalkers=config["MCMC"].get("walkers"),
+            ndim=config["MCMC"].get("dimension"),
+            log_prob_fn=log_prob_fn if beta == 1 else samplers.Tempered(log_prob_fn, beta),
+            moves=samplers.build_moves(config["MCMC"].get("moves")),
+            blobs_dtype=likelihood.BLOBS_DTYPE,
+            backend=backend if beta == 1 else None,
+            vectorize=True,
+        )
+        for beta in betas
     ]
 
-    # add some randomness to initial values
-    if use_rand_uniform:
-        rng_lo = initialGuess.get("porb_preSN_lo") - initial_values[0]
-        rng_hi = initialGuess.get("porb_preSN_hi") - initial_values[0]
-        porb_rng = np.random.uniform(rng_lo, rng_hi, nwalkers)
+    # one stream of random numbers per ensemble, and one for the exchanges of walkers
+    swap_seed = None
+    if seed is not None:
+        *ensemble_seeds, swap_seed = seed.spawn(len(ensembles) + 1)
+        for ensemble, ensemble_seed in zip(ensembles, ensemble_seeds):
+            bit_generator = np.random.MT19937(ensemble_seed)
+            ensemble.random_state = np.random.RandomState(bit_generator).get_state()
 
-        rng_lo = initialGuess.get("m1_preSN_lo") - initial_values[1]
-        rng_hi = initialGuess.get("m1_preSN_hi") - initial_values[1]
-        m1_rng = np.random.uniform(rng_lo, rng_hi, nwalkers)
+    if len(ensembles) == 1:
+        return ensembles[0]
 
-        rng_lo = initialGuess.get("m2_lo") - initial_values[2]
-        rng_hi = initialGuess.get("m2_hi") - initial_values[2]
-        m2_rng = np.random.uniform(rng_lo, rng_hi, nwalkers)
+    logger.info(f"parallel tempering over temperatures {np.array2string(1 / betas, precision=2)}")
+    sampler = samplers.TemperedEnsemble(
+        ensembles, betas, tempering.get("swap_every", 1), seed=swap_seed
+    )
 
-        rng_lo = initialGuess.get("w_lo") - initial_values[3]
-        rng_hi = initialGuess.get("w_hi") - initial_values[3]
-        w_rng = np.random.uniform(rng_lo, rng_hi, nwalkers)
+    # hot ensembles of a resumed run continue from the checkpoint, if it has them
+    if backend.iteration > 0:
+        ckpt_filename = checkpoint.checkpoint_filename(backend.filename)
+        sampler.hot_states = checkpoint.load_hot_states(ckpt_filename, betas)
+        if sampler.hot_states is None:
+            logger.info("no hot ensembles found in checkpoint, starting them from cold walkers")
 
-        rng_lo = initialGuess.get("theta_lo") - initial_values[4]
-        rng_hi = initialGuess.get("theta_hi") - initial_values[4]
-        theta_rng = np.random.uniform(rng_lo, rng_hi, nwalkers)
+    return sampler
 
-        rng_lo = initialGuess.get("phi_lo") - initial_values[5]
-        rng_hi = initialGuess.get("phi_hi") - initial_values[5]
-        phi_rng = np.random.uniform(rng_lo, rng_hi, nwalkers)
 
-        randomness = np.column_stack((porb_rng, m1_rng, m2_rng, w_rng, theta_rng, phi_rng))
-    else:
-        logger.critical("`use_random_uniform_walkers` = False is not yet supported")
+def initial_walkers(config: Dict[str, Any]) -> np.ndarray:
+    """Initial position of the walkers: spread over the ranges of the initial guess of the
+    configuration with `use_random_uniform_walkers`, otherwise in a small ball around the maximum
+    a posteriori, all of them with a finite likelihood (see `initialization.py`)
+
+    Parameters
+    ----------
+    config : `Dict[str, Any]`
+        Configuration loaded from the YAML file
+
+    Returns
+    -------
+    initial : `np.ndarray`
+        Array of shape (walkers, dimension), in the sampled space of `transforms.py` if the
+        `reparameterize` option is set
+    """
+
+    nwalkers = config["MCMC"].get("walkers")
+    use_rand_uniform = config["MCMC"].get("use_random_uniform_walkers")
+
+    # initial guess for parameter values, and limits of each parameter
+    # [p_pre   m1_pre    m2    w      theta     phi]
+    initialGuess = config["MCMC"].get("initialGuess")
+    options = config["MCMC"].get("initialization", dict())
+
+    # log-likelihood of the physical parameters, evaluated in batches by this process
+    kwargs = likelihood_context(config)
+
+    def log_prob_fn(params: np.ndarray) -> np.ndarray:
+        return likelihood.evaluate_batch(params, **kwargs)["log_L"]
+
+    try:
+        if use_rand_uniform:
+            _, lo, hi = initialization.guess_bounds(initialGuess)
+            initial = initialization.uniform_walkers(lo, hi, nwalkers, np.random.default_rng())
+        else:
+            initial, report = initialization.map_walkers(
+                log_prob_fn, initialGuess, nwalkers, options
+            )
+            logger.info(
+                f"{nwalkers} walkers around the MAP with log L in "
+                f"[{report['walkers_log_prob'][0]:.3f}, {report['walkers_log_prob'][1]:.3f}] :: "
+                f"{sum(report['evaluations'].values())} evaluations"
+            )
+    except ValueError as exc:
+        logger.critical(f"could not set initial walkers: {str(exc)}")
         sys.exit(1)
 
-    # initial walkers
-    logging.debug("Initial walkers")
-    initial = initial_values + randomness
-    for k, el in enumerate(initial):
-        logging.debug(f"walker {k}: {el}")
+    finite = np.isfinite(log_prob_fn(initial))
+    logger.info(f"{finite.sum()} of {nwalkers} initial walkers have a finite likelihood")
+
+    if logs.debug_enabled:
+        logging.debug("Initial walkers")
+        for k, el in enumerate(initial):
+            logging.debug("walker %d: %s", k, el)
+
+    if config["MCMC"].get("reparameterize", False):
+        initial = transforms.to_sampled(initial, config["StellarParameters"])
+
+    return initial
+
+
+def open_backend(
+    config: Dict[str, Any], resume: bool = False
+) -> Tuple[emcee.backends.HDFBackend, Union[np.ndarray, emcee.State], str]:
+    """Open the HDF5 backend of a run. A previous run is only kept when resuming it
+
+    Parameters
+    ----------
+    config : `Dict[str, Any]`
+        Configuration loaded from the YAML file
+
+    resume : `bool`
+        Flag to continue the run stored in the backend
+
+    Returns
+    -------
+    backend : `emcee.backends.HDFBackend`
+        Backend of the run
 
-    # need a numpy array to start emcee
-    initial = np.array(initial)
+    initial : `np.ndarray / emcee.State`
+        Initial position of the walkers of a new chain (see `initial_walkers`), or state of the
+        run being resumed
 
-    # output handling (backend emcee)
+    chash : `str`
+        Hash of the configuration (see `checkpoint.config_hash`)
+    """
+
+    from .backends import BufferedHDFBackend, PhysicalHDFBackend
+
+    nwalkers = config["MCMC"].get("walkers")
+    ndim = config["MCMC"].get("dimension")
+    filename = config["MCMC"].get("filename")
+
+    # output handling (backend emcee). a previous run is only kept when resuming it
+    chash = checkpoint.config_hash(config)
+    ckpt_filename = checkpoint.checkpoint_filename(filename)
+    options = config["MCMC"].get("backend", dict())
     try:
-        os.remove(filename)
-    except FileNotFoundError:
-        pass
-    backend = emcee.backends.HDFBackend(filename)
-    backend.reset(nwalkers, ndim)
+        kwargs = dict(
+            buffer_steps=options.get("buffer_steps", 100),
+            thin=options.get("thin", 1),
+            codec=options.get("codec", "none"),
+        )
+        if config["MCMC"].get("reparameterize", False):
+            backend = PhysicalHDFBackend(filename, config["StellarParameters"], **kwargs)
+        else:
+            backend = BufferedHDFBackend(filename, **kwargs)
+    except ValueError as exc:
+        logger.critical(f"could not set backend: {str(exc)}")
+        sys.exit(1)
+    if resume and os.path.isfile(filename):
+        try:
+            initial = checkpoint.restore(backend, nwalkers, ndim, chash)
+        except (OSError, ValueError) as exc:
+            logger.critical(f"cannot resume run stored in `{filename}`: {str(exc)}")
+            sys.exit(1)
+    else:
+        if resume:
+            logger.info(f"`{filename}` not found, starting a new chain")
+        for fname in (filename, ckpt_filename, summaries.summaries_filename(filename)):
+            try:
+                os.remove(fname)
+            except FileNotFoundError:
+                pass
+        backend.reset(nwalkers, ndim)
+        checkpoint.mark_backend(backend, chash)
+        initial = initial_walkers(config)
+
+    return backend, initial, chash
+
+
+def convergence_monitor(
+    config: Dict[str, Any], backend: emcee.backends.HDFBackend
+) -> Optional[ConvergenceMonitor]:
+    """Convergence check of the `convergence` options, None if it is not enabled"""
+
+    convergence_options = config["MCMC"].get("convergence", dict())
+    if not convergence_options.get("enabled", False):
+        return None
+
+    monitor = ConvergenceMonitor(
+        check_every=convergence_options.get("check_every", 1000),
+        n_tau=convergence_options.get("n_tau", 50),
+        tau_tol=convergence_options.get("tau_tol", 0.01),
+    )
+    if backend.iteration > 0:
+        monitor.load_history(backend)
+
+    return monitor
+
+
+def likelihood_context(config: Dict[str, Any]) -> Dict[str, Any]:
+    """Keyword arguments of the likelihood for a given configuration
+
+    Parameters
+    ----------
+    config : `Dict[str, Any]`
+        Configuration loaded from the YAML file
+
+    Returns
+    -------
+    kwargs : `Dict[str, Any]`
+        Stellar parameters of Cygnus X-1, prior distributions, prior evaluators (`prior_set`) and
+        name of the kicks model (`kick_kernel`)
+    """
+
+    priors = config["MCMC"].get("priorDistributions")
+    stellarParameters = config["StellarParameters"]
+    kick_kernel = config["MCMC"].get("kick_kernel", "poskiorb")
 
     # update kwargs dict with info regarding priors
     kwargs = dict()
     kwargs.update(stellarParameters)
     kwargs.update(priors)
 
-    print("starting Monte Carlo simulation")
-    with Pool() as pool:
-        sampler = emcee.EnsembleSampler(
-            nwalkers=nwalkers,
-            ndim=ndim,
-            log_prob_fn=likelihood.log_likelihood,
-            pool=pool,
-            backend=backend,
-            kwargs=kwargs,
+    # walkers in the unconstrained space of `transforms.py`
+    kwargs["reparameterize"] = config["MCMC"].get("reparameterize", False)
+
+    # prior evaluators & implementation of the kicks model
+    kwargs["prior_set"] = build_priors(priors, stellarParameters)
+    kicks.get_kernel(kick_kernel)
+    kwargs["kick_kernel"] = kick_kernel
+
+    return kwargs
+
+
+def init_worker(
+    config_files: Dict[str, str],
+    log_args: Optional[Tuple[Any, ...]] = None,
+    telemetry_args: Optional[Tuple[Any, ...]] = None,
+    profile_dir: Optional[str] = None,
+) -> None:
+    """Initializer of pool workers: load the configurations & build their likelihood contexts
+    once for the whole run, plus logging & telemetry counters when shared with the main process,
+    and profiling when asked for
+
+    Parameters
+    ----------
+    config_files : `Dict[str, str]`
+        Configuration filename of each likelihood context, by name
+
+    log_args, telemetry_args : `Tuple`
+        Arguments of `logs.init_worker` & `telemetry.init_worker`, not used if None
+
+    profile_dir : `str`
+        Profile directory of the run (see `profiling.py`), not profiled if None
+    """
+
+    if profile_dir is not None:
+        profiling.init_worker(profile_dir)
+
+    if log_args is not None:
+        logs.init_worker(*log_args)
+    if telemetry_args is not None:
+        telemetry.init_worker(*telemetry_args)
+
+    for name, config_file in config_files.items():
+        likelihood.set_context(likelihood_context(load_yaml(config_file)), name)
+
+
+def run_sampler(
+    sampler: Union[emcee.EnsembleSampler, samplers.TemperedEnsemble],
+    initial: np.ndarray,
+    nsteps: int,
+    progress: bool,
+    stats: Optional[telemetry.Telemetry],
+    report_every: int,
+    checkpoint_every: int,
+    chash: str,
+    monitor: Optional[ConvergenceMonitor] = None,
+    posterior: Optional[summaries.PosteriorSummaries] = None,
+    summaries_every: Optional[int] = None,
+) -> None:
+    """Run MCMC, reporting telemetry of the sampler every `report_every` steps and saving a
+    checkpoint every `checkpoint_every` steps. If a convergence monitor is given, sampling stops
+    as soon as the chain has converged. Streaming summaries of the posterior, if given, are
+    updated at every step and written with every checkpoint (and every `summaries_every` steps)
+
+    Parameters
+    ----------
+    sampler : `emcee.EnsembleSampler / samplers.TemperedEnsemble`
+        Sampler to run
+
+    initial : `np.ndarray / emcee.State`
+        Initial position of walkers, or state of a run being resumed
+
+    nsteps : `int`
+        Number of steps to perform
+
+    progress : `bool`
+        Flag to show a progress bar
+
+    stats : `telemetry.Telemetry`
+        Counters of likelihood evaluations. If None, no telemetry is reported
+
+    report_every : `int`
+        Number of steps between telemetry reports
+
+    checkpoint_every : `int`
+        Number of steps between checkpoints
+
+    chash : `str`
+        Hash of the configuration, stored in checkpoints
+
+    monitor : `ConvergenceMonitor`
+        Convergence check based on the autocorrelation time of the chain
+
+    posterior : `summaries.PosteriorSummaries`
+        Streaming summaries of the posterior. If None, no summaries are kept
+
+    summaries_every : `int`
+        Number of steps between writes of the summaries, besides those done with checkpoints. If
+        None, summaries are only written with checkpoints
+    """
+
+    ckpt_filename = checkpoint.checkpoint_filename(sampler.backend.filename)
+    summaries_filename = summaries.summaries_filename(sampler.backend.filename)
+
+    # parallel tempering also checkpoints its hot ensembles
+    tempered: Dict[str, Any] = dict()
+    if isinstance(sampler, samplers.TemperedEnsemble):
+        tempered = {"hot_states": sampler.hot_states, "betas": sampler.betas}
+
+    state = None
+    for state in sampler.sample(initial, iterations=nsteps, progress=progress):
+        if stats is not None and sampler.iteration % report_every == 0:
+            summary = stats.report(sampler.iteration, sampler.acceptance_fraction)
+            logger.info(telemetry.format_summary(summary))
+
+        if posterior is not None:
+            posterior.update(state, sampler.iteration)
+
+        if sampler.iteration % checkpoint_every == 0:
+            if tempered:
+                tempered["hot_states"] = sampler.hot_states
+            # resuming rolls the chain back to the checkpoint, so its steps must be in the file
+            sampler.backend.flush(wait=True)
+            checkpoint.save(
+                ckpt_filename, state, sampler.iteration, sampler.backend.accepted, chash, **tempered
+            )
+
+        # summaries written with a checkpoint are reused when resuming from it
+        if posterior is not None and (
+            sampler.iteration % checkpoint_every == 0
+            or (summaries_every and sampler.iteration % summaries_every == 0)
+        ):
+            posterior.save(summaries_filename)
+
+        if monitor is not None and monitor.converged(sampler):
+            logger.info(f"chain converged after {sampler.iteration} steps, stopping")
+            break
+
+    # last report & checkpoint, unless they were just done
+    if stats is not None and sampler.iteration % report_every != 0:
+        summary = stats.report(sampler.iteration, sampler.acceptance_fraction)
+        logger.info(telemetry.format_summary(summary))
+
+    # steps still buffered by the backend
+    sampler.backend.close()
+
+    if state is not None and sampler.iteration % checkpoint_every != 0:
+        if tempered:
+            tempered["hot_states"] = sampler.hot_states
+        checkpoint.save(
+            ckpt_filename, state, sampler.iteration, sampler.backend.accepted, chash, **tempered
         )
 
-        # run MCMC
-        sampler.run_mcmc(initial, nsteps, progress=progress)
+    if posterior is not None and state is not None:
+        posterior.save(summaries_filename)
 
 
-if __name__ == "__main__":
+def cli() -> None:
+    """Entry point of the command line"""
+
     args = parse_args()
 
+    # every MPI rank but 0 only evaluates walkers sent by the sampler
+    if args.executor == "mpi" and executors.mpi_rank() != 0:
+        executors.serve_mpi_workers()
+        # write the profile of this worker, if rank 0 asked for it
+        profiling.stop()
+        sys.exit(0)
+
     logger = set_logger(args.debug)
 
     logger.info("********************************************************")
@@ -209,9 +770,28 @@ if __name__ == "__main__":
     # time it
     _startTime = time.time()
 
-    main(config_file=args.config_file)
+    try:
+        main(
+            config_file=args.config_file,
+            resume=args.resume,
+            executor=args.executor,
+            workers=args.workers,
+            profile=args.profile,
+        )
 
-    # time it
-    _endTime = time.time()
+        # time it
+        _endTime = time.time()
 
-    logger.info(f"[-- manager uptime: {_endTime - _startTime:.2f} sec --]")
+        logger.info(f"[-- manager uptime: {_endTime - _startTime:.2f} sec --]")
+
+    finally:
+        # MPI workers wait for rank 0 to open its pool, even if it ended before sampling
+        if args.executor == "mpi":
+            executors.release_mpi_workers()
+
+        # flush log records
+        logs.stop_logging()
+
+
+if __name__ == "__main__":
+    cli()
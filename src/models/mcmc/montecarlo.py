@@ -0,0 +1,396 @@
+"""Direct Monte Carlo alternative to the MCMC: importance sampling of the pre-SN parameters
+
+Pre-SN binaries are drawn uniformly inside the ranges of `initialGuess` (orbital period, masses and
+kick strength) with an isotropic kick direction (cos θ uniform in [-1, 1] & φ uniform in
+[0, 2π)), and each one is weighted by the likelihood of `likelihood.py`. As the isotropic prior on
+the kick direction is the density of the draws, the weight of a binary is its likelihood without
+the sin θ term:
+
+    log(weight) = log_L - log(sin θ)
+
+so that the weighted draws follow the same posterior as the chain of `mcmc.py`, restricted to the
+ranges of `initialGuess`. Draws are evaluated in blocks of `block_size` binaries by a pool of
+workers, and only the ones with non-zero weight are written to the output file, block after block,
+in the same `mcmc/pre-cc` & `mcmc/post-cc` tables as `src/data/make_dataset.py` plus their log of
+the weight (`mcmc/weights`, see `src/data/processed.py`). With `resample: N`, the file instead
+gets N draws taken with replacement with probability proportional to their weight, which need no
+weights afterwards. In both cases memory only depends on the size of a block, not on the number
+of draws
+"""
+
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import argparse
+import itertools
+import logging
+import sys
+import time
+from pathlib import Path
+
+import h5py
+import numpy as np
+
+from . import executors, likelihood, logs
+from .mcmc import init_worker, likelihood_context, load_yaml
+from .tables import TABLES, open_tables, stack_rows
+
+logger = logging.getLogger("MCMC")
+
+# names of the pre-SN parameters drawn uniformly inside the ranges of `initialGuess`
+UNIFORM_PARAMETERS = ("porb_preSN", "m1_preSN", "m2", "w")
+
+# tables of the output file: the ones of the processed chain & the weight of each row
+WEIGHTED_TABLES = dict(TABLES, weights=("log_weight",))
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        description="importance sampling of the pre-SN parameters of Cygnus X-1",
+        epilog="@asimazbunzel on GitHub",
+    )
+    parser.add_argument(
+        "-C",
+        "--config-file",
+        dest="config_file",
+        help="path to configuration file in YAML format",
+        type=str,
+    )
+    parser.add_argument(
+        "-d",
+        "--debug",
+        action="store_true",
+        default=False,
+        dest="debug",
+        help="enable debug mode",
+    )
+    parser.add_argument(
+        "-e",
+        "--executor",
+        choices=executors.EXECUTORS,
+        default="processes",
+        dest="executor",
+        help="backend evaluating the draws (`mpi` needs to be launched with `mpirun`)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        default=None,
+        dest="workers",
+        help="number of workers of the `processes` executor (default: all cores)",
+        type=int,
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        dest="seed",
+        help="seed of the draws (random if not given)",
+        type=int,
+        default=None,
+    )
+
+    return parser.parse_args()
+
+
+def proposal_bounds(config: Dict[str, Any]) -> Tuple[np.ndarray, np.ndarray]:
+    """Lower & upper limits of the uniform draws of P, m1, m2 & ω, from `initialGuess`"""
+
+    guess = config["MCMC"]["initialGuess"]
+    lo = np.array([guess[f"{name}_lo"] for name in UNIFORM_PARAMETERS], dtype=float)
+    hi = np.array([guess[f"{name}_hi"] for name in UNIFORM_PARAMETERS], dtype=float)
+
+    if np.any(hi <= lo):
+        raise ValueError("every range of `initialGuess` must have its upper limit above the lower")
+
+    return lo, hi
+
+
+def draw_binaries(n: int, lo: np.ndarray, hi: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Draw pre-SN binaries, uniform inside [`lo`, `hi`] with an isotropic kick
+
+    Returns
+    -------
+    params : `np.ndarray`
+        Array of shape (n, 6) with P, m1, m2, ω, θ & φ, in the order of the MCMC samples
+    """
+
+    params = np.empty((n, 6))
+    params[:, :4] = rng.uniform(lo, hi, size=(n, 4))
+    params[:, 4] = np.arccos(rng.uniform(-1, 1, size=n))
+    params[:, 5] = rng.uniform(0, 2 * np.pi, size=n)
+
+    return params
+
+
+def evaluate_block(
+    task: Tuple[int, np.random.SeedSequence, np.ndarray, np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Draw a block of binaries & weight them with the likelihood context of this process
+
+    Each block has its own seed, so that its draws do not depend on which process evaluates it
+
+    Parameters
+    ----------
+    task : `Tuple`
+        Number of draws, their seed and the limits of `draw_binaries`
+
+    Returns
+    -------
+    samples_pre, samples_post : `np.ndarray`
+        Pre-CC & post-CC rows of draws with non-zero weight (see `tables.stack_rows`)
+
+    log_weights : `np.ndarray`
+        Logarithm of the weight of each of them
+    """
+
+    n, seed, lo, hi = task
+
+    samples = draw_binaries(n, lo, hi, np.random.default_rng(seed))
+    observables = likelihood.evaluate_batch(samples, **likelihood.get_context())
+
+    # rows of the draws with finite likelihood, in the layout of the processed data
+    samples_pre, samples_post = stack_rows(samples, observables)
+
+    # the isotropic prior on the kick direction is already the density of the draws
+    keep = np.isfinite(observables["log_L"])
+    log_weights = observables["log_L"][keep] - np.log(np.sin(observables["theta"][keep]))
+
+    return samples_pre, samples_post, log_weights
+
+
+def log_sum_exp(values: np.ndarray) -> float:
+    """Logarithm of the sum of the exponential of `values`, -inf for an empty array"""
+
+    if values.size == 0:
+        return -np.inf
+
+    top = np.max(values)
+
+    return float(top + np.log(np.sum(np.exp(values - top))))
+
+
+class WeightedReservoir:
+    """Fixed-size sample, with replacement, of a stream of weighted rows
+
+    Each slot of the reservoir holds one row drawn with probability proportional to its weight
+    among all the rows seen so far: when a block of rows with total weight W arrives, every slot is
+    replaced, with probability W over the total weight seen, by a row of the block drawn according
+    to its weight
+
+    Parameters
+    ----------
+    size : `int`
+        Number of rows of the sample
+
+    rng : `np.random.Generator`
+        Random generator of the replacements
+    """
+
+    def __init__(self, size: int, rng: np.random.Generator) -> None:
+        self.size = size
+        self.rng = rng
+        self.log_total = -np.inf
+        self.rows: Optional[List[np.ndarray]] = None
+
+    def add(self, rows: List[np.ndarray], log_weights: np.ndarray) -> None:
+        """Offer a block of rows (arrays with one row per element of `log_weights`)"""
+
+        log_block = log_sum_exp(log_weights)
+        if not np.isfinite(log_block):
+            return
+
+        self.log_total = np.logaddexp(self.log_total, log_block)
+        replaced = self.rng.uniform(size=self.size) < np.exp(log_block - self.log_total)
+        if self.rows is None:
+            self.rows = [np.empty((self.size, array.shape[1])) for array in rows]
+
+        idx = self.rng.choice(
+            log_weights.size, size=np.count_nonzero(replaced), p=np.exp(log_weights - log_block)
+        )
+        for sample, array in zip(self.rows, rows):
+            sample[replaced] = array[idx]
+
+
+def block_tasks(
+    draws: int, block_size: int, seeds: List[np.random.SeedSequence], lo: np.ndarray, hi: np.ndarray
+) -> List[Tuple[int, np.random.SeedSequence, np.ndarray, np.ndarray]]:
+    """Tasks of `evaluate_block` covering `draws` binaries"""
+
+    sizes = [min(block_size, draws - start) for start in range(0, draws, block_size)]
+
+    return [(size, seed, lo, hi) for size, seed in zip(sizes, seeds)]
+
+
+def evaluate_blocks(
+    pool: Any, tasks: List[Any], nworkers: int
+) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Results of `evaluate_block` in the order of the tasks
+
+    Only `nworkers` blocks are sent to the pool at a time, so that results waiting to be written
+    never take more memory than that number of blocks
+    """
+
+    remaining = iter(tasks)
+    while True:
+        wave = list(itertools.islice(remaining, nworkers))
+        if not wave:
+            return
+        if pool is None:
+            yield from map(evaluate_block, wave)
+        else:
+            yield from pool.map(evaluate_block, wave)
+
+
+def main(
+    config_file: str = "",
+    executor: str = "processes",
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Draw & weight pre-SN binaries, writing them to the `filename` of the `MonteCarlo` options
+
+    Parameters
+    ----------
+    config_file : `str`
+        Configuration filename
+
+    executor : `str`
+        Backend evaluating the blocks of draws, one of `executors.EXECUTORS`
+
+    workers : `int`
+        Number of workers of the `processes` executor, all cores if None
+
+    seed : `int`
+        Seed of the draws. If None, a random one is used and logged. Results only depend on it and
+        on `block_size`, not on the number of workers
+
+    Returns
+    -------
+    summary : `Dict[str, Any]`
+        Number of draws, draws with non-zero weight, Kish effective sample size of the weights, log
+        of their mean (the evidence of the model inside the ranges of `initialGuess`, up to the
+        volume of those ranges) and rows written
+    """
+
+    config = load_yaml(fname=config_file)
+
+    options = config.get("MonteCarlo", dict())
+    draws = int(options.get("draws", 1000000))
+    block_size = int(options.get("block_size", 100000))
+    resample = int(options.get("resample", 0))
+    filename = options.get("filename", "data/processed/montecarlo.h5")
+    if draws < 1 or block_size < 1 or resample < 0:
+        raise ValueError("`draws` & `block_size` must be positive, and `resample` not negative")
+
+    lo, hi = proposal_bounds(config)
+    likelihood.set_context(likelihood_context(config))
+
+    # one seed per block and one for the resampling
+    seed_sequence = np.random.SeedSequence(seed)
+    logger.info(f"seed of the draws: {seed_sequence.entropy}")
+    nblocks = -(-draws // block_size)
+    resample_seed, *block_seeds = seed_sequence.spawn(nblocks + 1)
+    tasks = block_tasks(draws, block_size, block_seeds, lo, hi)
+
+    reservoir = None
+    if resample > 0:
+        reservoir = WeightedReservoir(resample, np.random.default_rng(resample_seed))
+
+    nworkers = executors.number_of_workers(executor, workers)
+    config_files = {likelihood.DEFAULT_CONTEXT: str(Path(config_file).resolve())}
+    initargs: Tuple[Any, ...] = (config_files, None, None)
+    if executor != "mpi":
+        initargs = (config_files, logs.worker_initargs(), None)
+
+    logger.info(f"evaluating {draws} draws in {nblocks} blocks of up to {block_size}")
+    start = time.perf_counter()
+    log_sum, log_sum_sq, accepted = -np.inf, -np.inf, 0
+    Path(filename).parent.mkdir(parents=True, exist_ok=True)
+    with h5py.File(filename, "w") as f, executors.executor_pool(
+        executor, workers, initializer=init_worker, initargs=initargs
+    ) as pool:
+        tables = open_tables(
+            f, TABLES if reservoir is not None else WEIGHTED_TABLES, config["MCMC"].get("processed")
+        )
+
+        for k, (samples_pre, samples_post, log_weights) in enumerate(
+            evaluate_blocks(pool, tasks, nworkers)
+        ):
+            log_sum = np.logaddexp(log_sum, log_sum_exp(log_weights))
+            log_sum_sq = np.logaddexp(log_sum_sq, log_sum_exp(2 * log_weights))
+            accepted += log_weights.size
+
+            if reservoir is None:
+                tables["pre-cc"].append(samples_pre)
+                tables["post-cc"].append(samples_post)
+                tables["weights"].append(log_weights[:, np.newaxis])
+            else:
+                reservoir.add([samples_pre, samples_post], log_weights)
+
+            logger.debug(f"block {k + 1}/{nblocks} :: {log_weights.size} draws with weight > 0")
+
+        if reservoir is not None and reservoir.rows is not None:
+            tables["pre-cc"].append(reservoir.rows[0])
+            tables["post-cc"].append(reservoir.rows[1])
+
+        for table in tables.values():
+            table.close()
+
+        # Kish effective sample size, (Σw)² / Σw²
+        summary: Dict[str, Any] = {
+            "draws": draws,
+            "accepted": accepted,
+            "effective_samples": float(np.exp(2 * log_sum - log_sum_sq)) if accepted else 0.0,
+            "log_mean_weight": float(log_sum - np.log(draws)),
+            "rows": tables["pre-cc"].nrows,
+            "wall_time": time.perf_counter() - start,
+        }
+        f["mcmc"].attrs.update(summary)
+        f["mcmc"].attrs["resampled"] = reservoir is not None
+
+    logger.info(
+        f"{accepted} of {draws} draws with weight > 0 :: "
+        f"{summary['effective_samples']:.1f} effective samples, "
+        f"{summary['rows']} rows written to {filename} in {summary['wall_time']:.2f} sec"
+    )
+    if accepted and summary["effective_samples"] < resample:
+        logger.warning(
+            f"only {summary['effective_samples']:.1f} effective samples for {resample} resampled "
+            "rows, which repeat many draws. increase `draws` or narrow `initialGuess`"
+        )
+
+    return summary
+
+
+def cli() -> None:
+    """Entry point of the command line"""
+
+    args = parse_args()
+
+    # every MPI rank but 0 only evaluates blocks sent by rank 0
+    if args.executor == "mpi" and executors.mpi_rank() != 0:
+        executors.serve_mpi_workers()
+        sys.exit(0)
+
+    logs.start_logging(filename=".montecarlo.log", debug=args.debug)
+
+    try:
+        main(
+            config_file=args.config_file,
+            executor=args.executor,
+            workers=args.workers,
+            seed=args.seed,
+        )
+    except ValueError as exc:
+        logger.critical(f"could not run the Monte Carlo: {str(exc)}")
+        sys.exit(1)
+    finally:
+        if args.executor == "mpi":
+            executors.release_mpi_workers()
+
+        logs.stop_logging()
+
+
+if __name__ == "__main__":
+    cli()
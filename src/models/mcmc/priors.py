@@ -1,9 +1,18 @@
 """Prior distributions for different stellar parameters
 """
 
-from typing import List, Union
+from typing import Any, Dict, List, Mapping, Tuple, Union
 
-import scipy.stats as stats
+import numpy as np
+
+# name of the `StellarParameters` entries used by each one of the `priorDistributions` options
+PRIOR_PARAMETERS = {
+    "p_orb": "PORB",
+    "e": "ECC",
+    "m2": "M_2",
+    "v_sys": "VSYS",
+    "i": "INC",
+}
 
 
 def lg_prior_porb(
@@ -37,7 +46,7 @@ def lg_prior_porb(
 
     # load chosen distribution
     try:
-        distro = stats.__dict__.get(distribution)
+        distro = _scipy_distribution(distribution)
     except Exception as e:
         raise e
 
@@ -73,7 +82,7 @@ def lg_prior_ecc(
 
     # load chosen distribution
     try:
-        distro = stats.__dict__.get(distribution)
+        distro = _scipy_distribution(distribution)
     except Exception as e:
         raise e
 
@@ -109,7 +118,7 @@ def lg_prior_m2(
 
     # load chosen distribution
     try:
-        distro = stats.__dict__.get(distribution)
+        distro = _scipy_distribution(distribution)
     except Exception as e:
         raise e
 
@@ -145,7 +154,7 @@ def lg_prior_mbh(
 
     # load chosen distribution
     try:
-        distro = stats.__dict__.get(distribution)
+        distro = _scipy_distribution(distribution)
     except Exception as e:
         raise e
 
@@ -181,7 +190,7 @@ def lg_prior_inc(
 
     # load chosen distribution
     try:
-        distro = stats.__dict__.get(distribution)
+        distro = _scipy_distribution(distribution)
     except Exception as e:
         raise e
 
@@ -217,7 +226,7 @@ def lg_prior_vsys(
 
     # load chosen distribution
     try:
-        distro = stats.__dict__.get(distribution)
+        distro = _scipy_distribution(distribution)
     except Exception as e:
         raise e
 
@@ -241,3 +250,186 @@ def lg_prior_vsys(
         raise e
 
     return logpdf
+
+
+def _scipy_distribution(distribution: str) -> Any:
+    """Distribution of `scipy.stats` by name, None if there is none
+
+    `scipy.stats` takes about a second to import, so it is only imported when a distribution
+    without a closed-form evaluator (see `build_priors`) is used
+    """
+
+    import scipy.stats
+
+    return scipy.stats.__dict__.get(distribution)
+
+
+def _loc_scale(distribution: str, loc: float, scale: float) -> Tuple[float, float]:
+    """Values of `loc` and `scale` used by the `lg_prior_*` functions for a stellar parameter and
+    its error
+    """
+
+    # in case uniform, range is [X - X_ERR , X + X_ERR]
+    if distribution == "uniform":
+        loc, scale = loc - scale, loc + scale
+
+    if loc < 0:
+        loc = 0
+
+    return loc, scale
+
+
+class Prior:
+    """Frozen prior distribution in logarithm, built once from the name of a `scipy.stats`
+    distribution and the value (and error) of a stellar parameter of Cygnus X-1
+
+    Calling it gives the same result as the `lg_prior_*` functions, log(PDF_x) - log(PDF_x_fixed),
+    but the distribution lookup and the reference term log(PDF_x_fixed) are computed only once
+
+    Parameters
+    ----------
+    distribution : `str`
+        Name of statistical distribution. Accepts any value from `scipy.stats`
+
+    x_fixed : `float`
+        Value of the stellar parameter of Cygnus X-1
+
+    loc : `float`
+        Same as in the `lg_prior_*` functions, i.e., the value of the stellar parameter
+
+    scale : `float`
+        Same as in the `lg_prior_*` functions, i.e., the error of the stellar parameter
+    """
+
+    def __init__(self, distribution: str, x_fixed: float, loc: float, scale: float) -> None:
+        self.distribution = distribution
+        self.loc, self.scale = _loc_scale(distribution, loc, scale)
+        self._frozen: Any = None
+        self.lg_ref = float(self.logpdf(x_fixed))
+
+    @property
+    def frozen(self) -> Any:
+        """Frozen `scipy.stats` distribution, built the first time it is needed"""
+
+        if self._frozen is None:
+            import scipy.stats
+
+            distro = _scipy_distribution(self.distribution)
+            if not isinstance(distro, scipy.stats.rv_continuous):
+                raise ValueError(
+                    f"`{self.distribution}` is not a continuous distribution of `scipy.stats`"
+                )
+            self._frozen = distro(loc=self.loc, scale=self.scale)
+
+        return self._frozen
+
+    def logpdf(self, x: Any) -> Any:
+        """Logarithm of the PDF of the distribution"""
+
+        return self.frozen.logpdf(x)
+
+    def __call__(self, x: Any) -> Any:
+        return self.logpdf(x) - self.lg_ref
+
+
+class NormPrior(Prior):
+    """Gaussian prior in logarithm, with a closed-form expression for its evaluation"""
+
+    def __init__(self, distribution: str, x_fixed: float, loc: float, scale: float) -> None:
+        super().__init__(distribution, x_fixed, loc, scale)
+        # log(PDF_x) - log(PDF_x_fixed) = z_fixed^2 / 2 - z^2 / 2
+        self._offset = 0.5 * ((x_fixed - self.loc) / self.scale) ** 2
+
+    def logpdf(self, x: Any) -> Any:
+        return -0.5 * np.square((x - self.loc) / self.scale) - np.log(
+            self.scale * np.sqrt(2 * np.pi)
+        )
+
+    def __call__(self, x: Any) -> Any:
+        return self._offset - 0.5 * np.square((x - self.loc) / self.scale)
+
+
+class UniformPrior(Prior):
+    """Uniform prior in logarithm, with a closed-form expression for its evaluation"""
+
+    def __init__(self, distribution: str, x_fixed: float, loc: float, scale: float) -> None:
+        super().__init__(distribution, x_fixed, loc, scale)
+        # support is [loc, loc + scale], where log(PDF_x) = -log(scale)
+        self._upper = self.loc + self.scale
+        with np.errstate(invalid="ignore"):
+            self._inside = -np.log(self.scale) - self.lg_ref
+            self._outside = -np.inf - self.lg_ref
+
+    def logpdf(self, x: Any) -> Any:
+        if not self.scale > 0:
+            return np.full(np.shape(x), np.nan)[()]
+
+        inside = (x >= self.loc) & (x <= self.loc + self.scale)
+        logpdf = np.where(inside, -np.log(self.scale), -np.inf)
+        # NaN is propagated, as done by `scipy.stats`
+        return np.where(np.isnan(x), np.nan, logpdf)[()]
+
+    def __call__(self, x: Any) -> Any:
+        inside = np.where((x >= self.loc) & (x <= self._upper), self._inside, self._outside)
+        return np.where(np.isnan(x), np.nan, inside)
+
+
+# distributions that do not need to go through `scipy.stats` to be evaluated
+_CLOSED_FORM_PRIORS = {"norm": NormPrior, "uniform": UniformPrior}
+
+
+def build_priors(
+    distributions: Mapping[str, str], stellar_parameters: Mapping[str, float]
+) -> Dict[str, Prior]:
+    """Build the prior evaluators of the stellar parameters of Cygnus X-1
+
+    Parameters
+    ----------
+    distributions : `Mapping[str, str]`
+        Options of `priorDistributions` in the configuration file, i.e., name of the `scipy.stats`
+        distribution for each one of the keys of `PRIOR_PARAMETERS`
+
+    stellar_parameters : `Mapping[str, float]`
+        Options of `StellarParameters` in the configuration file
+
+    Returns
+    -------
+    priors : `Dict[str, Prior]`
+        Prior evaluators, with the same keys as `distributions`
+    """
+
+    priors = dict()
+    for key, parameter in PRIOR_PARAMETERS.items():
+        if key not in distributions:
+            continue
+
+        distribution = distributions[key]
+        value = stellar_parameters[parameter]
+        error = stellar_parameters[f"{parameter}_ERR"]
+        cls = _CLOSED_FORM_PRIORS.get(distribution, Prior)
+        priors[key] = cls(distribution, x_fixed=value, loc=value, scale=error)
+
+    return priors
+
+
+# priors already built by `get_priors`, keyed by the values they depend on
+_priors_cache: Dict[Tuple[Any, ...], Dict[str, Prior]] = dict()
+
+
+def get_priors(kwargs: Mapping[str, Any]) -> Dict[str, Prior]:
+    """Prior evaluators for a dictionary with both stellar parameters and prior distributions,
+    as the one sent to the likelihood. They are built only the first time they are requested
+
+    Contexts of the likelihood (see `likelihood.set_context`) carry their own evaluators, so this
+    is only the fallback of keyword arguments passed explicitly, e.g. by `make_dataset.py`
+    """
+
+    key = tuple(
+        (kwargs.get(name), kwargs.get(parameter), kwargs.get(f"{parameter}_ERR"))
+        for name, parameter in PRIOR_PARAMETERS.items()
+    )
+    if key not in _priors_cache:
+        distributions = {name: kwargs[name] for name in PRIOR_PARAMETERS if name in kwargs}
+        _priors_cache[key] = build_priors(distributions, kwargs)
+
+    return _priors_cache[key]
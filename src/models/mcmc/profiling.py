@@ -0,0 +1,286 @@
+"""Profiling of a run over all of its processes
+
+With `--profile`, the main process and every worker of the pool run `cProfile` and write their
+stats to `<name>-<host>-<pid>.prof` files in a profile directory next to the output of the run
+(see `profile_directory`). Pool workers write theirs when they exit, MPI workers when they stop
+serving. Once the run ends, the stats of every process are merged into:
+
+- `report.txt`: own time of each process, fraction of the time spent in each component (third
+  party package, or module of this repository) and table of the hottest functions
+- `merged.prof`: merged stats, to be read with `pstats` or `snakeviz`
+- `stacks.collapsed`: call stacks in the collapsed format of `flamegraph.pl` & `speedscope`.
+  `cProfile` only records who calls whom, so stacks are rebuilt from the call graph, splitting the
+  time of a function among its callers in proportion to the time of each call
+
+Without `--profile` no function of this module is called, so runs do not pay for it
+"""
+
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import contextlib
+import cProfile
+import glob
+import multiprocessing.util
+import os
+import pstats
+import socket
+import time
+from pathlib import Path
+
+# root of the code of this repository, whose time is reported by module
+_SRC = Path(__file__).resolve().parents[2]
+
+# profile of this process, None when it is not being profiled, with its file & process id
+_profile: Optional[cProfile.Profile] = None
+_filename = ""
+_pid = 0
+
+REPORT = "report.txt"
+MERGED = "merged.prof"
+STACKS = "stacks.collapsed"
+
+# deepest call stack written, and smallest time (in seconds) of a stack
+_MAX_DEPTH = 64
+_MIN_TIME = 1e-6
+
+
+def profile_directory(filename: str) -> str:
+    """Directory with the profiles of a run writing to a given HDF5 file"""
+
+    return str(Path(filename).with_suffix(".profile"))
+
+
+def reset(directory: str) -> None:
+    """Create a profile directory, deleting the profiles of a previous run in it"""
+
+    os.makedirs(directory, exist_ok=True)
+    for fname in glob.glob(os.path.join(directory, "*.prof")):
+        os.remove(fname)
+
+
+def start(directory: str, name: str = "worker") -> None:
+    """Profile this process until `stop` is called or the process exits
+
+    Parameters
+    ----------
+    directory : `str`
+        Profile directory of the run
+
+    name : `str`
+        Kind of process, first part of the name of its profile
+    """
+
+    global _profile, _filename, _pid
+
+    if _profile is not None:
+        if _pid == os.getpid():
+            return
+        # forked workers inherit the profile of their parent, which is not theirs to write
+        _profile.disable()
+
+    _pid = os.getpid()
+    _filename = os.path.join(directory, f"{name}-{socket.gethostname()}-{os.getpid()}.prof")
+    _profile = cProfile.Profile()
+
+    # pool workers leave through `os._exit`, which skips `atexit` but not these finalizers
+    multiprocessing.util.Finalize(None, stop, exitpriority=100)
+
+    _profile.enable()
+
+
+def stop() -> bool:
+    """Stop profiling this process and write its profile
+
+    Returns
+    -------
+    profiled : `bool`
+        Flag telling if this process was being profiled
+    """
+
+    global _profile
+
+    if _profile is None:
+        return False
+
+    _profile.disable()
+    _profile.dump_stats(_filename)
+    _profile = None
+
+    return True
+
+
+def init_worker(directory: str) -> None:
+    """Initializer of pool workers: profile them until they exit"""
+
+    start(directory, "worker")
+
+
+@contextlib.contextmanager
+def profiled(directory: Optional[str], name: str = "main") -> Iterator[None]:
+    """Profile this process inside a `with` block. Does nothing if `directory` is None"""
+
+    if directory is None:
+        yield
+        return
+
+    start(directory, name)
+    try:
+        yield
+    finally:
+        stop()
+
+
+def wait_for_profiles(directory: str, count: int, timeout: float = 60.0) -> int:
+    """Wait until a profile directory has `count` profiles, or `timeout` seconds. MPI workers
+    write theirs after the pool of rank 0 is closed
+
+    Returns
+    -------
+    found : `int`
+        Number of profiles in the directory
+    """
+
+    deadline = time.monotonic() + timeout
+    while True:
+        found = len(glob.glob(os.path.join(directory, "*.prof")))
+        if found >= count or time.monotonic() > deadline:
+            return found
+        time.sleep(0.1)
+
+
+def time_by_component(stats: pstats.Stats) -> Dict[str, float]:
+    """Fraction of the own time spent in each component: third-party package, module of this
+    repository, `builtins` or directory of other files. Largest first
+    """
+
+    times: Dict[str, float] = dict()
+    for (filename, _, _), (_, _, tottime, _, _) in stats.stats.items():  # type: ignore
+        parts = Path(filename).parts
+        packages = [k for k, part in enumerate(parts) if part in ("site-packages", "dist-packages")]
+        if packages and packages[-1] + 1 < len(parts):
+            # third-party code, by package
+            component = Path(parts[packages[-1] + 1]).stem
+        elif filename.startswith("~") or filename.startswith("<"):
+            component = "builtins"
+        elif _SRC in Path(filename).resolve().parents:
+            # code of this repository, by module
+            component = Path(filename).stem
+        else:
+            component = Path(filename).parent.name
+        times[component] = times.get(component, 0.0) + tottime
+
+    total = sum(times.values()) or 1.0
+
+    return {
+        component: t / total
+        for component, t in sorted(times.items(), key=lambda item: item[1], reverse=True)
+    }
+
+
+def _label(func: Tuple[str, int, str]) -> str:
+    filename, line, name = func
+    if filename == "~":
+        return name.replace(";", ",")
+
+    return f"{Path(filename).name}:{line}({name})".replace(";", ",")
+
+
+def collapsed_stacks(stats: pstats.Stats) -> Dict[str, float]:
+    """Own time of each call stack, rebuilt from the call graph of merged stats
+
+    Starting from functions that have no caller, the time given to a function is split into its
+    own time and the time of its callees, in the same proportions as in the whole run. Recursive
+    calls are cut
+
+    Returns
+    -------
+    stacks : `Dict[str, float]`
+        Seconds by stack, with the functions of a stack separated by `;`
+    """
+
+    entries = stats.stats  # type: ignore
+    callees: Dict[Tuple[str, int, str], List[Tuple[Tuple[str, int, str], float]]] = dict()
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, list()).append((func, edge[3]))
+
+    stacks: Dict[str, float] = dict()
+
+    def walk(func: Tuple[str, int, str], budget: float, path: Tuple[str, ...]) -> None:
+        _, _, tottime, cumtime, _ = entries[func]
+        scale = budget / cumtime if cumtime > 0 else 0.0
+        key = ";".join(path)
+        stacks[key] = stacks.get(key, 0.0) + tottime * scale
+
+        if len(path) >= _MAX_DEPTH:
+            return
+        for callee, time_in_callee in callees.get(func, list()):
+            label = _label(callee)
+            if label in path or time_in_callee * scale < _MIN_TIME:
+                continue
+            walk(callee, time_in_callee * scale, path + (label,))
+
+    for func, (_, _, _, cumtime, callers) in entries.items():
+        if not callers:
+            walk(func, cumtime, (_label(func),))
+
+    return {stack: t for stack, t in stacks.items() if t >= _MIN_TIME}
+
+
+def write_report(directory: str, top: int = 30) -> List[str]:
+    """Merge the profiles of a directory and write `REPORT`, `MERGED` & `STACKS` in it
+
+    Parameters
+    ----------
+    directory : `str`
+        Profile directory of the run
+
+    top : `int`
+        Number of functions of the table of hottest functions
+
+    Returns
+    -------
+    lines : `List[str]`
+        Own time of each process and time by component, the first lines of the report
+    """
+
+    profiles = sorted(glob.glob(os.path.join(directory, "*.prof")))
+    if not profiles:
+        return [f"no profiles found in `{directory}`"]
+
+    lines = [f"{len(profiles)} processes profiled"]
+    for fname in profiles:
+        total_tt = pstats.Stats(fname).total_tt  # type: ignore
+        lines.append(f"    {Path(fname).stem:<40s} {total_tt:10.3f} s")
+
+    stats = pstats.Stats(*profiles)
+    lines.append("time by component")
+    for component, fraction in time_by_component(stats).items():
+        if fraction < 0.001:
+            break
+        lines.append(f"    {component:<40s} {100 * fraction:6.1f}%")
+
+    total = stats.total_tt or 1.0  # type: ignore
+    hot = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)  # type: ignore
+    table = [
+        f"hottest functions (own time of {total:.3f} s over all processes)",
+        f"    {'own %':>6s} {'own s':>10s} {'cum s':>10s} {'calls':>10s}  function",
+    ]
+    for func, (_, ncalls, tottime, cumtime, _) in hot[:top]:
+        table.append(
+            f"    {100 * tottime / total:6.1f} {tottime:10.3f} {cumtime:10.3f} {ncalls:10d}  "
+            f"{pstats.func_std_string(func)}"
+        )
+
+    with open(os.path.join(directory, REPORT), "w") as f:
+        f.write("\n".join(lines + table) + "\n")
+
+    stats.dump_stats(os.path.join(directory, MERGED))
+
+    with open(os.path.join(directory, STACKS), "w") as f:
+        for stack, t in sorted(collapsed_stacks(stats).items()):
+            # flame graph tools expect integer counts, here microseconds
+            if round(t * 1e6) > 0:
+                f.write(f"{stack} {round(t * 1e6)}\n")
+
+    return lines
@@ -0,0 +1,552 @@
+"""Reweighting of a processed chain to a new set of priors, without running the sampler again
+
+The likelihood of `likelihood.py` only depends on the stellar parameters of Cygnus X-1 through the
+priors on the post-kick observables (P, e, m2, v_sys & i) and through the cut on m2. A chain
+sampled with one set of priors is therefore an importance sample of the posterior for any other
+set, with the log of the weight of each row being
+
+    log(weight) = Σ log(new prior) - Σ log(old prior)
+
+evaluated at once over the columns of the processed file. Rows outside of the new cut on m2 get
+no weight, and rows of a Monte Carlo file (see `montecarlo.py`) keep their own weight on top.
+
+The new priors are given as overrides of the base configuration (`--set`, same paths as in
+`sweep.py`) or as the grid file of a sweep, in which case every variant is reweighted. Each one is
+written in the same `mcmc/pre-cc` & `mcmc/post-cc` tables as the input, plus the log of the weight
+of each row (`mcmc/weights`), with the Kish effective sample size of the weights and the weighted
+summaries of every column as attributes of the `mcmc` group
+
+A small effective sample size means that the new posterior is far from the sampled one and that
+the chain must be run again. Options that change the kicks model (`M_BH`), or priors whose support
+is wider than the old one, can not be reweighted either, as the chain has no samples there
+"""
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import argparse
+import json
+import logging
+import sys
+from pathlib import Path
+
+import h5py
+import numpy as np
+import yaml
+
+from ...data.processed import ProcessedData
+from . import logs
+from .mcmc import load_yaml
+from .montecarlo import WEIGHTED_TABLES, log_sum_exp
+from .priors import NormPrior, Prior, UniformPrior, build_priors
+from .summaries import QUANTILES
+from .sweep import apply_overrides, expand_grid, load_grid
+from .tables import TABLES, open_tables
+
+logger = logging.getLogger("MCMC")
+
+# column of the processed file evaluated by each one of the `priorDistributions` options
+PRIOR_COLUMNS = {"p_orb": "p_post", "e": "e", "m2": "m2", "v_sys": "v_sys", "i": "inc"}
+
+# options of `StellarParameters` that change the kicks model, not only the priors
+MODEL_PARAMETERS = ("M_BH",)
+
+# effective sample size, as a fraction of the one of the input, below which a new run is
+# recommended
+MIN_ESS_FRACTION = 0.1
+
+# largest difference between the stored log_L and the one of the priors of the configuration
+SOURCE_TOLERANCE = 1e-3
+
+# file with the results of every variant of a grid
+MANIFEST = "reweight.json"
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        description="reweighting of a processed chain of Cygnus X-1 to a new set of priors",
+        epilog="@asimazbunzel on GitHub",
+    )
+    parser.add_argument(
+        "-C",
+        "--config-file",
+        dest="config_file",
+        help="path to configuration file in YAML format, the one the chain was sampled with",
+        type=str,
+    )
+    parser.add_argument(
+        "-s",
+        "--set",
+        action="append",
+        default=list(),
+        dest="overrides",
+        help="new value of an option, as PATH=VALUE (e.g. StellarParameters.VSYS_ERR=2.7)",
+        metavar="PATH=VALUE",
+    )
+    parser.add_argument(
+        "-G",
+        "--grid-file",
+        dest="grid_file",
+        default=None,
+        help="grid of a sweep (see `sweep.py`), reweighting every one of its variants",
+        type=str,
+    )
+    parser.add_argument(
+        "-i",
+        "--input",
+        dest="processed_file",
+        default=None,
+        help="processed file to reweight (default: `processed_filename` of the configuration)",
+        type=str,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        dest="output",
+        default=None,
+        help="reweighted file, without `--grid-file` (default: input with `.reweighted.h5`)",
+        type=str,
+    )
+    parser.add_argument(
+        "--min-ess",
+        dest="min_ess",
+        default=MIN_ESS_FRACTION,
+        help="fraction of the effective samples of the input below which a new run is asked for",
+        type=float,
+    )
+    parser.add_argument(
+        "-d",
+        "--debug",
+        action="store_true",
+        default=False,
+        dest="debug",
+        help="enable debug mode",
+    )
+
+    return parser.parse_args()
+
+
+def parse_overrides(items: Sequence[str]) -> Dict[str, Any]:
+    """Overrides of the command line, `PATH=VALUE` with the value read as YAML"""
+
+    overrides = dict()
+    for item in items:
+        path, sep, value = item.partition("=")
+        if not sep or not path:
+            raise ValueError(f"`{item}` is not of the form PATH=VALUE")
+        overrides[path.strip()] = yaml.safe_load(value)
+
+    return overrides
+
+
+def support(prior: Prior) -> Tuple[float, float]:
+    """Range of values with a finite log(PDF) of a prior"""
+
+    if isinstance(prior, NormPrior):
+        return -np.inf, np.inf
+    if isinstance(prior, UniformPrior):
+        return prior.loc, prior.loc + prior.scale
+
+    lo, hi = prior.frozen.support()
+
+    return float(lo), float(hi)
+
+
+def m2_cut(stellar_parameters: Dict[str, Any]) -> Tuple[float, float]:
+    """Range of m2 kept by the likelihood"""
+
+    m2, error = stellar_parameters["M_2"], stellar_parameters["M_2_ERR"]
+
+    return m2 - error, m2 + error
+
+
+def check_reweightable(config: Dict[str, Any], new_config: Dict[str, Any]) -> List[str]:
+    """Check that the posterior of a new configuration can be reached by reweighting
+
+    Raises
+    ------
+    ValueError
+        If an option of the kicks model changed
+
+    Returns
+    -------
+    problems : `List[str]`
+        Priors & cuts that give weight to values never sampled by the chain. Their posterior is
+        biased, as those values are missing from it
+    """
+
+    old_parameters, new_parameters = config["StellarParameters"], new_config["StellarParameters"]
+    for name in MODEL_PARAMETERS:
+        if old_parameters[name] != new_parameters[name]:
+            raise ValueError(f"`{name}` changes the kicks model, the chain must be run again")
+
+    old_priors = build_priors(config["MCMC"]["priorDistributions"], old_parameters)
+    new_priors = build_priors(new_config["MCMC"]["priorDistributions"], new_parameters)
+
+    problems = list()
+    for key in PRIOR_COLUMNS:
+        old_lo, old_hi = support(old_priors[key])
+        new_lo, new_hi = support(new_priors[key])
+        if new_lo < old_lo or new_hi > old_hi:
+            problems.append(
+                f"prior on `{key}` has support [{new_lo:g}, {new_hi:g}], wider than the sampled "
+                f"[{old_lo:g}, {old_hi:g}]"
+            )
+
+    old_lo, old_hi = m2_cut(old_parameters)
+    new_lo, new_hi = m2_cut(new_parameters)
+    if new_lo < old_lo or new_hi > old_hi:
+        problems.append(
+            f"cut on m2 is [{new_lo:g}, {new_hi:g}], wider than the sampled "
+            f"[{old_lo:g}, {old_hi:g}]"
+        )
+
+    return problems
+
+
+def log_priors(prior_set: Dict[str, Prior], observables: Dict[str, np.ndarray]) -> np.ndarray:
+    """Sum of the log of the priors of the likelihood over the columns of a processed file"""
+
+    log_p = np.zeros_like(observables["m2"], dtype=float)
+    for key, column in PRIOR_COLUMNS.items():
+        log_p += prior_set[key](observables[column])
+
+    return log_p
+
+
+def check_source(config: Dict[str, Any], data: ProcessedData) -> float:
+    """Largest difference between the stored log_L of a processed file and the one given by the
+    priors of a configuration, to catch files sampled with another one. Differences of `float32`
+    files are larger, as their columns were rounded after the likelihood was evaluated
+    """
+
+    prior_set = build_priors(config["MCMC"]["priorDistributions"], config["StellarParameters"])
+    observables = {column: data[column] for column in PRIOR_COLUMNS.values()}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        log_L = log_priors(prior_set, observables) + np.log(np.sin(data["theta"]))
+
+    return float(np.max(np.abs(log_L - data["log_L"]), initial=0.0))
+
+
+def log_weights(
+    config: Dict[str, Any],
+    new_config: Dict[str, Any],
+    observables: Dict[str, np.ndarray],
+    log_weight: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Log of the weight of each row of a processed file for the priors of a new configuration
+
+    Parameters
+    ----------
+    config : `Dict[str, Any]`
+        Configuration the chain was sampled with
+
+    new_config : `Dict[str, Any]`
+        Configuration with the new priors
+
+    observables : `Dict[str, np.ndarray]`
+        Columns of `PRIOR_COLUMNS` in the processed file
+
+    log_weight : `np.ndarray`
+        Log of the weight each row already has (Monte Carlo files), None for a chain
+
+    Returns
+    -------
+    log_weight : `np.ndarray`
+        Log of the new weight of each row, -inf for rows outside of the new cut on m2
+    """
+
+    old_priors = build_priors(config["MCMC"]["priorDistributions"], config["StellarParameters"])
+    new_priors = build_priors(
+        new_config["MCMC"]["priorDistributions"], new_config["StellarParameters"]
+    )
+
+    with np.errstate(invalid="ignore"):
+        log_w = log_priors(new_priors, observables) - log_priors(old_priors, observables)
+
+    lo, hi = m2_cut(new_config["StellarParameters"])
+    m2 = observables["m2"]
+    log_w[(m2 < lo) | (m2 > hi) | np.isnan(log_w)] = -np.inf
+
+    if log_weight is not None:
+        log_w += log_weight
+
+    return log_w
+
+
+def effective_sample_size(log_w: np.ndarray) -> Tuple[float, float]:
+    """Kish effective sample size of a set of weights, (Σw)² / Σw², and largest normalized weight"""
+
+    log_sum = log_sum_exp(log_w)
+    if not np.isfinite(log_sum):
+        return 0.0, 1.0
+
+    ess = float(np.exp(2 * log_sum - log_sum_exp(2 * log_w)))
+
+    return ess, float(np.exp(np.max(log_w) - log_sum))
+
+
+def weighted_summary(
+    values: np.ndarray, weights: np.ndarray, quantiles: Sequence[float] = QUANTILES
+) -> np.ndarray:
+    """Weighted mean, standard deviation & quantiles of a column. Weights must add up to one"""
+
+    mean = np.sum(weights * values)
+    std = np.sqrt(np.sum(weights * np.square(values - mean)))
+
+    # quantiles interpolated between the middle of the weight of each sorted value
+    order = np.argsort(values)
+    cdf = np.cumsum(weights[order]) - 0.5 * weights[order]
+    estimates = np.interp(quantiles, cdf, values[order])
+
+    return np.array([mean, std, *estimates])
+
+
+def reweight(
+    config: Dict[str, Any],
+    new_config: Dict[str, Any],
+    data: ProcessedData,
+    output: str,
+    overrides: Dict[str, Any],
+    min_ess: float = MIN_ESS_FRACTION,
+) -> Dict[str, Any]:
+    """Reweight a processed file to the priors of a new configuration and write the result
+
+    Parameters
+    ----------
+    config : `Dict[str, Any]`
+        Configuration the chain was sampled with
+
+    new_config : `Dict[str, Any]`
+        Configuration with the new priors
+
+    data : `ProcessedData`
+        Processed file of the chain
+
+    output : `str`
+        Name of the reweighted file
+
+    overrides : `Dict[str, Any]`
+        Options changed by `new_config`, stored with the results
+
+    min_ess : `float`
+        Fraction of the effective samples of the input below which a new run is asked for
+
+    Returns
+    -------
+    summary : `Dict[str, Any]`
+        Number of rows, Kish effective sample size & its fraction of the one of the input (the
+        number of rows, unless the input is weighted), largest normalized
+        weight, log of the ratio of the evidence of the new model to the old one, flag telling if
+        the chain must be run again, the problems found by `check_reweightable` and the weighted
+        mean, standard deviation & quantiles of every column, by `table/column`
+    """
+
+    problems = check_reweightable(config, new_config)
+    for problem in problems:
+        logger.warning(f"{problem}. run the chain again to sample it")
+
+    observables = {column: data[column] for column in PRIOR_COLUMNS.values()}
+    log_weight = data.column("weights", "log_weight") if "weights" in data.tables else None
+
+    log_w = log_weights(config, new_config, observables, log_weight)
+    ess, max_weight = effective_sample_size(log_w)
+    nrows = log_w.size
+
+    # effective samples & sum of the weights of the input, to compare the new weights with
+    if log_weight is None:
+        ess_old, log_sum_old = float(nrows), np.log(max(nrows, 1))
+    else:
+        ess_old, log_sum_old = effective_sample_size(log_weight)[0], log_sum_exp(log_weight)
+
+    summary: Dict[str, Any] = {
+        "samples": nrows,
+        "effective_samples": ess,
+        "ess_fraction": ess / ess_old if ess_old > 0 else 0.0,
+        "max_weight": max_weight,
+        "log_evidence_ratio": float(log_sum_exp(log_w) - log_sum_old),
+        "rerun": bool(problems) or ess < min_ess * ess_old,
+    }
+
+    # weighted summaries of every column
+    weights = np.exp(log_w - log_sum_exp(log_w)) if ess > 0 else np.zeros(nrows)
+    names, rows = list(), list()
+    columns = {table: data.columns(table) for table in TABLES if table in data.tables}
+    for table, names_in_table in columns.items():
+        for name in names_in_table:
+            names.append(f"{table}/{name}")
+            rows.append(weighted_summary(np.asarray(data.column(table, name), float), weights))
+    statistics = np.array(rows).reshape(len(names), 2 + len(QUANTILES))
+
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    with h5py.File(output, "w") as f:
+        tables = open_tables(
+            f,
+            dict(columns, weights=WEIGHTED_TABLES["weights"]),
+            new_config["MCMC"].get("processed"),
+        )
+        for table, names_in_table in columns.items():
+            tables[table].append(data.to_array(table, names_in_table))
+        tables["weights"].append(log_w[:, np.newaxis])
+        for table in tables.values():
+            table.close()
+
+        attrs = f["mcmc"].attrs
+        attrs.update(summary)
+        attrs["problems"] = json.dumps(problems)
+        attrs["source"] = str(Path(data.filename).resolve())
+        attrs["overrides"] = json.dumps(overrides)
+        # weighted summaries, one row per column of `summary_columns`
+        attrs["summary_columns"] = names
+        attrs["summary_probabilities"] = list(QUANTILES)
+        attrs["summary_mean"] = statistics[:, 0]
+        attrs["summary_std"] = statistics[:, 1]
+        attrs["summary_quantiles"] = statistics[:, 2:]
+
+    summary["problems"] = problems
+    summary["statistics"] = {name: values.tolist() for name, values in zip(names, statistics)}
+
+    return summary
+
+
+def format_summary(summary: Dict[str, Any], quantiles: Sequence[float] = QUANTILES) -> List[str]:
+    """Lines with the effective sample size and the weighted mean, standard deviation & quantiles
+    of each column of the summary of `reweight`
+    """
+
+    header = "".join(f"{f'q{100 * p:g}':>12}" for p in quantiles)
+    lines = [
+        f"{summary['effective_samples']:.1f} effective samples of {summary['samples']} rows "
+        f"({100 * summary['ess_fraction']:.1f}% of the input), "
+        f"largest weight {summary['max_weight']:.2e}",
+        f"{'column':<16}{'mean':>12}{'std':>12}{header}",
+    ]
+    for name, values in summary["statistics"].items():
+        lines.append(f"{name.split('/')[-1]:<16}" + "".join(f"{value:12.4g}" for value in values))
+    lines.extend(f"{problem}: run the chain again" for problem in summary["problems"])
+    if summary["rerun"] and not summary["problems"]:
+        lines.append("effective sample size too small: run the chain again with these priors")
+
+    return lines
+
+
+def reweighted_filename(filename: str) -> str:
+    """Default name of the reweighted file of a processed one"""
+
+    return str(Path(filename).with_suffix(".reweighted.h5"))
+
+
+def main(
+    config_file: str = "",
+    overrides: Optional[Dict[str, Any]] = None,
+    grid_file: Optional[str] = None,
+    processed_file: Optional[str] = None,
+    output: Optional[str] = None,
+    min_ess: float = MIN_ESS_FRACTION,
+) -> List[Dict[str, Any]]:
+    """Reweight the processed chain of a configuration to new priors
+
+    Parameters
+    ----------
+    config_file : `str`
+        Configuration filename, the one the chain was sampled with
+
+    overrides : `Dict[str, Any]`
+        New values by path inside the configuration (see `sweep.apply_overrides`)
+
+    grid_file : `str`
+        Grid of a sweep. If given, every one of its variants is reweighted (on top of `overrides`)
+        and written to the output directory of the grid, with a `reweight.json` listing them
+
+    processed_file : `str`
+        Processed file, the `processed_filename` of the configuration if None
+
+    output : `str`
+        Reweighted file when there is no grid, the input with `.reweighted.h5` if None
+
+    min_ess : `float`
+        Fraction of the effective samples of the input below which a new run is asked for
+
+    Returns
+    -------
+    results : `List[Dict[str, Any]]`
+        Overrides, output file & summary of `reweight` of each variant
+    """
+
+    config = load_yaml(fname=config_file)
+    overrides = overrides or dict()
+    if processed_file is None:
+        processed_file = config["MCMC"].get("processed_filename", "data/processed/mcmc.h5")
+
+    if grid_file is None:
+        variants = [("reweighted", overrides, output or reweighted_filename(processed_file))]
+    else:
+        grid, output_dir = load_grid(grid_file)
+        variants = [
+            (f"variant-{k:03d}", dict(overrides, **values), str(output_dir / f"variant-{k:03d}.h5"))
+            for k, values in enumerate(expand_grid(grid))
+        ]
+        variants = [(name, values, reweighted_filename(fname)) for name, values, fname in variants]
+
+    results = list()
+    with ProcessedData(processed_file) as data:
+        difference = check_source(config, data)
+        if not difference < SOURCE_TOLERANCE:
+            logger.warning(
+                f"log_L of {processed_file} differs by up to {difference:.2e} from the one of the "
+                f"priors of {config_file}. was the chain sampled with another configuration?"
+            )
+
+        logger.info(f"reweighting {processed_file} to {len(variants)} set(s) of priors")
+        for name, values, fname in variants:
+            logger.info(f"{name} :: {values}")
+            summary = reweight(
+                config, apply_overrides(config, values), data, fname, values, min_ess
+            )
+            logger.info(
+                f"{name} :: {summary['effective_samples']:.1f} effective samples of "
+                f"{summary['samples']}, written to {fname}"
+            )
+            if summary["rerun"]:
+                logger.warning(f"{name} :: too far from the sampled posterior, run the chain again")
+
+            print(f"{name} {values} -> {fname}")
+            for line in format_summary(summary):
+                print(f"    {line}")
+            results.append({"name": name, "overrides": values, "filename": fname, **summary})
+
+    if grid_file is not None:
+        manifest = Path(results[0]["filename"]).parent / MANIFEST
+        with open(manifest, "w") as f:
+            json.dump({"input": processed_file, "variants": results}, f, indent=2)
+        logger.info(f"results of every variant written to {manifest}")
+
+    return results
+
+
+def cli() -> None:
+    """Entry point of the command line"""
+
+    args = parse_args()
+
+    logs.start_logging(filename=".reweight.log", debug=args.debug)
+
+    try:
+        main(
+            config_file=args.config_file,
+            overrides=parse_overrides(args.overrides),
+            grid_file=args.grid_file,
+            processed_file=args.processed_file,
+            output=args.output,
+            min_ess=args.min_ess,
+        )
+    except ValueError as exc:
+        logger.critical(f"could not reweight the chain: {str(exc)}")
+        sys.exit(1)
+    finally:
+        logs.stop_logging()
+
+
+if __name__ == "__main__":
+    cli()
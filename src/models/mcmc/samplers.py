@@ -0,0 +1,355 @@
+"""Proposals & parallel tempering of the MCMC sampler
+
+The kick angles make the posterior multimodal, where the default stretch move of `emcee` mixes
+slowly. Two options of the configuration help with that:
+
+- `moves`: a weighted mixture of the proposals of `emcee` (see `MOVES`), e.g. differential evolution
+  moves which can jump between modes
+- `tempering`: a ladder of ensembles sampling the likelihood raised to 1 / T, which exchange
+  walkers with their neighbours in temperature (see `TemperedEnsemble`)
+
+The efficiency of a sampler is measured by its effective samples per CPU-second (see
+`sampling_efficiency`)
+"""
+
+from __future__ import annotations
+
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import logging
+
+import numpy as np
+
+from .convergence import STEPS_PER_TAU
+
+if TYPE_CHECKING:
+    import emcee
+
+logger = logging.getLogger(__name__)
+
+# largest number of stored steps read to estimate the effective samples of a run
+_EFFICIENCY_ROWS = 10000
+
+# name of the class in `emcee.moves` of each move
+MOVES = {
+    "stretch": "StretchMove",
+    "walk": "WalkMove",
+    "de": "DEMove",
+    "desnooker": "DESnookerMove",
+    "kde": "KDEMove",
+}
+
+
+def build_moves(
+    options: Optional[Sequence[Dict[str, Any]]]
+) -> Optional[List[Tuple[emcee.moves.Move, float]]]:
+    """Mixture of proposals given by the `moves` option of the configuration
+
+    Parameters
+    ----------
+    options : `Sequence[Dict[str, Any]]`
+        Each element has the name of a move (`move`, one of `MOVES`), its probability of being
+        chosen at each step (`weight`, normalised by `emcee`) and keyword arguments of the move
+
+    Returns
+    -------
+    moves : `List[Tuple[emcee.moves.Move, float]]`
+        Moves & their weights, for `emcee.EnsembleSampler`. None for the default of `emcee`
+    """
+
+    if not options:
+        return None
+
+    import emcee
+
+    moves = list()
+    for option in options:
+        option = dict(option)
+        name = option.pop("move", None)
+        weight = float(option.pop("weight", 1.0))
+        if name not in MOVES:
+            raise ValueError(f"unknown move `{name}`, options are: {', '.join(MOVES)}")
+        if weight <= 0:
+            raise ValueError(f"weight of move `{name}` must be positive")
+        try:
+            moves.append((getattr(emcee.moves, MOVES[name])(**option), weight))
+        except TypeError as exc:
+            raise ValueError(f"wrong options of move `{name}`: {str(exc)}") from None
+
+    return moves
+
+
+def temperature_ladder(ntemps: int = 1, max_temperature: float = 20.0) -> np.ndarray:
+    """Inverse temperatures of a ladder, geometrically spaced between 1 & 1 / `max_temperature`"""
+
+    if ntemps < 1:
+        raise ValueError("number of temperatures must be at least 1")
+    if ntemps > 1 and max_temperature <= 1:
+        raise ValueError("maximum temperature must be larger than 1")
+
+    return np.power(float(max_temperature), -np.arange(ntemps) / max(ntemps - 1, 1))
+
+
+class Tempered:
+    """Log-probability of an ensemble of walkers at an inverse temperature `beta`
+
+    Parameters
+    ----------
+    fn : `Callable`
+        Function returning one tuple (log-probability & blobs) per walker
+
+    beta : `float`
+        Inverse temperature, scaling the log-probability
+    """
+
+    def __init__(self, fn: Callable[[np.ndarray], List[Any]], beta: float) -> None:
+        self.fn = fn
+        self.beta = beta
+
+    def __call__(self, params: np.ndarray) -> List[Any]:
+        return [(self.beta * result[0],) + tuple(result[1:]) for result in self.fn(params)]
+
+
+class TemperedEnsemble:
+    """Parallel tempering over a ladder of `emcee` ensembles
+
+    Ensemble `k` samples the likelihood raised to `betas[k]`, and every `swap_every` steps walkers
+    of neighbouring temperatures are exchanged with a Metropolis criterion (hottest pair first).
+    Only the chain of the cold ensemble (`betas[0]` = 1) is stored in its backend; the other ones
+    are kept in memory. This class exposes the same interface as `emcee.EnsembleSampler` used by
+    `mcmc.run_sampler` (`sample`, `iteration`, `acceptance_fraction`, `backend` and
+    `get_autocorr_time`), all of them referring to the cold ensemble
+
+    Parameters
+    ----------
+    samplers : `List[emcee.EnsembleSampler]`
+        One sampler per temperature, coldest first. The log-probability of each one must be scaled
+        by its inverse temperature (see `Tempered`)
+
+    betas : `np.ndarray`
+        Inverse temperatures of the samplers, starting at 1
+
+    swap_every : `int`
+        Number of steps between exchanges of walkers
+
+    seed : `np.random.SeedSequence / int`
+        Seed of the exchanges of walkers, random if None
+
+    Attributes
+    ----------
+    hot_states : `List[emcee.State]`
+        Current state of every ensemble but the cold one. If it is set before sampling (e.g. from a
+        checkpoint), hot ensembles continue from it; otherwise they start from the position of the
+        cold walkers
+    """
+
+    def __init__(
+        self,
+        samplers: List[emcee.EnsembleSampler],
+        betas: np.ndarray,
+        swap_every: int = 1,
+        seed: Optional[Union[np.random.SeedSequence, int]] = None,
+    ) -> None:
+        if len(samplers) != len(betas) or betas[0] != 1:
+            raise ValueError("there must be one sampler per temperature, starting at T = 1")
+
+        self.samplers = samplers
+        self.betas = np.asarray(betas, dtype=float)
+        self.swap_every = max(int(swap_every), 1)
+
+        self.hot_states: Optional[List[emcee.State]] = None
+
+        self._random = np.random.default_rng(seed)
+        self._swaps_accepted = np.zeros(len(betas) - 1)
+        self._swaps_proposed = np.zeros(len(betas) - 1)
+
+    @property
+    def backend(self) -> emcee.backends.Backend:
+        return self.samplers[0].backend
+
+    @property
+    def iteration(self) -> int:
+        return self.samplers[0].iteration
+
+    @property
+    def acceptance_fraction(self) -> np.ndarray:
+        return self.samplers[0].acceptance_fraction
+
+    @property
+    def swap_acceptance_fraction(self) -> np.ndarray:
+        """Fraction of accepted exchanges between each pair of neighbouring temperatures"""
+
+        with np.errstate(invalid="ignore"):
+            return self._swaps_accepted / self._swaps_proposed
+
+    def get_autocorr_time(self, **kwargs: Any) -> np.ndarray:
+        return self.samplers[0].get_autocorr_time(**kwargs)
+
+    def sample(
+        self,
+        initial: Union[np.ndarray, emcee.State],
+        iterations: int = 1,
+        progress: bool = False,
+    ) -> Iterator[emcee.State]:
+        """Advance every ensemble, yielding the state of the cold one after each step
+
+        Parameters
+        ----------
+        initial : `np.ndarray / emcee.State`
+            Initial position of the cold walkers, or state of a run being resumed
+
+        iterations : `int`
+            Number of steps to perform
+
+        progress : `bool`
+            Flag to show a progress bar
+
+        Yields
+        ------
+        state : `emcee.State`
+            State of the cold ensemble
+        """
+
+        import emcee
+
+        if self.hot_states is None:
+            coords = initial.coords if isinstance(initial, emcee.State) else initial
+            self.hot_states = [emcee.State(np.copy(coords)) for _ in self.samplers[1:]]
+
+        # hot ensembles are not stored, so their generators never end
+        hot_steps = [
+            sampler.sample(state, iterations=None, store=False)
+            for sampler, state in zip(self.samplers[1:], self.hot_states)
+        ]
+
+        for k, state in enumerate(
+            self.samplers[0].sample(initial, iterations=iterations, progress=progress)
+        ):
+            self.hot_states = [next(steps) for steps in hot_steps]
+
+            # `emcee` updates the yielded states in place and continues from them, so exchanges
+            # are seen by the next step of every ensemble
+            if (k + 1) % self.swap_every == 0:
+                self._swap([state] + self.hot_states)
+
+            yield state
+
+    def _swap(self, states: List[emcee.State]) -> None:
+        """Exchange walkers between neighbouring temperatures, hottest pair first"""
+
+        nwalkers = len(states[0].log_prob)
+        for k in range(len(states) - 1, 0, -1):
+            colder, hotter = states[k - 1], states[k]
+            beta_colder, beta_hotter = self.betas[k - 1], self.betas[k]
+
+            # each walker of the colder ensemble is paired with a random one of the hotter
+            pairs = self._random.permutation(nwalkers)
+            log_L_colder = colder.log_prob / beta_colder
+            log_L_hotter = hotter.log_prob[pairs] / beta_hotter
+
+            with np.errstate(invalid="ignore"):
+                log_ratio = (beta_colder - beta_hotter) * (log_L_hotter - log_L_colder)
+                accepted = np.log(self._random.uniform(size=nwalkers)) < log_ratio
+
+            i, j = np.flatnonzero(accepted), pairs[accepted]
+            colder.coords[i], hotter.coords[j] = hotter.coords[j], colder.coords[i].copy()
+            colder.log_prob[i] = beta_colder * log_L_hotter[accepted]
+            hotter.log_prob[j] = beta_hotter * log_L_colder[accepted]
+            if colder.blobs is not None:
+                colder.blobs[i], hotter.blobs[j] = hotter.blobs[j], colder.blobs[i].copy()
+
+            self._swaps_accepted[k - 1] += accepted.sum()
+            self._swaps_proposed[k - 1] += nwalkers
+
+
+def sampling_efficiency(
+    sampler: Union[emcee.EnsembleSampler, TemperedEnsemble],
+    start_step: int,
+    wall_time: float,
+    workers: int,
+    burn: int = 0,
+    tau: Optional[np.ndarray] = None,
+) -> Dict[str, Any]:
+    """Effective samples of the steps done by a run, per CPU-second
+
+    The effective sample size of each parameter is the number of samples of the run divided by its
+    integrated autocorrelation time τ, both of them only over the steps of this run after the
+    burn-in and over the walkers that moved. CPU-seconds are the wall time of the run times the
+    number of processes evaluating the likelihood. τ is estimated on at most `_EFFICIENCY_ROWS`
+    steps, and on a tenth of a previous estimate of τ per step if one is given
+
+    Parameters
+    ----------
+    sampler : `emcee.EnsembleSampler / TemperedEnsemble`
+        Sampler after running
+
+    start_step : `int`
+        Number of steps stored in the backend before the run
+
+    wall_time : `float`
+        Duration of the run, in seconds
+
+    workers : `int`
+        Number of processes evaluating the likelihood
+
+    burn : `int`
+        Steps discarded from the start of the chain
+
+    tau : `np.ndarray`
+        Previous estimate of τ (e.g. the one of `convergence.ConvergenceMonitor`), used to thin the
+        chain read
+
+    Returns
+    -------
+    summary : `Dict[str, Any]`
+        τ & effective samples of each parameter, smallest effective sample size (the one limiting
+        the precision of the posterior) and its value per CPU-second
+    """
+
+    import emcee
+
+    # only steps of this run after the burn-in (all of them if the chain is shorter than the
+    # burn-in), read `spacing` steps apart: no less than the thin of the backend (see
+    # `backends.BufferedHDFBackend`), nor than a fraction of the previous τ
+    discard = max(start_step, burn) if burn < sampler.iteration else start_step
+    thin = getattr(sampler.backend, "thin", 1)
+    spacing = max((sampler.iteration - discard) // _EFFICIENCY_ROWS, 1)
+    if tau is not None and np.any(np.isfinite(tau)):
+        spacing = max(spacing, int(np.nanmin(tau) // STEPS_PER_TAU))
+    spacing = max(spacing // thin, 1) * thin
+
+    # walkers that never moved (e.g. stuck where the likelihood is zero) add no effective samples
+    chain = sampler.backend.get_chain(discard=discard, thin=spacing)
+    steps, _, ndim = chain.shape[0] * spacing, chain.shape[1], chain.shape[2]
+    moved = np.any(chain != chain[0], axis=(0, 2))
+    tau = np.full(ndim, np.nan)
+    if np.any(moved):
+        tau = spacing * emcee.autocorr.integrated_time(chain[:, moved], tol=0)
+    effective_samples = np.count_nonzero(moved) * steps / tau
+    cpu_seconds = wall_time * workers
+
+    summary: Dict[str, Any] = {
+        "steps": int(steps),
+        "walkers_moved": int(np.count_nonzero(moved)),
+        "cpu_seconds": cpu_seconds,
+        "tau": [float(x) for x in tau],
+        "effective_samples": [float(x) for x in effective_samples],
+        "min_effective_samples": float(np.min(effective_samples)),
+        "effective_samples_per_cpu_second": float(np.min(effective_samples)) / cpu_seconds,
+    }
+    if isinstance(sampler, TemperedEnsemble):
+        summary["temperatures"] = [float(x) for x in 1 / sampler.betas]
+        summary["swap_acceptance_fraction"] = [float(x) for x in sampler.swap_acceptance_fraction]
+
+    return summary
@@ -0,0 +1,662 @@
+"""Streaming summaries of the posterior, updated at every step of the sampler
+
+While `mcmc.py` runs, the walkers of each step after the burn-in are added to summaries of the
+same `pre-cc` & `post-cc` columns as the processed file (see `tables.py`):
+
+- mean, standard deviation, minimum & maximum of each column, with Welford's online algorithm
+- quantiles of each column, from a sketch of compactors that keeps a few thousand weighted values
+  per column instead of the samples
+- histograms of each column and of each pair of columns of a table, over fixed bins, enough for a
+  corner plot. values outside the range of the bins are only counted
+
+Memory usage does not depend on the length of the chain. Summaries are written next to the backend
+(see `summaries_filename`) together with the checkpoints of the run, so that they can be read
+(`load_summaries`, or `python -m src.models.mcmc.summaries -C <config>`) while the run is in
+progress, without reading the chain
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import argparse
+import itertools
+import logging
+import os
+from pathlib import Path
+
+import h5py
+import numpy as np
+import yaml
+
+from . import transforms
+from .tables import TABLES, chain_thin, observables_from_blobs, read_chunk, stack_rows
+
+if TYPE_CHECKING:
+    import emcee
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.16, 0.5, 0.84)
+
+# range of the bins of each column, unless given by the `summaries` options of the configuration
+DEFAULT_RANGES = {
+    "p_pre": (0.0, 20.0),
+    "a_pre": (0.0, 150.0),
+    "m1_pre": (15.0, 55.0),
+    "m2": (25.0, 55.0),
+    "w": (0.0, 600.0),
+    "theta": (0.0, np.pi),
+    "phi": (0.0, 2 * np.pi),
+    "p_post": (0.0, 20.0),
+    "e": (0.0, 1.0),
+    "inc": (0.0, 180.0),
+    "v_sys": (0.0, 200.0),
+    "log_L": (-60.0, 0.0),
+}
+
+
+def summaries_filename(filename: str) -> str:
+    """Name of the summaries of a given HDF5 backend"""
+
+    return str(Path(filename).with_suffix(".summaries.h5"))
+
+
+class RunningMoments:
+    """Mean, variance & extremes of each column of a stream of rows (Welford's algorithm, merging
+    one block of rows at a time)
+
+    Parameters
+    ----------
+    ncols : `int`
+        Number of columns
+    """
+
+    def __init__(self, ncols: int) -> None:
+        self.count = 0
+        self.mean = np.zeros(ncols)
+        self.m2 = np.zeros(ncols)
+        self.min = np.full(ncols, np.inf)
+        self.max = np.full(ncols, -np.inf)
+
+    def update(self, rows: np.ndarray) -> None:
+        """Add an array of rows, with shape (n, ncols)"""
+
+        n = rows.shape[0]
+        if n == 0:
+            return
+
+        mean = rows.mean(axis=0)
+        m2 = ((rows - mean) ** 2).sum(axis=0)
+
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.count * n / total
+        self.count = total
+
+        np.minimum(self.min, rows.min(axis=0), out=self.min)
+        np.maximum(self.max, rows.max(axis=0), out=self.max)
+
+    @property
+    def std(self) -> np.ndarray:
+        """Sample standard deviation of each column"""
+
+        if self.count < 2:
+            return np.full(self.mean.shape, np.nan)
+
+        return np.sqrt(self.m2 / (self.count - 1))
+
+
+class QuantileSketch:
+    """Quantiles of each column of a stream of rows, with a sketch of compactors (Manku,
+    Rajagopalan & Lindsay 1998)
+
+    Values are kept in levels of at most `capacity` values per column, each value of level `l`
+    standing for 2^l values of the stream. A full level is sorted and every other value of it is
+    moved to the next level, starting alternately by the first and the second one. Memory grows
+    with the logarithm of the number of values, and the error in rank of the quantiles is of a
+    few values in `capacity`. All columns get the same number of values, so they are compacted at
+    once
+
+    Parameters
+    ----------
+    ncols : `int`
+        Number of columns
+
+    capacity : `int`
+        Maximum number of values per level & column
+    """
+
+    def __init__(self, ncols: int, capacity: int = 2048) -> None:
+        self.ncols = ncols
+        self.capacity = int(capacity)
+        self.levels: List[np.ndarray] = [np.empty((ncols, 0))]
+        self.offsets: List[int] = [0]
+
+    def update(self, rows: np.ndarray) -> None:
+        """Add an array of rows, with shape (n, ncols)"""
+
+        self.levels[0] = np.concatenate((self.levels[0], rows.T), axis=1)
+
+        for level in itertools.count():
+            if level == len(self.levels) or self.levels[level].shape[1] < self.capacity:
+                break
+
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty((self.ncols, 0)))
+                self.offsets.append(0)
+
+            values = np.sort(self.levels[level], axis=1)
+            # an odd value out stays in this level
+            size = values.shape[1] - values.shape[1] % 2
+            start = self.offsets[level]
+            promoted = values[:, start:size:2]
+            self.levels[level] = values[:, size:]
+            self.levels[level + 1] = np.concatenate((self.levels[level + 1], promoted), axis=1)
+            self.offsets[level] = 1 - self.offsets[level]
+
+    @property
+    def count(self) -> int:
+        """Number of values of each column added to the sketch"""
+
+        return sum(values.shape[1] << level for level, values in enumerate(self.levels))
+
+    def estimates(self, quantiles: Sequence[float] = QUANTILES) -> np.ndarray:
+        """Estimate of quantiles of each column, with shape (ncols, number of quantiles)"""
+
+        p = np.asarray(quantiles, dtype=float)
+        if self.count == 0:
+            return np.full((self.ncols, len(p)), np.nan)
+
+        values = np.concatenate(self.levels, axis=1)
+        weights = np.concatenate(
+            [np.full(values.shape[1], 2.0**level) for level, values in enumerate(self.levels)]
+        )
+
+        order = np.argsort(values, axis=1)
+        ranks = np.cumsum(weights[order], axis=1)
+        # first value whose rank reaches each quantile
+        idx = np.stack([np.searchsorted(r, p * r[-1]) for r in ranks])
+        idx = np.minimum(idx, values.shape[1] - 1)
+
+        return np.take_along_axis(np.take_along_axis(values, order, axis=1), idx, axis=1)
+
+
+class Histograms:
+    """Counts of each column, and of each pair of columns, of a stream of rows over fixed bins
+
+    Parameters
+    ----------
+    ranges : `Sequence[Tuple[float, float]]`
+        Lower & upper limit of the bins of each column
+
+    bins : `int`
+        Number of bins of each column
+    """
+
+    def __init__(self, ranges: Sequence[Tuple[float, float]], bins: int = 50) -> None:
+        self.bins = int(bins)
+        self.ranges = np.asarray(ranges, dtype=float)
+        self.pairs = list(itertools.combinations(range(len(self.ranges)), 2))
+
+        # columns of each pair, and offsets of each column & pair in the flattened counts, so that
+        # every histogram is updated by a single `np.bincount`
+        self._first, self._second = np.array(self.pairs, dtype=np.int64).reshape(-1, 2).T
+        self._offsets = np.arange(len(self.ranges)) * self.bins
+        self._offsets2d = np.arange(len(self.pairs)) * self.bins**2
+
+        self.counts = np.zeros((len(self.ranges), self.bins), dtype=np.int64)
+        self.counts2d = np.zeros((len(self.pairs), self.bins, self.bins), dtype=np.int64)
+        self.outside = np.zeros(len(self.ranges), dtype=np.int64)
+
+    def edges(self, k: int) -> np.ndarray:
+        """Edges of the bins of column `k`"""
+
+        return np.linspace(self.ranges[k, 0], self.ranges[k, 1], self.bins + 1)
+
+    def update(self, rows: np.ndarray) -> None:
+        """Add an array of rows, with shape (n, ncols)"""
+
+        lo, hi = self.ranges[:, 0], self.ranges[:, 1]
+        with np.errstate(invalid="ignore"):
+            inside = (rows >= lo) & (rows <= hi)
+            idx = np.floor((rows - lo) / (hi - lo) * self.bins)
+        # values at the upper limit go to the last bin
+        idx = np.clip(np.where(inside, idx, 0), 0, self.bins - 1).astype(np.int64)
+
+        self.outside += (~inside).sum(axis=0)
+        flat = (idx + self._offsets)[inside]
+        self.counts.reshape(-1)[...] += np.bincount(flat, minlength=self.counts.size)
+
+        a, b = self._first, self._second
+        keep = inside[:, a] & inside[:, b]
+        flat = (self._offsets2d + idx[:, a] * self.bins + idx[:, b])[keep]
+        self.counts2d.reshape(-1)[...] += np.bincount(flat, minlength=self.counts2d.size)
+
+
+class TableSummary:
+    """Moments, quantiles & histograms of the columns of one table
+
+    Parameters
+    ----------
+    columns : `Sequence[str]`
+        Names of the columns
+
+    ranges : `Mapping[str, Tuple[float, float]]`
+        Range of the bins of each column
+
+    bins : `int`
+        Number of bins of each column
+
+    sketch_size : `int`
+        Capacity of the levels of the quantile sketch
+    """
+
+    def __init__(
+        self,
+        columns: Sequence[str],
+        ranges: Mapping[str, Tuple[float, float]],
+        bins: int = 50,
+        sketch_size: int = 2048,
+    ) -> None:
+        self.columns = tuple(columns)
+        self.moments = RunningMoments(len(self.columns))
+        self.sketch = QuantileSketch(len(self.columns), sketch_size)
+        self.histograms = Histograms([ranges[name] for name in self.columns], bins)
+
+    def update(self, rows: np.ndarray) -> None:
+        """Add an array of rows, with shape (n, number of columns)"""
+
+        self.moments.update(rows)
+        self.sketch.update(rows)
+        self.histograms.update(rows)
+
+    def same_bins(self, other: "TableSummary") -> bool:
+        """Flag telling if another summary has the same columns, bins & sketch as this one"""
+
+        return (
+            self.columns == other.columns
+            and self.histograms.counts.shape == other.histograms.counts.shape
+            and np.array_equal(self.histograms.ranges, other.histograms.ranges)
+            and self.sketch.capacity == other.sketch.capacity
+        )
+
+    def save(self, g: h5py.Group) -> None:
+        """Write the state of the summaries into a group of a HDF5 file"""
+
+        g.attrs["columns"] = list(self.columns)
+        g.attrs["count"] = self.moments.count
+        g.attrs["sketch_size"] = self.sketch.capacity
+        g.attrs["sketch_offsets"] = self.sketch.offsets
+        for name, value in (
+            ("mean", self.moments.mean),
+            ("m2", self.moments.m2),
+            ("min", self.moments.min),
+            ("max", self.moments.max),
+            ("ranges", self.histograms.ranges),
+            ("counts", self.histograms.counts),
+            ("counts2d", self.histograms.counts2d),
+            ("outside", self.histograms.outside),
+        ):
+            g.create_dataset(name, data=value)
+
+        sketch = g.create_group("sketch")
+        for level, values in enumerate(self.sketch.levels):
+            sketch.create_dataset(str(level), data=values)
+
+    @classmethod
+    def load(cls, g: h5py.Group) -> "TableSummary":
+        """Summaries stored by `save`"""
+
+        columns = [str(name) for name in g.attrs["columns"]]
+        summary = cls(
+            columns,
+            dict(zip(columns, g["ranges"][...])),
+            g["counts"].shape[1],
+            int(g.attrs["sketch_size"]),
+        )
+        summary.moments.count = int(g.attrs["count"])
+        for target, name in (
+            (summary.moments.mean, "mean"),
+            (summary.moments.m2, "m2"),
+            (summary.moments.min, "min"),
+            (summary.moments.max, "max"),
+            (summary.histograms.counts, "counts"),
+            (summary.histograms.counts2d, "counts2d"),
+            (summary.histograms.outside, "outside"),
+        ):
+            target[...] = g[name][...]
+
+        summary.sketch.levels = [g["sketch"][str(level)][...] for level in range(len(g["sketch"]))]
+        summary.sketch.offsets = [int(offset) for offset in g.attrs["sketch_offsets"]]
+
+        return summary
+
+
+class PosteriorSummaries:
+    """Streaming summaries of the `pre-cc` & `post-cc` columns of the steps of a run after its
+    burn-in
+
+    Parameters
+    ----------
+    burn : `int`
+        Number of steps burned at the beginning of the chain, which are not summarized
+
+    ranges : `Mapping[str, Tuple[float, float]]`
+        Range of the bins of each column, `DEFAULT_RANGES` for missing ones
+
+    bins : `int`
+        Number of bins of the histograms of each column
+
+    sketch_size : `int`
+        Capacity of the levels of the quantile sketches
+
+    stellar_parameters : `Mapping[str, Any]`
+        Stellar parameters of Cygnus X-1, only given when walkers move in the sampled space of
+        `transforms.py`
+    """
+
+    def __init__(
+        self,
+        burn: int = 0,
+        ranges: Optional[Mapping[str, Tuple[float, float]]] = None,
+        bins: int = 50,
+        sketch_size: int = 2048,
+        stellar_parameters: Optional[Mapping[str, Any]] = None,
+    ) -> None:
+        self.burn = burn
+        self.iteration = 0
+        self.stellar_parameters = stellar_parameters
+
+        all_ranges = dict(DEFAULT_RANGES)
+        all_ranges.update({name: tuple(value) for name, value in (ranges or dict()).items()})
+        self.tables = {
+            name: TableSummary(columns, all_ranges, bins, sketch_size)
+            for name, columns in TABLES.items()
+        }
+
+    def update(self, state: emcee.State, iteration: int) -> None:
+        """Add the walkers of a step of the sampler. With parallel tempering, the state of the cold
+        ensemble is the one after the exchanges of the step, which `emcee` does not store
+
+        Parameters
+        ----------
+        state : `emcee.State`
+            State of the walkers after the step
+
+        iteration : `int`
+            Number of steps of the chain, including this one
+        """
+
+        self.iteration = iteration
+        if iteration <= self.burn:
+            return
+
+        coords, log_prob = state.coords, state.log_prob
+        if self.stellar_parameters is not None:
+            coords, log_jacobian = transforms.to_physical(coords, self.stellar_parameters)
+            with np.errstate(invalid="ignore"):
+                log_prob = transforms.add_jacobian(log_prob, -log_jacobian)
+
+        self.update_samples(coords, log_prob, state.blobs)
+
+    def update_samples(self, samples: np.ndarray, log_prob: np.ndarray, blobs: np.ndarray) -> None:
+        """Add samples in physical units, with their log-probability & blobs"""
+
+        samples_pre, samples_post = stack_rows(
+            samples, observables_from_blobs(samples, log_prob, blobs)
+        )
+        self.tables["pre-cc"].update(samples_pre)
+        self.tables["post-cc"].update(samples_post)
+
+    def rebuild(self, filename: str, iteration: int, chunk_steps: int = 1000) -> None:
+        """Summarize the first `iteration` steps of the chain stored in a backend, reading it in
+        chunks of `chunk_steps` rows. Used when resuming a run whose summaries were lost or are
+        not at the step of its checkpoint. Only the stored steps of a thinned chain are summarized
+        """
+
+        # rows of a thinned chain are `thin` steps apart
+        thin = chain_thin(filename)
+        first, last = self.burn // thin, iteration // thin
+        for start in range(first, last, chunk_steps):
+            samples, log_prob, blobs = read_chunk(filename, start, min(start + chunk_steps, last))
+            self.update_samples(samples, log_prob, blobs)
+
+        self.iteration = iteration
+
+    def _split_key(self, key: str) -> Tuple[str, int]:
+        """Table & index of a column, given as `table/name` or only by `name`"""
+
+        table, name = key.split("/", 1) if "/" in key else (None, key)
+        tables = [
+            candidate
+            for candidate, summary in self.tables.items()
+            if table in (None, candidate) and name in summary.columns
+        ]
+
+        if len(tables) != 1:
+            raise KeyError(f"no single column `{key}` in tables {list(self.tables)}")
+
+        return tables[0], self.tables[tables[0]].columns.index(name)
+
+    @property
+    def count(self) -> int:
+        """Number of samples summarized"""
+
+        return self.tables["pre-cc"].moments.count
+
+    def percentiles(self, quantiles: Sequence[float] = QUANTILES) -> Dict[str, np.ndarray]:
+        """Estimated quantiles (between 0 & 1) of each column, by `table/name`"""
+
+        return {
+            f"{table}/{name}": estimates
+            for table, s in self.tables.items()
+            for name, estimates in zip(s.columns, s.sketch.estimates(quantiles))
+        }
+
+    def moments(self) -> Dict[str, Tuple[float, float]]:
+        """Mean & standard deviation of each column, by `table/name`"""
+
+        return {
+            f"{table}/{name}": (mean, std)
+            for table, s in self.tables.items()
+            for name, mean, std in zip(s.columns, s.moments.mean, s.moments.std)
+        }
+
+    def histogram(self, key: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Counts & edges of the bins of a column, given as `table/name` or only by `name`"""
+
+        table, k = self._split_key(key)
+        histograms = self.tables[table].histograms
+
+        return histograms.counts[k].copy(), histograms.edges(k)
+
+    def histogram2d(self, x: str, y: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Counts & edges of the bins of a pair of columns of the same table, with the bins of `x`
+        along the first axis of the counts (as `np.histogram2d`)
+        """
+
+        table, a = self._split_key(x)
+        other, b = self._split_key(y)
+        if table != other or a == b:
+            raise KeyError(f"`{x}` & `{y}` are not two columns of the same table")
+
+        histograms = self.tables[table].histograms
+        counts = histograms.counts2d[histograms.pairs.index((min(a, b), max(a, b)))]
+        if a > b:
+            counts = counts.T
+
+        return counts.copy(), histograms.edges(a), histograms.edges(b)
+
+    def save(self, filename: str) -> None:
+        """Write the summaries, replacing the file at once so that readers never see a partial
+        one
+        """
+
+        tmp_filename = f"{filename}.tmp"
+        with h5py.File(tmp_filename, "w") as f:
+            f.attrs["iteration"] = self.iteration
+            f.attrs["burn"] = self.burn
+            for name, summary in self.tables.items():
+                summary.save(f.create_group(name))
+
+        os.replace(tmp_filename, filename)
+
+
+def load_summaries(filename: str) -> PosteriorSummaries:
+    """Summaries written by `PosteriorSummaries.save`
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the summaries file (see `summaries_filename`)
+
+    Returns
+    -------
+    summaries : `PosteriorSummaries`
+        Summaries at the step they were written. Walkers added to them are taken as physical
+    """
+
+    with h5py.File(filename, "r") as f:
+        summaries = PosteriorSummaries(burn=int(f.attrs["burn"]))
+        summaries.iteration = int(f.attrs["iteration"])
+        summaries.tables = {name: TableSummary.load(f[name]) for name in TABLES if name in f}
+
+    return summaries
+
+
+def build_summaries(
+    config: Dict[str, Any], backend: emcee.backends.HDFBackend
+) -> Optional[PosteriorSummaries]:
+    """Streaming summaries of the `summaries` options of the configuration, None if they are not
+    enabled. Summaries of a resumed run are loaded from its file when they are at the step the run
+    continues from, and rebuilt from the backend otherwise
+
+    Parameters
+    ----------
+    config : `Dict[str, Any]`
+        Configuration loaded from the YAML file
+
+    backend : `emcee.backends.HDFBackend`
+        Backend of the run
+
+    Returns
+    -------
+    summaries : `PosteriorSummaries`
+        Summaries of the steps of the backend
+    """
+
+    options = config["MCMC"].get("summaries", dict())
+    if not options.get("enabled", True):
+        return None
+
+    stellar_parameters = None
+    if config["MCMC"].get("reparameterize", False):
+        stellar_parameters = config["StellarParameters"]
+
+    summaries = PosteriorSummaries(
+        burn=config["MCMC"].get("burn", 0),
+        ranges=options.get("ranges"),
+        bins=options.get("bins", 50),
+        sketch_size=options.get("sketch_size", 2048),
+        stellar_parameters=stellar_parameters,
+    )
+
+    iteration = backend.iteration
+    if iteration == 0:
+        return summaries
+
+    filename = summaries_filename(backend.filename)
+    try:
+        stored = load_summaries(filename)
+    except (OSError, KeyError):
+        stored = None
+
+    if (
+        stored is not None
+        and stored.iteration == iteration
+        and stored.burn == summaries.burn
+        and stored.tables.keys() == summaries.tables.keys()
+        and all(stored.tables[name].same_bins(s) for name, s in summaries.tables.items())
+    ):
+        summaries.tables = stored.tables
+        summaries.iteration = iteration
+    else:
+        logger.info(f"no summaries at step {iteration} with these bins, rebuilding them")
+        summaries.rebuild(backend.filename, iteration, config["MCMC"].get("chunk_steps", 1000))
+
+    return summaries
+
+
+def format_summaries(
+    summaries: PosteriorSummaries, quantiles: Sequence[float] = QUANTILES
+) -> List[str]:
+    """Lines with the mean, standard deviation & quantiles of each column"""
+
+    header = "".join(f"{f'q{100 * p:g}':>12}" for p in quantiles)
+    lines = [
+        f"{summaries.count} samples after {summaries.iteration} steps (burn: {summaries.burn})",
+        f"{'column':<16}{'mean':>12}{'std':>12}{header}",
+    ]
+    moments = summaries.moments()
+    for key, estimates in summaries.percentiles(quantiles).items():
+        mean, std = moments[key]
+        values = "".join(f"{value:12.4g}" for value in (mean, std, *estimates))
+        lines.append(f"{key:<16}{values}")
+
+    return lines
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        description="summaries of the posterior of a MCMC run, written while it is in progress",
+        epilog="@asimazbunzel on GitHub",
+    )
+    parser.add_argument(
+        "-C",
+        "--config-file",
+        dest="config_file",
+        help="path to configuration file in YAML format",
+        type=str,
+    )
+
+    return parser.parse_args()
+
+
+def main(config_file: str = "") -> PosteriorSummaries:
+    """Print the summaries of the run of a configuration
+
+    Parameters
+    ----------
+    config_file : `str`
+        Configuration filename
+
+    Returns
+    -------
+    summaries : `PosteriorSummaries`
+        Summaries of the run
+    """
+
+    with open(config_file) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+
+    summaries = load_summaries(summaries_filename(config["MCMC"].get("filename")))
+    for line in format_summaries(summaries):
+        print(line)
+
+    return summaries
+
+
+def cli() -> None:
+    """Entry point of the command line"""
+
+    args = parse_args()
+
+    main(config_file=args.config_file)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,489 @@
+"""Sweep of MCMC runs over a grid of overrides of a base configuration
+
+Every combination of the overrides of a grid file is a variant, with its own configuration file,
+backend & checkpoint in the output directory of the grid. All variants are sampled at the same
+time over a single pool of workers, each one from its own thread. At each step a variant sends one
+batch of walkers per worker and waits for them; the pool serves tasks in the order they arrive, so
+every variant advances at the same pace. While a variant is busy with the bookkeeping of its step
+(proposals, writes to its backend), workers evaluate the walkers of the other ones, which keeps
+them busier than running the variants back to back
+
+A `manifest.json` file in the output directory lists the variants with their overrides, files and
+final state of their chains. Samplers of the variants draw their proposals from independent streams
+of random numbers, spawned from the seed of the sweep also stored in the manifest
+"""
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple, Union
+
+import argparse
+import concurrent.futures
+import copy
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import yaml
+
+from . import executors, likelihood, logs, summaries
+from .mcmc import (
+    convergence_monitor,
+    init_worker,
+    likelihood_context,
+    load_yaml,
+    make_sampler,
+    open_backend,
+    run_sampler,
+)
+
+if TYPE_CHECKING:
+    import emcee
+
+logger = logging.getLogger("MCMC")
+
+MANIFEST = "manifest.json"
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse command line arguments"""
+
+    parser = argparse.ArgumentParser(
+        description="run MCMC chains for a grid of configurations over a shared pool of workers",
+        epilog="@asimazbunzel on GitHub",
+    )
+    parser.add_argument(
+        "-C",
+        "--config-file",
+        dest="config_file",
+        help="path to base configuration file in YAML format",
+        type=str,
+    )
+    parser.add_argument(
+        "-G",
+        "--grid-file",
+        dest="grid_file",
+        help="path to YAML file with the grid of overrides of the base configuration",
+        type=str,
+    )
+    parser.add_argument(
+        "-d",
+        "--debug",
+        action="store_true",
+        default=False,
+        dest="debug",
+        help="enable debug mode",
+    )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        action="store_true",
+        default=False,
+        dest="resume",
+        help="resume the chains of a previous sweep instead of starting new ones",
+    )
+    parser.add_argument(
+        "-e",
+        "--executor",
+        choices=executors.EXECUTORS,
+        default="processes",
+        dest="executor",
+        help="backend evaluating the walkers (`mpi` needs to be launched with `mpirun`)",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        default=None,
+        dest="workers",
+        help="number of workers of the `processes` executor (default: all cores)",
+        type=int,
+    )
+    parser.add_argument(
+        "-s",
+        "--seed",
+        dest="seed",
+        help="seed of the samplers (random if not given)",
+        type=int,
+        default=None,
+    )
+
+    return parser.parse_args()
+
+
+def load_grid(filename: Union[str, Path]) -> Tuple[Dict[str, List[Any]], Path]:
+    """Load a grid file
+
+    Parameters
+    ----------
+    filename : `str / Path`
+        YAML file with the `overrides` (lists of values by path inside the configuration, with
+        keys separated by dots) and the `output_dir` of the sweep
+
+    Returns
+    -------
+    overrides : `Dict[str, List[Any]]`
+        Values of each overridden option
+
+    output_dir : `Path`
+        Directory with the files of the sweep
+    """
+
+    grid = load_yaml(filename)
+
+    overrides = grid.get("overrides")
+    if not overrides:
+        raise ValueError(f"no `overrides` found in `{filename}`")
+
+    output_dir = grid.get("output_dir")
+    if output_dir is None:
+        raise ValueError(f"no `output_dir` found in `{filename}`")
+
+    # a single value is the same as a list with only that value
+    overrides = {
+        key: values if isinstance(values, list) else [values] for key, values in overrides.items()
+    }
+
+    return overrides, Path(output_dir)
+
+
+def expand_grid(overrides: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """Every combination of the values of a grid of overrides, in the order of the grid file"""
+
+    keys = list(overrides)
+
+    return [dict(zip(keys, values)) for values in itertools.product(*overrides.values())]
+
+
+def apply_overrides(config: Dict[str, Any], overrides: Dict[str, Any]) -> Dict[str, Any]:
+    """Copy of a configuration with some of its options replaced
+
+    Parameters
+    ----------
+    config : `Dict[str, Any]`
+        Configuration loaded from the YAML file
+
+    overrides : `Dict[str, Any]`
+        New values by path inside the configuration, e.g. `StellarParameters.VSYS_ERR`. Options
+        must already exist in the configuration, to catch misspelled ones
+
+    Returns
+    -------
+    config : `Dict[str, Any]`
+        New configuration
+    """
+
+    config = copy.deepcopy(config)
+    for path, value in overrides.items():
+        *parents, key = path.split(".")
+        node = config
+        for parent in parents:
+            node = node.get(parent) if isinstance(node, dict) else None
+        if not isinstance(node, dict) or key not in node:
+            raise ValueError(f"`{path}` is not an option of the configuration")
+        node[key] = value
+
+    return config
+
+
+def make_variants(
+    base_config: Dict[str, Any],
+    overrides: Dict[str, List[Any]],
+    output_dir: Path,
+    seed_sequence: Optional[np.random.SeedSequence] = None,
+) -> List[Dict[str, Any]]:
+    """Configuration of each variant of a sweep, written to the output directory
+
+    Backend and processed filenames of each variant are placed in `output_dir`, and progress bars
+    are disabled
+
+    Parameters
+    ----------
+    base_config : `Dict[str, Any]`
+        Configuration shared by all variants
+
+    overrides : `Dict[str, List[Any]]`
+        Grid of overrides (see `load_grid`)
+
+    output_dir : `Path`
+        Directory with the files of the sweep
+
+    seed_sequence : `np.random.SeedSequence`
+        Seed of the sweep, from which the one of each variant is spawned. Random if None
+
+    Returns
+    -------
+    variants : `List[Dict[str, Any]]`
+        Name, overrides, configuration, configuration filename and seed of the sampler of each
+        variant
+    """
+
+    grid = expand_grid(overrides)
+    if seed_sequence is None:
+        seed_sequence = np.random.SeedSequence()
+    seeds = seed_sequence.spawn(len(grid))
+
+    variants = list()
+    for k, (values, seed) in enumerate(zip(grid, seeds)):
+        name = f"variant-{k:03d}"
+
+        config = apply_overrides(base_config, values)
+        config["MCMC"]["filename"] = str(output_dir / f"{name}.h5")
+        config["MCMC"]["processed_filename"] = str(output_dir / f"{name}.processed.h5")
+        config["MCMC"]["progress_bar"] = False
+
+        config_file = output_dir / f"{name}.yml"
+        with open(config_file, "w") as f:
+            yaml.safe_dump(config, f, sort_keys=False)
+
+        variants.append(
+            {
+                "name": name,
+                "overrides": values,
+                "config": config,
+                "config_file": str(config_file),
+                "seed": seed,
+            }
+        )
+
+    return variants
+
+
+def write_manifest(output_dir: Path, manifest: Dict[str, Any]) -> None:
+    """Atomically write the manifest of a sweep"""
+
+    filename = output_dir / MANIFEST
+    tmp_filename = output_dir / f"{MANIFEST}.tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    os.replace(tmp_filename, filename)
+
+
+def run_variant(
+    variant: Dict[str, Any],
+    backend: emcee.backends.HDFBackend,
+    initial: Union[np.ndarray, emcee.State],
+    chash: str,
+    pool: Any,
+    nbatches: int,
+) -> Dict[str, Any]:
+    """Run the chain of a variant, sending its walkers to a shared pool of workers
+
+    Parameters
+    ----------
+    variant : `Dict[str, Any]`
+        Variant given by `make_variants`
+
+    backend, initial, chash :
+        Output of `mcmc.open_backend` for the variant
+
+    pool : `multiprocessing.Pool / mpi4py.futures.MPIPoolExecutor / None`
+        Pool of workers shared by all variants
+
+    nbatches : `int`
+        Number of batches of walkers sent to the pool at each step
+
+    Returns
+    -------
+    summary : `Dict[str, Any]`
+        Number of steps done in this sweep, wall time taken and writes of the backend (see
+        `backends.BufferedHDFBackend.write_stats`)
+    """
+
+    config = variant["config"]
+    nsteps = config["MCMC"].get("steps")
+    start_step = backend.iteration
+
+    start = time.perf_counter()
+    if start_step < nsteps:
+        logger.info(f"{variant['name']} :: sampling {nsteps - start_step} steps")
+        run_sampler(
+            make_sampler(
+                config, backend, pool, nbatches, context=variant["name"], seed=variant["seed"]
+            ),
+            initial,
+            nsteps - start_step,
+            False,
+            None,
+            config["MCMC"].get("telemetry_every", 1000),
+            config["MCMC"].get("checkpoint_every", 1000),
+            chash,
+            convergence_monitor(config, backend),
+            summaries.build_summaries(config, backend),
+            config["MCMC"].get("summaries", dict()).get("write_every"),
+        )
+
+    return {
+        "new_steps": int(backend.iteration - start_step),
+        "wall_time": time.perf_counter() - start,
+        "backend": backend.write_stats(),
+    }
+
+
+def main(
+    config_file: str = "",
+    grid_file: str = "",
+    resume: bool = False,
+    executor: str = "processes",
+    workers: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> None:
+    """Run every variant of a sweep over one pool of workers
+
+    Parameters
+    ----------
+    config_file : `str`
+        Base configuration filename
+
+    grid_file : `str`
+        Grid of overrides filename (see `load_grid`)
+
+    resume : `bool`
+        Flag to continue the chains of a previous sweep, only doing their remaining steps
+
+    executor : `str`
+        Backend evaluating the walkers, one of `executors.EXECUTORS`
+
+    workers : `int`
+        Number of workers of the `processes` executor, all cores if None
+
+    seed : `int`
+        Seed of the samplers, random if None. Resumed chains continue from the random state
+        stored in their backend instead
+    """
+
+    logger.info("setting sweep of Markov Chain Monte Carlo simulations")
+
+    # one seed per variant, spawned from the one of the sweep
+    seed_sequence = np.random.SeedSequence(seed)
+    logger.info(f"seed of the samplers: {seed_sequence.entropy}")
+
+    base_config = load_yaml(fname=config_file)
+    try:
+        overrides, output_dir = load_grid(grid_file)
+        output_dir.mkdir(parents=True, exist_ok=True)
+        variants = make_variants(base_config, overrides, output_dir, seed_sequence)
+        for variant in variants:
+            likelihood.set_context(likelihood_context(variant["config"]), variant["name"])
+    except (OSError, ValueError) as exc:
+        logger.critical(f"could not set sweep: {str(exc)}")
+        sys.exit(1)
+
+    logger.info(f"{len(variants)} variants of `{config_file}` in `{output_dir}`")
+
+    # backends are opened before starting, so that a wrong one stops the sweep right away
+    runs = [open_backend(variant["config"], resume) for variant in variants]
+
+    nworkers = executors.number_of_workers(executor, workers)
+    manifest: Dict[str, Any] = {
+        "base_config": str(Path(config_file).resolve()),
+        "grid": str(Path(grid_file).resolve()),
+        "executor": executor,
+        "workers": nworkers,
+        "seed": seed_sequence.entropy,
+        "variants": [
+            {
+                "name": variant["name"],
+                "overrides": variant["overrides"],
+                "spawn_key": list(variant["seed"].spawn_key),
+                "config_file": variant["config_file"],
+                "filename": variant["config"]["MCMC"]["filename"],
+                "processed_filename": variant["config"]["MCMC"]["processed_filename"],
+                "status": "running",
+            }
+            for variant in variants
+        ],
+    }
+    write_manifest(output_dir, manifest)
+
+    # every worker builds the likelihood context of every variant once
+    config_files = {variant["name"]: variant["config_file"] for variant in variants}
+    initargs: Tuple[Any, ...] = (config_files, None, None)
+    if executor != "mpi":
+        initargs = (config_files, logs.worker_initargs(), None)
+
+    start = time.perf_counter()
+    with executors.executor_pool(
+        executor, workers, initializer=init_worker, initargs=initargs
+    ) as pool:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(variants)) as threads:
+            futures = [
+                threads.submit(run_variant, variant, *run, pool, nworkers)
+                for variant, run in zip(variants, runs)
+            ]
+
+            for variant, (backend, _, _), future, entry in zip(
+                variants, runs, futures, manifest["variants"]
+            ):
+                try:
+                    entry.update(future.result())
+                    entry["status"] = "done"
+                except Exception as exc:
+                    logger.critical(f"{variant['name']} :: failed: {str(exc)}")
+                    entry["status"] = "failed"
+                    entry["error"] = str(exc)
+
+                entry["steps"] = int(backend.iteration)
+                if backend.iteration > 0:
+                    entry["acceptance_fraction"] = float(
+                        np.mean(backend.accepted / backend.iteration)
+                    )
+
+    # throughput of the whole sweep
+    wall_time = time.perf_counter() - start
+    walker_evaluations = sum(
+        entry.get("new_steps", 0) * variant["config"]["MCMC"].get("walkers")
+        for variant, entry in zip(variants, manifest["variants"])
+    )
+    manifest["wall_time"] = wall_time
+    manifest["walker_evaluations"] = int(walker_evaluations)
+    manifest["walker_evaluations_per_sec"] = walker_evaluations / wall_time
+    write_manifest(output_dir, manifest)
+
+    logger.info(
+        f"sweep done in {wall_time:.1f} s :: {walker_evaluations / wall_time:.1f} walkers/s over "
+        f"{nworkers} {executor} workers"
+    )
+
+    if any(entry["status"] == "failed" for entry in manifest["variants"]):
+        sys.exit(1)
+
+
+def cli() -> None:
+    """Entry point of the command line"""
+
+    args = parse_args()
+
+    # every MPI rank but 0 only evaluates walkers sent by the samplers
+    if args.executor == "mpi" and executors.mpi_rank() != 0:
+        executors.serve_mpi_workers()
+        sys.exit(0)
+
+    logs.start_logging(filename=".sweep.log", debug=args.debug)
+
+    try:
+        main(
+            config_file=args.config_file,
+            grid_file=args.grid_file,
+            resume=args.resume,
+            executor=args.executor,
+            workers=args.workers,
+            seed=args.seed,
+        )
+
+    finally:
+        # MPI workers wait for rank 0 to open its pool, even if it ended before sampling
+        if args.executor == "mpi":
+            executors.release_mpi_workers()
+
+        # flush log records
+        logs.stop_logging()
+
+
+if __name__ == "__main__":
+    cli()
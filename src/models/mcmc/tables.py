@@ -0,0 +1,363 @@
+"""Tables of processed data sets & how they are stored
+
+A processed data set has one table per kind of values, `pre-cc` & `post-cc` (see `TABLES` for their
+columns), with one row per sample of the posterior with finite likelihood. This module has what
+both the MCMC code and `src/data` need to build & write them:
+
+- reads of a stored chain in chunks of steps (`chunk_bounds`, `read_chunk`)
+- rows of the tables from samples & their binary parameters (`observables_from_blobs`,
+  `stack_rows`)
+- writers of the tables (`open_tables`), with the storage options (layout, compression & precision)
+  also used by the chain written by `backends.py`
+
+Processed files are read with `src/data/processed.py`
+"""
+
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import os
+
+import h5py
+import numpy as np
+
+from .likelihood import BLOB_NAMES, fold_angles
+
+# names of the columns of each table, in the order of the rows given by `stack_rows`
+TABLES = {
+    "pre-cc": ("p_pre", "a_pre", "m1_pre", "m2", "w", "theta", "phi"),
+    "post-cc": ("p_post", "e", "inc", "v_sys", "log_L"),
+}
+
+LAYOUTS = ("columns", "table")
+CODECS = ("lzf", "gzip", "none")
+DTYPES = ("float64", "float32")
+
+# default storage of processed files, overridden by the `processed` options of the configuration
+DEFAULT_STORAGE = {"layout": "columns", "codec": "lzf", "dtype": "float64"}
+
+
+def storage_options(options: Optional[Mapping[str, Any]] = None) -> Dict[str, str]:
+    """Storage of a processed file, from the `processed` options of the configuration
+
+    Parameters
+    ----------
+    options : `Mapping[str, Any]`
+        `layout` (one of `LAYOUTS`), `codec` (one of `CODECS`) & `dtype` (one of `DTYPES`). Missing
+        ones take the value of `DEFAULT_STORAGE`
+
+    Returns
+    -------
+    storage : `Dict[str, str]`
+        Value of every option
+    """
+
+    storage = dict(DEFAULT_STORAGE)
+    storage.update(options or dict())
+
+    for key, choices in (("layout", LAYOUTS), ("codec", CODECS), ("dtype", DTYPES)):
+        if storage[key] not in choices:
+            raise ValueError(f"unknown {key} `{storage[key]}`, options are: {', '.join(choices)}")
+
+    return storage
+
+
+# rows per chunk of chunked datasets, and per block when copying columns into contiguous ones
+CHUNK_ROWS = 16384
+
+
+class TableWriter:
+    """Append rows to a table of a processed file
+
+    Rows are written as they arrive, so that memory usage does not depend on the size of the table.
+    Uncompressed columns are kept in a scratch file next to the processed one until `close`, which
+    copies them into contiguous datasets of their final length
+
+    Parameters
+    ----------
+    f : `h5py.File`
+        Processed file, open for writing
+
+    name : `str`
+        Name of the table, inside the `mcmc` group
+
+    columns : `Sequence[str]`
+        Names of the columns of the table
+
+    layout, codec, dtype : `str`
+        Storage of the table (see `storage_options`)
+    """
+
+    def __init__(
+        self,
+        f: h5py.File,
+        name: str,
+        columns: Sequence[str],
+        layout: str = "columns",
+        codec: str = "lzf",
+        dtype: str = "float64",
+    ) -> None:
+        self.f = f
+        self.name = f"mcmc/{name}"
+        self.columns = tuple(columns)
+        self.layout = layout
+        self.dtype = dtype
+        self.nrows = 0
+
+        compression = None if codec == "none" else codec
+        self._scratch: Optional[h5py.File] = None
+        self._scratch_filename = ""
+
+        if layout == "table":
+            ncols = len(self.columns)
+            table = f.create_dataset(
+                self.name,
+                (0, ncols),
+                maxshape=(None, ncols),
+                dtype=dtype,
+                chunks=(min(CHUNK_ROWS, max(CHUNK_ROWS // ncols, 1)), ncols),
+                compression=compression,
+            )
+            table.attrs["columns"] = list(self.columns)
+            self._datasets = [table]
+            return
+
+        group = f.create_group(self.name)
+        group.attrs["columns"] = list(self.columns)
+
+        # resizable datasets need chunks, so uncompressed ones are grown in a scratch file
+        target = group
+        if compression is None:
+            self._scratch_filename = f"{f.filename}.{name}.scratch"
+            self._scratch = h5py.File(self._scratch_filename, "w")
+            target = self._scratch
+
+        self._datasets = [
+            target.create_dataset(
+                column,
+                (0,),
+                maxshape=(None,),
+                dtype=dtype,
+                chunks=(CHUNK_ROWS,),
+                compression=compression,
+            )
+            for column in self.columns
+        ]
+
+    def append(self, rows: np.ndarray) -> None:
+        """Append an array of rows, with shape (n, number of columns)"""
+
+        rows = np.asarray(rows)
+        if rows.ndim != 2 or rows.shape[1] != len(self.columns):
+            raise ValueError(f"rows of `{self.name}` must have {len(self.columns)} columns")
+
+        start = self.nrows
+        self.nrows += rows.shape[0]
+        if self.layout == "table":
+            self._datasets[0].resize(self.nrows, axis=0)
+            self._datasets[0][start:] = rows
+        else:
+            for k, dataset in enumerate(self._datasets):
+                dataset.resize(self.nrows, axis=0)
+                dataset[start:] = rows[:, k]
+
+    def close(self) -> None:
+        """Finish the table, moving uncompressed columns into contiguous datasets"""
+
+        if self._scratch is None:
+            return
+
+        group = self.f[self.name]
+        for column, staged in zip(self.columns, self._datasets):
+            dataset = group.create_dataset(column, (self.nrows,), dtype=self.dtype)
+            for start in range(0, self.nrows, CHUNK_ROWS):
+                stop = min(start + CHUNK_ROWS, self.nrows)
+                dataset[start:stop] = staged[start:stop]
+
+        self._scratch.close()
+        os.remove(self._scratch_filename)
+        self._scratch = None
+
+
+def open_tables(
+    f: h5py.File,
+    tables: Mapping[str, Sequence[str]],
+    storage: Optional[Mapping[str, Any]] = None,
+) -> Dict[str, TableWriter]:
+    """Writers of the tables of a processed file
+
+    Parameters
+    ----------
+    f : `h5py.File`
+        Processed file, open for writing
+
+    tables : `Mapping[str, Sequence[str]]`
+        Names of the columns of each table, by name of the table (e.g. `TABLES`)
+
+    storage : `Mapping[str, Any]`
+        Storage options of `storage_options`
+
+    Returns
+    -------
+    writers : `Dict[str, TableWriter]`
+        Writer of each table, by name
+    """
+
+    storage = storage_options(storage)
+
+    return {name: TableWriter(f, name, columns, **storage) for name, columns in tables.items()}
+
+
+def chain_thin(filename: str, name: str = "mcmc") -> int:
+    """Steps between the stored rows of a chain: 1, unless it was thinned when written (see
+    `backends.BufferedHDFBackend`), in which case row `r` is the state after step `(r + 1) * thin`
+    """
+
+    with h5py.File(filename, "r") as f:
+        return int(f[name].attrs.get("thin", 1))
+
+
+def chunk_bounds(
+    filename: str, nburn: int, chunk_steps: int, name: str = "mcmc"
+) -> Tuple[List[Tuple[int, int]], int]:
+    """Split the burned MCMC chain stored in an `emcee.backends.HDFBackend` file in chunks of steps
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the HDF5 file with the chain
+
+    nburn : `int`
+        Number of steps to burn at the beginning of the chain
+
+    chunk_steps : `int`
+        Number of steps per chunk
+
+    name : `str`
+        Name of the group of the backend in the HDF5 file
+
+    Returns
+    -------
+    bounds : `List[Tuple[int, int]]`
+        First and last (excluded) stored row of each chunk. Rows are steps, unless the chain is
+        thinned (see `chain_thin`)
+
+    nwalkers : `int`
+        Number of walkers of the chain
+    """
+
+    with h5py.File(filename, "r") as f:
+        iteration = int(f[name].attrs["iteration"])
+        nwalkers = int(f[name].attrs["nwalkers"])
+
+    bounds = [
+        (start, min(start + chunk_steps, iteration))
+        for start in range(nburn // chain_thin(filename, name), iteration, chunk_steps)
+    ]
+
+    return bounds, nwalkers
+
+
+def read_chunk(
+    filename: str, start: int, stop: int, name: str = "mcmc"
+) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray]]:
+    """Read the steps [start, stop) of the chain without loading the rest of it in memory
+
+    Parameters
+    ----------
+    filename : `str`
+        Name of the HDF5 file with the chain
+
+    start, stop : `int`
+        First and last (excluded) step to read
+
+    name : `str`
+        Name of the group of the backend in the HDF5 file
+
+    Returns
+    -------
+    samples : `np.ndarray`
+        Flattened chunk of the chain, with shape (steps * walkers, dimension). It follows the
+        same order as `emcee.backends.HDFBackend.get_chain(flat=True)`
+
+    log_prob : `np.ndarray`
+        Log-probability of each sample
+
+    blobs : `np.ndarray`
+        Blobs of each sample (see `likelihood.BLOB_NAMES`), None if the chain has no blobs
+    """
+
+    with h5py.File(filename, "r") as f:
+        g = f[name]
+        samples = g["chain"][start:stop].reshape(-1, int(g.attrs["ndim"]))
+        log_prob = g["log_prob"][start:stop].reshape(-1)
+        blobs = None
+        if g.attrs.get("has_blobs", False):
+            blobs = g["blobs"][start:stop].reshape(-1)
+
+    return samples, log_prob, blobs
+
+
+def observables_from_blobs(
+    samples: np.ndarray, log_prob: np.ndarray, blobs: np.ndarray
+) -> Dict[str, np.ndarray]:
+    """Binary parameters of a set of MCMC samples, taken from the blobs stored during sampling
+
+    Gives the same values as `likelihood.evaluate_batch` without evaluating the kicks model
+
+    Parameters
+    ----------
+    samples : `np.ndarray`
+        Samples of the chain, with shape (n, 6)
+
+    log_prob : `np.ndarray`
+        Log-probability of each sample
+
+    blobs : `np.ndarray`
+        Structured array with the blobs of each sample
+
+    Returns
+    -------
+    observables : `Dict[str, np.ndarray]`
+        Same arrays as the ones given by `likelihood.evaluate_batch`, except for `a_post`
+    """
+
+    observables = {name: blobs[name] for name in BLOB_NAMES}
+    observables["theta"], observables["phi"] = fold_angles(samples[:, 4], samples[:, 5])
+    observables["inc"] = np.rad2deg(np.arccos(observables["cos_i"]))
+    observables["log_L"] = log_prob
+
+    return observables
+
+
+def stack_rows(
+    samples: np.ndarray, observables: Dict[str, np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Pre-CC & post-CC rows (see `TABLES`) of the samples with finite likelihood, from their
+    binary parameters (`observables_from_blobs` or `likelihood.evaluate_batch`)
+    """
+
+    # only keep samples with finite likelihood
+    keep = np.isfinite(observables["log_L"])
+
+    samples_pre = np.column_stack(
+        (
+            samples[keep, 0],
+            observables["a_pre"][keep],
+            samples[keep, 1],
+            samples[keep, 2],
+            samples[keep, 3],
+            observables["theta"][keep],
+            observables["phi"][keep],
+        )
+    )
+    samples_post = np.column_stack(
+        (
+            observables["p_post"][keep],
+            observables["e"][keep],
+            observables["inc"][keep],
+            observables["v_sys"][keep],
+            observables["log_L"][keep],
+        )
+    )
+
+    return samples_pre, samples_post
@@ -0,0 +1,291 @@
+"""Telemetry of the MCMC sampler
+
+Count how many likelihood evaluations are rejected by each one of the cuts of `likelihood.py` and
+how long they take. Counters live in shared memory, with one row per process (the main one and
+each one of the pool workers), so that workers update them without any locking and the main
+process aggregates them whenever a report is needed
+"""
+
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import json
+import multiprocessing
+import multiprocessing.sharedctypes
+import time
+
+import numpy as np
+
+# outcome of a likelihood evaluation. rejection codes follow the order of the cuts
+FINITE = 0
+M1_BELOW_MBH = 1
+W_NEGATIVE = 2
+P_NEGATIVE = 3
+ANGLES_OUTSIDE = 4
+P_ABOVE_LIMIT = 5
+W_ABOVE_LIMIT = 6
+M2_OUTSIDE = 7
+UNBOUND = 8
+ZERO_PRIOR = 9
+
+OUTCOMES = (
+    "finite",
+    "m1 < M_BH",
+    "ω < 0",
+    "p < 0",
+    "angles outside limits",
+    "p > 1000",
+    "ω > 600",
+    "m2 outside M_2 ± M_2_ERR",
+    "unbound after kick",
+    "zero prior",
+)
+
+# columns of a row of counters: one column per outcome, total evaluation time & bytes sent to or
+# received from the workers
+_TIME = len(OUTCOMES)
+_IPC = len(OUTCOMES) + 1
+_NCOLS = len(OUTCOMES) + 2
+
+# row of counters of this process, None when telemetry is not active
+_row: Optional[np.ndarray] = None
+
+
+def _counters_view(raw: Any, nslots: int) -> np.ndarray:
+    return np.frombuffer(raw, dtype=np.float64).reshape(nslots, _NCOLS)
+
+
+def _claim_row(raw: Any, nslots: int, next_slot: Any) -> None:
+    """Take the next free row of counters for this process"""
+
+    global _row
+
+    with next_slot.get_lock():
+        slot = next_slot.value
+        next_slot.value += 1
+
+    if slot >= nslots:
+        # more processes than expected, keep counting locally
+        _row = np.zeros(_NCOLS)
+    else:
+        _row = _counters_view(raw, nslots)[slot]
+
+
+def init_worker(raw: Any, nslots: int, next_slot: Any) -> None:
+    """Initializer of pool workers: activate telemetry on this process"""
+
+    _claim_row(raw, nslots, next_slot)
+
+
+def count(outcome: int) -> None:
+    """Count the outcome of a single likelihood evaluation"""
+
+    if _row is not None:
+        _row[outcome] += 1
+
+
+def count_many(outcomes: np.ndarray) -> None:
+    """Count the outcomes of an array of likelihood evaluations"""
+
+    if _row is not None:
+        _row[: len(OUTCOMES)] += np.bincount(outcomes, minlength=len(OUTCOMES))
+
+
+def count_ipc(nbytes: int) -> None:
+    """Count bytes exchanged with the workers"""
+
+    if _row is not None:
+        _row[_IPC] += nbytes
+
+
+def is_active() -> bool:
+    """Whether evaluations are being counted on this process"""
+
+    return _row is not None
+
+
+class Timed:
+    """Log-probability function accumulating its evaluation time in the telemetry counters
+
+    Parameters
+    ----------
+    fn : `Callable`
+        Function to evaluate. Must be defined at module level so that it can be sent to workers
+    """
+
+    def __init__(self, fn: Callable[..., Any]) -> None:
+        self.fn = fn
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        if _row is None:
+            return self.fn(*args, **kwargs)
+
+        start = time.perf_counter()
+        result = self.fn(*args, **kwargs)
+        _row[_TIME] += time.perf_counter() - start
+
+        return result
+
+
+class Telemetry:
+    """Shared counters & periodic reports of a MCMC run
+
+    Parameters
+    ----------
+    nslots : `int`
+        Maximum number of processes evaluating the likelihood (main process included)
+
+    filename : `str`
+        Name of the sidecar file where reports are appended, one JSON object per line
+
+    start_step : `int`
+        Number of steps already stored in the backend. If it is not zero, the run is a resumed one
+        and reports are appended to the ones of the previous run
+
+    executor : `str`
+        Name of the backend evaluating the likelihood (see `executors.py`)
+
+    workers : `int`
+        Number of processes of the backend, used to report its scaling
+    """
+
+    def __init__(
+        self,
+        nslots: int,
+        filename: str,
+        start_step: int = 0,
+        executor: str = "serial",
+        workers: int = 1,
+    ) -> None:
+        self.nslots = nslots
+        self.filename = filename
+        self.executor = executor
+        self.workers = workers
+
+        self._raw = multiprocessing.sharedctypes.RawArray("d", nslots * _NCOLS)
+        self._next_slot = multiprocessing.Value("i", 0)
+        self._counters = _counters_view(self._raw, nslots)
+
+        # the main process also evaluates the likelihood in vectorized mode
+        _claim_row(self._raw, self.nslots, self._next_slot)
+
+        # truncate sidecar file of a new run
+        if start_step == 0:
+            with open(self.filename, "w"):
+                pass
+
+        self._start = time.perf_counter()
+        self._last_time = self._start
+        self._last_step = start_step
+        self._last_evaluations = 0.0
+        self._last_busy = 0.0
+        self._last_ipc = 0.0
+
+    def initargs(self) -> Tuple[Any, int, Any]:
+        """Arguments for `init_worker` when creating a pool of workers"""
+
+        return self._raw, self.nslots, self._next_slot
+
+    def totals(self) -> np.ndarray:
+        """Counters summed over all processes"""
+
+        return self._counters.sum(axis=0)
+
+    def report(self, step: int, acceptance_fraction: np.ndarray) -> Dict[str, Any]:
+        """Summary of the run since the previous report, appended to the sidecar file
+
+        Scaling of the backend is given by the number of walkers evaluated per second and by its
+        parallel efficiency: the fraction of the wall time that its workers spent evaluating the
+        likelihood. MPI workers do not share counters with the main process, so evaluations,
+        outcomes & efficiency are only available for the other backends
+
+        Parameters
+        ----------
+        step : `int`
+            Number of steps done by the sampler
+
+        acceptance_fraction : `np.ndarray`
+            Acceptance fraction of each walker
+
+        Returns
+        -------
+        summary : `Dict[str, Any]`
+            Values reported
+        """
+
+        now = time.perf_counter()
+        totals = self.totals()
+        evaluations = float(totals[: len(OUTCOMES)].sum())
+
+        elapsed = now - self._last_time
+        new_evaluations = evaluations - self._last_evaluations
+        new_steps = step - self._last_step
+        new_busy = totals[_TIME] - self._last_busy
+        new_ipc = totals[_IPC] - self._last_ipc
+
+        efficiency = float("nan")
+        if self.executor != "mpi" and elapsed > 0:
+            efficiency = new_busy / (elapsed * self.workers)
+
+        summary = {
+            "step": int(step),
+            "wall_time": now - self._start,
+            "wall_time_per_step": elapsed / new_steps if new_steps > 0 else float("nan"),
+            "evaluations": int(evaluations),
+            "evaluations_per_sec": new_evaluations / elapsed if elapsed > 0 else float("nan"),
+            "mean_time_per_call": totals[_TIME] / evaluations if evaluations > 0 else float("nan"),
+            "executor": self.executor,
+            "workers": self.workers,
+            "walker_evaluations_per_sec": (
+                len(acceptance_fraction) * new_steps / elapsed if elapsed > 0 else float("nan")
+            ),
+            "parallel_efficiency": efficiency,
+            "ipc_bytes_per_step": new_ipc / new_steps if new_steps > 0 else float("nan"),
+            "acceptance_fraction": {
+                "mean": float(np.mean(acceptance_fraction)),
+                "min": float(np.min(acceptance_fraction)),
+                "max": float(np.max(acceptance_fraction)),
+                "walkers": [float(x) for x in acceptance_fraction],
+            },
+            "outcomes": {name: int(n) for name, n in zip(OUTCOMES, totals[: len(OUTCOMES)])},
+        }
+
+        self.write(summary)
+
+        self._last_time = now
+        self._last_step = step
+        self._last_evaluations = evaluations
+        self._last_busy = totals[_TIME]
+        self._last_ipc = totals[_IPC]
+
+        return summary
+
+    def write(self, record: Dict[str, Any]) -> None:
+        """Append a record to the sidecar file"""
+
+        with open(self.filename, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+def format_summary(summary: Dict[str, Any]) -> str:
+    """One-line description of a telemetry summary, for logging"""
+
+    evaluations = max(summary["evaluations"], 1)
+    rejections = ", ".join(
+        f"{name}: {100 * n / evaluations:.1f}%"
+        for name, n in summary["outcomes"].items()
+        if name != "finite" and n > 0
+    )
+
+    return (
+        f"step {summary['step']} :: {summary['workers']} {summary['executor']} workers, "
+        f"{summary['walker_evaluations_per_sec']:.1f} walkers/s, "
+        f"efficiency {100 * summary['parallel_efficiency']:.1f}%, "
+        f"{summary['ipc_bytes_per_step'] / 1024:.1f} kB/step IPC :: "
+        f"{summary['evaluations_per_sec']:.1f} evals/s, "
+        f"{1e6 * summary['mean_time_per_call']:.1f} μs/call, "
+        f"{summary['wall_time_per_step']:.3e} s/step, "
+        f"acceptance {summary['acceptance_fraction']['mean']:.3f} "
+        f"[{summary['acceptance_fraction']['min']:.3f}, "
+        f"{summary['acceptance_fraction']['max']:.3f}] :: "
+        f"rejected: {rejections or 'none'}"
+    )
@@ -0,0 +1,138 @@
+"""Unconstrained parameterization of the sampled space
+
+With the `reparameterize` option of the configuration, walkers move in a space where every
+real value is a valid binary, instead of proposing orbital periods, kicks or masses that the
+likelihood rejects right away:
+
+    u[0] = log(P)                                  P > 0
+    u[1] = log(m1 - M_BH)                          m1 > M_BH
+    u[2] = logit((m2 - m2_lo) / (m2_hi - m2_lo))   m2_lo < m2 < m2_hi
+    u[3] = log(ω)                                  ω > 0
+    u[4] = cos(θ), reflected at ±1                 0 < θ < π
+    u[5] = φ, periodic                             0 < φ < 2π
+
+where m2_lo = M_2 - M_2_ERR & m2_hi = M_2 + M_2_ERR
+
+The log-probability of a walker is the one of its physical parameters plus the log of the Jacobian
+of the map above. Walkers are stored in the backend in physical units (see
+`backends.PhysicalHDFBackend`), so that chains, and the data processed from them, look the same
+with both parameterizations
+"""
+
+from typing import Any, Mapping, Tuple
+
+import numpy as np
+
+# smallest distance to the boundaries of the physical space when mapping walkers to the sampled
+# one, so that initial walkers outside of it are moved just inside
+_EPS = 1e-10
+
+
+def _m2_limits(stellar_parameters: Mapping[str, Any]) -> Tuple[float, float]:
+    return (
+        stellar_parameters["M_2"] - stellar_parameters["M_2_ERR"],
+        stellar_parameters["M_2"] + stellar_parameters["M_2_ERR"],
+    )
+
+
+def to_physical(
+    params: np.ndarray, stellar_parameters: Mapping[str, Any]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Physical parameters of walkers in the sampled space, and the Jacobian of the map
+
+    Parameters
+    ----------
+    params : `np.ndarray`
+        Array of shape (n, 6) with walkers in the sampled space
+
+    stellar_parameters : `Mapping[str, Any]`
+        Stellar parameters of Cygnus X-1, setting the limits of m1 & m2
+
+    Returns
+    -------
+    physical : `np.ndarray`
+        Array of shape (n, 6) with P, m1, m2, ω, θ & φ
+
+    log_jacobian : `np.ndarray`
+        Logarithm of the absolute value of the determinant of the Jacobian, for each walker
+    """
+
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    log_p, log_dm1, logit_m2, log_w, cos_theta, phi = params.T
+
+    m2_lo, m2_hi = _m2_limits(stellar_parameters)
+
+    # cosine of θ reflected back into [-1, 1], which keeps the volume
+    cos_theta = (cos_theta + 1) % 4
+    cos_theta = np.where(cos_theta > 2, 3 - cos_theta, cos_theta - 1)
+
+    physical = np.column_stack(
+        (
+            np.exp(log_p),
+            stellar_parameters["M_BH"] + np.exp(log_dm1),
+            m2_lo + (m2_hi - m2_lo) / (1 + np.exp(-logit_m2)),
+            np.exp(log_w),
+            np.arccos(cos_theta),
+            phi % (2 * np.pi),
+        )
+    )
+
+    # d(logit^-1(x)) / dx = logit^-1(x) * (1 - logit^-1(x)), and |dθ / dcos(θ)| = 1 / sin(θ)
+    with np.errstate(divide="ignore"):
+        log_jacobian = (
+            log_p
+            + log_dm1
+            + np.log(m2_hi - m2_lo)
+            - np.logaddexp(0, -logit_m2)
+            - np.logaddexp(0, logit_m2)
+            + log_w
+            - 0.5 * np.log1p(-cos_theta * cos_theta)
+        )
+
+    return physical, log_jacobian
+
+
+def to_sampled(params: np.ndarray, stellar_parameters: Mapping[str, Any]) -> np.ndarray:
+    """Walkers in the sampled space for given physical parameters, inverse of `to_physical`
+
+    Parameters outside of the physical space (e.g. m1 < M_BH) are moved just inside of it
+
+    Parameters
+    ----------
+    params : `np.ndarray`
+        Array of shape (n, 6) with P, m1, m2, ω, θ & φ
+
+    stellar_parameters : `Mapping[str, Any]`
+        Stellar parameters of Cygnus X-1, setting the limits of m1 & m2
+
+    Returns
+    -------
+    sampled : `np.ndarray`
+        Array of shape (n, 6) with walkers in the sampled space
+    """
+
+    params = np.atleast_2d(np.asarray(params, dtype=float))
+    porb, m1, m2, w, theta, phi = params.T
+
+    m2_lo, m2_hi = _m2_limits(stellar_parameters)
+    m2_fraction = np.clip((m2 - m2_lo) / (m2_hi - m2_lo), _EPS, 1 - _EPS)
+
+    return np.column_stack(
+        (
+            np.log(np.maximum(porb, _EPS)),
+            np.log(np.maximum(m1 - stellar_parameters["M_BH"], _EPS)),
+            np.log(m2_fraction) - np.log1p(-m2_fraction),
+            np.log(np.maximum(w, _EPS)),
+            # cos(θ) does not change when θ is folded into [0, π] by the likelihood
+            np.cos(theta),
+            phi % (2 * np.pi),
+        )
+    )
+
+
+def add_jacobian(log_prob: np.ndarray, log_jacobian: np.ndarray) -> np.ndarray:
+    """Log-probability in the sampled space. Walkers with zero probability keep it, whatever the
+    value of the Jacobian at their position
+    """
+
+    return np.where(np.isfinite(log_prob), log_prob + log_jacobian, log_prob)
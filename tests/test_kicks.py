@@ -0,0 +1,15 @@
+"""test_kicks
+
+Check the in-tree kick kernel against `poskiorb`, as done by `make validate-kicks`
+"""
+
+import pytest
+from src.models.mcmc import kicks
+
+
+def test_numpy_kernel_matches_poskiorb():
+    pytest.importorskip("poskiorb")
+
+    max_rel_diff = kicks.validate(draws=10000, seed=0)
+
+    assert max(max_rel_diff.values()) <= kicks.RTOL, max_rel_diff
@@ -0,0 +1,29 @@
+"""test_likelihood
+
+Check that the vectorized likelihood gives exactly the same values as the scalar one
+"""
+
+from pathlib import Path
+
+import numpy as np
+from src.models.mcmc import initialization, likelihood
+from src.models.mcmc.mcmc import likelihood_context, load_yaml
+
+CONFIG_FILE = Path(__file__).resolve().parents[1] / "config" / "mcmc-config.yml"
+
+
+def test_batch_matches_scalar():
+    config = load_yaml(CONFIG_FILE)
+    config["MCMC"]["kick_kernel"] = "numpy"
+    context = likelihood_context(config)
+
+    # larger kicks than the initial guess, so that some binaries pass every cut of the likelihood
+    _, lo, hi = initialization.guess_bounds(config["MCMC"]["initialGuess"], {"w": [0.1, 1000.0]})
+    params = initialization.uniform_walkers(lo, hi, 10000, np.random.default_rng(0))
+
+    batch = np.array(likelihood.log_likelihood_batch(params, **context))
+    scalar = np.array([likelihood.log_likelihood(p, **context) for p in params])
+
+    assert np.any(np.isfinite(batch[:, 0]))
+    assert np.array_equal(batch[:, 0], scalar[:, 0], equal_nan=True)
+    assert np.array_equal(batch[:, 1:], scalar[:, 1:], equal_nan=True)